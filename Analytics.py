@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+Streaming trend and anomaly statistics of player counts.
+
+Every sample written by player_counts_insert updates its app's statistics
+in O(1): a fast and a slow EWMA, an exponentially weighted variance, the
+mean and variance of a rolling window of recent samples and a same hour
+last week baseline. The state of each app is packed into a small binary
+blob in app_trend, next to the scores Dashboard.py ranks on, so the
+dashboard never has to scan the history. The scores are written every cycle
+and the blobs, most of each row, only every save_interval seconds.
+"""
+
+import math
+import threading
+import time
+
+import numpy as np
+
+
+#Hours in a week, the resolution of the weekly baseline
+HOURS_PER_WEEK = 168
+
+#Length of a collection cycle's bucket in seconds
+BUCKET_SECONDS = 600
+
+#Positions of the scalars at the start of the packed state
+(LAST_BUCKET, EWMA_FAST, EWMA_SLOW, EWVAR, RING_POS, RING_COUNT, RING_SUM,
+ RING_SUMSQ, HOUR_SLOT, HOUR_SUM, HOUR_COUNT) = range(11)
+HEADER_LENGTH = 11
+
+
+#Function for getting the hour of the week of a bucket
+def hour_of_week(bucket):
+    """
+    Function for getting the hour of the week, Monday 00:00 being 0, of a
+    10 minute epoch bucket
+
+    Parameters
+    ----------
+    bucket : Integer bucket from DataFetch.time_to_bucket
+
+    Returns
+    -------
+    Integer from 0 to 167
+
+    """
+    #The epoch started on a Thursday, 72 hours after a Monday
+    return (bucket * BUCKET_SECONDS // 3600 + 72) % HOURS_PER_WEEK
+
+
+class AppTrend:
+    """
+    Streaming statistics of one app.
+
+    Parameters
+    ----------
+    window : Number of samples in the rolling window
+    state : Packed state from to_bytes, or None for a new app
+
+    """
+
+    def __init__(self, window, state=None):
+        self.window = window
+        if state is None:
+            self.header = np.zeros(HEADER_LENGTH)
+            self.header[LAST_BUCKET] = -1
+            self.header[HOUR_SLOT] = -1
+            self.ring = np.zeros(window, dtype=np.float32)
+            self.weekly = np.full(HOURS_PER_WEEK, np.nan, dtype=np.float32)
+        else:
+            self.header = np.frombuffer(state, dtype=np.float64,
+                                        count=HEADER_LENGTH).copy()
+            offset = HEADER_LENGTH * 8
+            self.ring = np.frombuffer(state, dtype=np.float32, count=window,
+                                      offset=offset).copy()
+            self.weekly = np.frombuffer(state, dtype=np.float32,
+                                        count=HOURS_PER_WEEK,
+                                        offset=offset + window * 4).copy()
+
+    def to_bytes(self):
+        return (self.header.tobytes() + self.ring.tobytes()
+                + self.weekly.tobytes())
+
+    @property
+    def last_bucket(self):
+        return int(self.header[LAST_BUCKET])
+
+    def update(self, bucket, count, fast_alpha, slow_alpha):
+        """
+        Add one sample to the statistics
+
+        Parameters
+        ----------
+        bucket : Bucket of the sample
+        count : Player count of the sample
+        fast_alpha : Weight of the newest sample in the fast EWMA
+        slow_alpha : Weight of the newest sample in the slow EWMA and
+            variance
+
+        Returns
+        -------
+        Same hour last week baseline, NaN if there isn't one yet
+
+        """
+        header = self.header
+        count = float(count)
+
+        #Moving averages, started at the first sample
+        if header[LAST_BUCKET] < 0:
+            header[EWMA_FAST] = count
+            header[EWMA_SLOW] = count
+        else:
+            header[EWMA_FAST] += fast_alpha * (count - header[EWMA_FAST])
+            diff = count - header[EWMA_SLOW]
+            increment = slow_alpha * diff
+            header[EWMA_SLOW] += increment
+            header[EWVAR] = (1 - slow_alpha) * (header[EWVAR]
+                                                + diff * increment)
+        header[LAST_BUCKET] = bucket
+
+        #Rolling window with running sums, dropping the oldest sample
+        position = int(header[RING_POS])
+        if header[RING_COUNT] == self.window:
+            old = float(self.ring[position])
+            header[RING_SUM] -= old
+            header[RING_SUMSQ] -= old * old
+        else:
+            header[RING_COUNT] += 1
+        self.ring[position] = count
+        header[RING_SUM] += count
+        header[RING_SUMSQ] += count * count
+        header[RING_POS] = (position + 1) % self.window
+
+        #Resum once per lap so float error can't build up
+        if header[RING_POS] == 0:
+            header[RING_SUM] = float(self.ring.sum(dtype=np.float64))
+            header[RING_SUMSQ] = float(np.square(self.ring, dtype=np.float64)
+                                       .sum())
+
+        #The weekly slot of an hour is only written once the hour is over,
+        #so during the hour it still holds last week's mean
+        slot = hour_of_week(bucket)
+        if slot != header[HOUR_SLOT]:
+            if header[HOUR_SLOT] >= 0 and header[HOUR_COUNT] > 0:
+                self.weekly[int(header[HOUR_SLOT])] = (header[HOUR_SUM]
+                                                       / header[HOUR_COUNT])
+            header[HOUR_SLOT] = slot
+            header[HOUR_SUM] = 0
+            header[HOUR_COUNT] = 0
+        header[HOUR_SUM] += count
+        header[HOUR_COUNT] += 1
+
+        return float(self.weekly[slot])
+
+    def rolling(self):
+        """
+        Mean and standard deviation of the rolling window
+
+        Returns
+        -------
+        Tuple of (mean, std)
+
+        """
+        n = self.header[RING_COUNT]
+        if n == 0:
+            return 0.0, 0.0
+        mean = self.header[RING_SUM] / n
+        variance = max(self.header[RING_SUMSQ] / n - mean * mean, 0.0)
+        return mean, math.sqrt(variance)
+
+
+class TrendEngine:
+    """
+    Keeps AppTrend statistics for every app and writes their scores to
+    app_trend. Use update as an insert hook of player_counts_insert.
+
+    Parameters
+    ----------
+    window : Number of samples in the rolling window
+    fast_alpha : Weight of the newest sample in the fast EWMA
+    slow_alpha : Weight of the newest sample in the slow EWMA and variance
+    min_players : Slow EWMA below which an app's trend score is damped, so
+        a game going from 2 to 6 players doesn't top the list
+    save_interval : Seconds between writes of the packed states. Samples
+        since the last write are lost from the statistics if the collector
+        dies
+
+    """
+
+    def __init__(self, window=36, fast_alpha=0.3, slow_alpha=0.02,
+                 min_players=100, save_interval=3600):
+        self.window = window
+        self.fast_alpha = fast_alpha
+        self.slow_alpha = slow_alpha
+        self.min_players = min_players
+        self.save_interval = save_interval
+        self.trends = {}
+        self.dirty = set()
+        self.last_save = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build an engine from the data_fetch section of config.yaml
+
+        Parameters
+        ----------
+        config : Dict of the full config
+
+        Returns
+        -------
+        TrendEngine
+
+        """
+        settings = config['data_fetch'].get('trends', {})
+        return cls(window=settings.get('window', 36),
+                   fast_alpha=settings.get('fast_alpha', 0.3),
+                   slow_alpha=settings.get('slow_alpha', 0.02),
+                   min_players=settings.get('min_players', 100),
+                   save_interval=settings.get('save_interval', 3600))
+
+    def _load(self, connector, app_ids):
+        #Only apps we haven't seen since starting are read from the table
+        missing = [app_id for app_id in app_ids if app_id not in self.trends]
+        if not missing:
+            return
+
+        cursor = connector.cursor()
+        missing_str = ', '.join(str(int(app_id)) for app_id in missing)
+        cursor.execute(f"""
+                       SELECT app_id, state
+                       FROM app_trend
+                       WHERE app_id IN ({missing_str});
+                       """)
+        #Apps first seen since the last state write have an empty one
+        for app_id, state in cursor:
+            self.trends[app_id] = AppTrend(self.window, bytes(state) or None)
+        cursor.close()
+
+        for app_id in missing:
+            if app_id not in self.trends:
+                self.trends[app_id] = AppTrend(self.window)
+
+    def update(self, rows, connector):
+        """
+        Update the statistics of every app in a batch of inserted samples
+        and write the new scores, and the packed states once save_interval
+        has passed since they were last written. Samples older than an
+        app's latest sample are ignored, so replaying a spool doesn't count
+        samples twice.
+
+        Parameters
+        ----------
+        rows : List of [app_id, timestamp, count, bucket]
+        connector : A connector to MySQL server
+
+        Returns
+        -------
+        None
+
+        """
+        if not rows:
+            return
+
+        with self._lock:
+            self._update(rows, connector)
+
+        return
+
+    def _update(self, rows, connector):
+        self._load(connector, {row[0] for row in rows})
+
+        updated = {}
+        for app_id, _, count, bucket in sorted(rows, key=lambda row: row[3]):
+            trend = self.trends[app_id]
+            if bucket <= trend.last_bucket:
+                continue
+
+            baseline = trend.update(bucket, count, self.fast_alpha,
+                                    self.slow_alpha)
+            mean, std = trend.rolling()
+            ewma_fast = trend.header[EWMA_FAST]
+            ewma_slow = trend.header[EWMA_SLOW]
+
+            #Growth of the fast average over the slow one
+            trend_score = ((ewma_fast - ewma_slow)
+                           / max(ewma_slow, self.min_players))
+
+            #How far below what we'd expect this sample is, in standard
+            #deviations. Last week's same hour is expected if we have it
+            expected = mean if math.isnan(baseline) else baseline
+            anomaly_score = (count - expected) / max(std, math.sqrt(
+                max(expected, 1.0)))
+
+            updated[app_id] = [app_id, bucket, int(count), ewma_fast,
+                               ewma_slow, math.sqrt(trend.header[EWVAR]),
+                               mean, std,
+                               None if math.isnan(baseline) else baseline,
+                               trend_score, anomaly_score, b'']
+
+        if updated:
+            self._save_scores(connector, list(updated.values()))
+            self.dirty.update(updated)
+
+        if time.monotonic() - self.last_save >= self.save_interval:
+            self._save_states(connector)
+
+    def flush(self, connector):
+        """
+        Write the packed states of every app updated since the last write
+
+        Parameters
+        ----------
+        connector : A connector to MySQL server
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._save_states(connector)
+
+        return
+
+    def _save_scores(self, connector, values):
+        #New rows get an empty state until the next state write, existing
+        #rows keep theirs
+        cursor = connector.cursor()
+        cursor.executemany("""
+                           INSERT INTO app_trend
+                           (app_id, bucket, last_count, ewma_fast, ewma_slow,
+                            ew_std, rolling_mean, rolling_std, baseline,
+                            trend_score, anomaly_score, state)
+                           VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
+                                   %s, %s)
+                           ON DUPLICATE KEY UPDATE
+                               bucket = VALUES(bucket),
+                               last_count = VALUES(last_count),
+                               ewma_fast = VALUES(ewma_fast),
+                               ewma_slow = VALUES(ewma_slow),
+                               ew_std = VALUES(ew_std),
+                               rolling_mean = VALUES(rolling_mean),
+                               rolling_std = VALUES(rolling_std),
+                               baseline = VALUES(baseline),
+                               trend_score = VALUES(trend_score),
+                               anomaly_score = VALUES(anomaly_score);
+                           """, values)
+        connector.commit()
+        cursor.close()
+
+    def _save_states(self, connector):
+        if self.dirty:
+            cursor = connector.cursor()
+            cursor.executemany("""
+                               UPDATE app_trend
+                               SET state = %s
+                               WHERE app_id = %s;
+                               """, [[self.trends[app_id].to_bytes(), app_id]
+                                     for app_id in self.dirty])
+            connector.commit()
+            cursor.close()
+        self.dirty = set()
+        self.last_save = time.monotonic()
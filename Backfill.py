@@ -0,0 +1,489 @@
+# -*- coding: utf-8 -*-
+"""
+Parallel import of historical player counts from CSV or json lines dumps.
+
+Each file is split into chunks of whole lines, which a process pool parses
+into rows of (app_id, timestamp, count) while the main process loads the
+chunks that are already parsed. Timestamps are rounded to the collector's
+10 minute grid and loaded without a cycle bucket, so the dashboard sums them
+by timestamp like samples from before cycles were recorded. Samples at or
+after the first recorded cycle, and samples of an app at a time that
+player_count already has, are skipped so they aren't counted twice.
+
+Apps missing from game_info get a stub row, named App <app_id>, which the
+next app_information or app_catalog run fills in. Each chunk is committed
+together with its row in backfill_chunk, so an interrupted import resumes
+after the last committed chunk and never loads a chunk twice.
+
+Run from the repository root:
+    python Backfill.py dumps/player_counts_2023.csv dumps/extra.jsonl \
+        --workers 8
+"""
+
+import argparse
+import io
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import datetime
+
+import pandas as pd
+import yaml
+
+from Database import Database
+from DataFetch import (BUCKET_SECONDS, bulk_load, insert_values_batches,
+                       load_data_infile, setup_database)
+
+#File extensions of each format, others need --format
+FORMATS = {'.csv': 'csv', '.jsonl': 'json', '.ndjson': 'json'}
+
+#Staging table each chunk is loaded into before the samples player_count
+#doesn't have yet are copied over. Temporary, so every connection has its own
+STAGING_TABLE = """
+    CREATE TEMPORARY TABLE IF NOT EXISTS backfill_rows(
+        app_id INT UNSIGNED NOT NULL,
+        timestamp DATETIME NOT NULL,
+        count INT UNSIGNED NOT NULL
+        );
+"""
+
+
+#Function for the format of a dump
+def file_format_of(path, file_format=None):
+    """
+    Function for the format of a dump, by its extension unless given, and
+    checking that a json dump has one object per line since only those can
+    be split into chunks
+
+    Parameters
+    ----------
+    path : Path of the dump
+    file_format : 'csv' or 'json', None to go by the extension
+
+    Returns
+    -------
+    'csv' or 'json'
+
+    """
+    extension = os.path.splitext(path)[1].lower()
+    file_format = file_format or FORMATS.get(extension)
+    if file_format is None:
+        if extension == '.json':
+            raise ValueError(f'{path}: only json lines dumps, one object per '
+                             'line, can be imported. Rename it to .jsonl if '
+                             'it is one, or convert it')
+        raise ValueError(f'Unknown format of {path}, pass --format')
+
+    if file_format == 'json':
+        with open(path, 'rb') as file:
+            first = file.read(4096).lstrip()
+        if first.startswith(b'['):
+            raise ValueError(f'{path} is a json array. Only json lines '
+                             'dumps, one object per line, can be imported; '
+                             'convert it, e.g. with jq -c .[]')
+
+    return file_format
+
+
+#Function for splitting a file into chunks of whole lines
+def split_file(path, file_format, chunk_bytes):
+    """
+    Function for splitting a file into byte ranges that start and end on
+    line boundaries, so each can be parsed on its own
+
+    Parameters
+    ----------
+    path : Path of the dump
+    file_format : 'csv' or 'json'
+    chunk_bytes : Approximate size of each chunk
+
+    Returns
+    -------
+    Tuple of the csv header line (empty for json lines) and a list of
+    (start_byte, end_byte) ranges
+
+    """
+    size = os.path.getsize(path)
+    chunks = []
+    with open(path, 'rb') as file:
+        header = file.readline() if file_format == 'csv' else b''
+        start = file.tell()
+        while start < size:
+            #Carry on to the end of the line the chunk would cut through
+            file.seek(min(start + chunk_bytes, size))
+            file.readline()
+            end = min(file.tell(), size)
+            chunks.append((start, end))
+            start = end
+
+    return header, chunks
+
+
+#Function for parsing one chunk, run in the process pool
+def parse_chunk(path, start, end, file_format, header, columns, first_bucket,
+                timezone=None):
+    """
+    Function for parsing a chunk of a dump into player_count rows
+
+    Parameters
+    ----------
+    path : Path of the dump
+    start : First byte of the chunk
+    end : Byte after the last of the chunk
+    file_format : 'csv' or 'json'
+    header : Csv header line, prepended to every csv chunk
+    columns : Dict of app_id, timestamp and count to the dump's field names
+    first_bucket : Bucket of the first recorded cycle, samples from then on
+        are skipped. None to keep everything
+    timezone : Timezone of the collector's clock that stored timestamps are
+        in. Dump times are taken as UTC unless they carry an offset. None
+        keeps them as they are
+
+    Returns
+    -------
+    Tuple of the list of (app_id, timestamp, count) rows and the number of
+    lines that were skipped
+
+    """
+    with open(path, 'rb') as file:
+        file.seek(start)
+        data = file.read(end - start)
+
+    fields = [columns['app_id'], columns['timestamp'], columns['count']]
+    if file_format == 'csv':
+        frame = pd.read_csv(io.BytesIO(header + data), usecols=fields)
+    else:
+        frame = pd.read_json(io.BytesIO(data), lines=True, dtype=False,
+                             convert_dates=False)
+    total = len(frame)
+    frame = frame.reindex(columns=fields)
+    frame.columns = ['app_id', 'timestamp', 'count']
+
+    #Epoch seconds or date strings, anything unparseable is dropped
+    if pd.api.types.is_numeric_dtype(frame['timestamp']):
+        timestamps = pd.to_datetime(frame['timestamp'], unit='s', utc=True,
+                                    errors='coerce')
+    else:
+        timestamps = pd.to_datetime(frame['timestamp'], utc=True,
+                                    format='mixed', errors='coerce')
+    if timezone:
+        timestamps = timestamps.dt.tz_convert(timezone)
+    frame['timestamp'] = timestamps.dt.tz_localize(None).dt.round('10min')
+    frame['app_id'] = pd.to_numeric(frame['app_id'], errors='coerce')
+    frame['count'] = pd.to_numeric(frame['count'], errors='coerce')
+    frame = frame.dropna()
+    frame = frame[(frame['app_id'] > 0) & (frame['count'] >= 0)]
+
+    if first_bucket is not None:
+        cutoff = pd.Timestamp(first_bucket * BUCKET_SECONDS, unit='s')
+        frame = frame[frame['timestamp'] < cutoff]
+
+    #Several samples rounded into the same slot keep the last one
+    frame = frame.drop_duplicates(['app_id', 'timestamp'], keep='last')
+
+    rows = list(zip(frame['app_id'].astype('int64').tolist(),
+                    frame['timestamp'].dt.strftime('%Y-%m-%d %H:%M:%S')
+                    .tolist(),
+                    frame['count'].astype('int64').tolist()))
+
+    return rows, total - len(rows)
+
+
+#Function for the key a file's chunks are checkpointed under
+def source_key(path):
+    """
+    Function for identifying a dump by its name and size, so a resumed run
+    finds its chunks even from another directory
+
+    Parameters
+    ----------
+    path : Path of the dump
+
+    Returns
+    -------
+    String key
+
+    """
+    return f'{os.path.basename(path)}:{os.path.getsize(path)}'
+
+
+#Function for the chunks of a file that were already loaded
+def loaded_chunks(connector, source):
+    """
+    Function for fetching the byte ranges of a dump that are already loaded
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    source : Key of the dump from source_key
+
+    Returns
+    -------
+    Dict of start_byte to end_byte
+
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+                   SELECT start_byte, end_byte
+                   FROM backfill_chunk
+                   WHERE source = %s;
+                   """, (source,))
+    done = {int(start): int(end) for start, end in cursor.fetchall()}
+    cursor.close()
+
+    return done
+
+
+#Function for loading one parsed chunk
+def load_chunk(connector, source, start, end, rows, known_apps, strategy,
+               batch_size):
+    """
+    Function for inserting a chunk's rows, stubs for its new apps and its
+    checkpoint in one transaction. The rows go through a staging table so
+    that samples player_count already has for the same app and time, such
+    as ones the collector recorded before cycles were, are left out. Only
+    player_count's rows within the chunk's time range are looked at.
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    source : Key of the dump from source_key
+    start : First byte of the chunk
+    end : Byte after the last of the chunk
+    rows : List of (app_id, timestamp, count) rows
+    known_apps : Set of app ids in game_info, updated with the new stubs
+    strategy : values or load_data, as in player_counts_insert
+    batch_size : Rows per statement for the values strategy
+
+    Returns
+    -------
+    Number of rows inserted into player_count
+
+    """
+    cursor = connector.cursor()
+    try:
+        new_apps = sorted({row[0] for row in rows} - known_apps)
+        if new_apps:
+            cursor.executemany("""
+                               INSERT IGNORE INTO game_info
+                               (app_id, name, developer, rating, price)
+                               VALUES (%s, %s, '', 0, 0);
+                               """,
+                               [(app_id, f'App {app_id}')
+                                for app_id in new_apps])
+
+        cursor.execute(STAGING_TABLE)
+        cursor.execute('DELETE FROM backfill_rows;')
+        columns = ['app_id', 'timestamp', 'count']
+        if strategy == 'load_data':
+            load_data_infile(cursor, 'backfill_rows', columns, rows)
+        else:
+            insert_values_batches(cursor, 'backfill_rows', columns, rows,
+                                  batch_size)
+
+        #Only samples in the chunk's time range are compared, which the
+        #timestamp index or the monthly partitions narrow down
+        inserted = 0
+        if rows:
+            cursor.execute("""
+                           INSERT INTO player_count
+                           (app_id, timestamp, count)
+                           SELECT staged.app_id, staged.timestamp,
+                           staged.count
+                           FROM backfill_rows AS staged
+                           LEFT JOIN (
+                               SELECT app_id, timestamp
+                               FROM player_count
+                               WHERE timestamp BETWEEN %s AND %s
+                               ) AS existing
+                           ON existing.app_id = staged.app_id
+                           AND existing.timestamp = staged.timestamp
+                           WHERE existing.app_id IS NULL;
+                           """, (min(row[1] for row in rows),
+                                 max(row[1] for row in rows)))
+            inserted = cursor.rowcount
+
+        cursor.execute("""
+                       INSERT INTO backfill_chunk
+                       (source, start_byte, end_byte, rows_loaded, loaded_at)
+                       VALUES (%s, %s, %s, %s, %s);
+                       """, (source, start, end, inserted, datetime.now()))
+        connector.commit()
+    except Exception:
+        connector.rollback()
+        raise
+    finally:
+        cursor.close()
+
+    known_apps.update(new_apps)
+
+    return inserted
+
+
+#Function for importing dumps
+def backfill(connector, paths, columns, file_format=None, workers=None,
+             chunk_bytes=32 * 2**20, strategy='values', batch_size=1000,
+             timezone=None, keep_overlap=False):
+    """
+    Function for importing dumps of player counts, parsing chunks in a
+    process pool and loading them as they are parsed
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    paths : List of paths of the dumps
+    columns : Dict of app_id, timestamp and count to the dumps' field names
+    file_format : 'csv' or 'json', None to go by each file's extension
+    workers : Number of parsing processes, None for one per CPU
+    chunk_bytes : Approximate size of each chunk. A resumed import has to
+        use the same size
+    strategy : values or load_data, as in player_counts_insert
+    batch_size : Rows per statement for the values strategy
+    timezone : Timezone of the collector's clock, see parse_chunk
+    keep_overlap : Whether to also load samples from after the first
+        recorded cycle
+
+    Returns
+    -------
+    Number of rows loaded
+
+    """
+    cursor = connector.cursor()
+    cursor.execute('SELECT app_id FROM game_info;')
+    known_apps = {int(app_id) for (app_id,) in cursor.fetchall()}
+    cursor.execute('SELECT MIN(bucket) FROM collection_cycle;')
+    first_bucket = cursor.fetchone()[0]
+    cursor.close()
+    if keep_overlap or first_bucket is None:
+        first_bucket = None
+    else:
+        first_bucket = int(first_bucket)
+
+    #Every chunk that isn't loaded yet
+    tasks = []
+    for path in paths:
+        path_format = file_format_of(path, file_format)
+
+        source = source_key(path)
+        header, chunks = split_file(path, path_format, chunk_bytes)
+        done = loaded_chunks(connector, source)
+        before = len(tasks)
+        for start, end in chunks:
+            if done.get(start) == end:
+                continue
+            if any(start < done_end and done_start < end
+                   for done_start, done_end in done.items()):
+                raise ValueError(f'{path} was partly loaded with another '
+                                 'chunk size, resume with the same one')
+            tasks.append((source, path, start, end, path_format, header))
+
+        print(f'{path}: {len(chunks) - (len(tasks) - before)} of '
+              f'{len(chunks)} chunks already loaded')
+
+    loaded = 0
+    skipped = 0
+    existing = 0
+    started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        queued = iter(tasks)
+        #Enough chunks in flight to keep every worker busy while we load
+        in_flight = 2 * (workers or os.cpu_count() or 1)
+
+        def submit():
+            for task in queued:
+                source, path, start, end, path_format, header = task
+                future = executor.submit(parse_chunk, path, start, end,
+                                         path_format, header, columns,
+                                         first_bucket, timezone)
+                pending[future] = task
+                if len(pending) >= in_flight:
+                    break
+
+        submit()
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                source, path, start, end, _, _ = pending.pop(future)
+                rows, bad = future.result()
+                inserted = load_chunk(connector, source, start, end, rows,
+                                      known_apps, strategy, batch_size)
+                loaded += inserted
+                skipped += bad
+                existing += len(rows) - inserted
+                rate = loaded / (time.perf_counter() - started)
+                print(f'Loaded {path} bytes {start:,}-{end:,}: '
+                      f'{inserted:,} rows, {loaded:,} total at '
+                      f'{rate:,.0f} rows/s')
+            submit()
+
+    print(f'Backfill finished: {loaded:,} rows loaded, {skipped:,} skipped, '
+          f'{existing:,} already in player_count in '
+          f'{time.perf_counter() - started:.1f}s')
+
+    return loaded
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('paths', nargs='+',
+                        help='CSV or json lines dumps, uncompressed')
+    parser.add_argument('--format', choices=['csv', 'json'],
+                        help='Format of every file, json being json lines, '
+                        'instead of by extension')
+    parser.add_argument('--app-id-field', default='app_id',
+                        help='Field of the app id')
+    parser.add_argument('--timestamp-field', default='timestamp',
+                        help='Field of the time, a date string or epoch '
+                        'seconds')
+    parser.add_argument('--count-field', default='count',
+                        help='Field of the player count')
+    parser.add_argument('--workers', type=int,
+                        help='Parsing processes, defaults to backfill: '
+                        'workers or one per CPU')
+    parser.add_argument('--chunk-mb', type=float,
+                        help='Size of each chunk, defaults to backfill: '
+                        'chunk_mb')
+    parser.add_argument('--timezone',
+                        help="Timezone of the collector's clock, defaults "
+                        'to backfill: timezone')
+    parser.add_argument('--keep-overlap', action='store_true',
+                        help='Also load samples from after the first '
+                        'recorded cycle')
+    args = parser.parse_args()
+
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    credentials = config['mysql_credentials']
+    settings = config['data_fetch'].get('backfill', {}) or {}
+
+    bulk_load.update(config['data_fetch'].get('bulk_load', {}))
+    #Rows go in as INSERT ... VALUES batches unless LOAD DATA is set up
+    strategy = ('load_data' if bulk_load['strategy'] == 'load_data'
+                else 'values')
+    local_infile = strategy == 'load_data'
+
+    #Makes sure the schema, including backfill_chunk, is up to date
+    setup_database(
+        credentials, allow_local_infile=local_infile,
+        migrations=config.get('database', {}).get('migrations')).close()
+
+    database = Database.from_config(
+        config, credentials, 'collector',
+        connect_args={'allow_local_infile': local_infile})
+    cnx = database.connect()
+    try:
+        backfill(cnx, args.paths,
+                 {'app_id': args.app_id_field,
+                  'timestamp': args.timestamp_field,
+                  'count': args.count_field},
+                 file_format=args.format,
+                 workers=args.workers or settings.get('workers'),
+                 chunk_bytes=int((args.chunk_mb
+                                  or settings.get('chunk_mb', 32)) * 2**20),
+                 strategy=strategy, batch_size=bulk_load['batch_size'],
+                 timezone=args.timezone or settings.get('timezone'),
+                 keep_overlap=args.keep_overlap)
+    finally:
+        cnx.close()
@@ -5,11 +5,24 @@ Created on Mon Dec  2 23:08:06 2024
 @author: sulli
 """
 
-from dash import Dash, html, dcc, callback, Output, Input, State
+from dash import Dash, html, dcc, callback, ctx, Output, Input, State, no_update
 import plotly.express as px
+import plotly.graph_objects as go
 import pandas as pd
+import numpy as np
+import base64
+import os
+import threading
 import yaml
-from sqlalchemy import create_engine
+
+from Database import Database
+from FigureCache import FigureCache, make_key
+from Jobs import JobQueue
+from LiveUpdates import LiveFeed
+from SingleFlight import SingleFlight
+from Movers import MoversIndex
+from Profiling import CallbackProfiler
+from Seasonality import HourlyCube, WEEKDAYS, slot_label
 
 # Get information from the config
 with open('config.yaml','r') as file:
@@ -31,21 +44,77 @@ else:
     credentials['password'] = str(input("Password:"))
     credentials['host'] = str(input('Host:'))
 
-engine = create_engine(f'mysql+mysqlconnector://{credentials["username"]}'
-                       f':{credentials["password"]}@{credentials["host"]}'
-                       f':3306/steam_db')
+# Pooled connections, reads go to the replica if one is configured.
+# STEAM_DB_URL points the dashboard at another database, e.g. a synthetic
+# one from benchmarks/synthetic_data.py
+database = Database.from_config(config, credentials, 'dashboard')
+engine = database.read_engine
 
-# Initial dataframe
-def fetch_initial_data():
-    query = """
+# Opt-in profiling of callback stages
+profiler = CallbackProfiler.from_config(config)
+
+# Heavy callbacks run as background jobs that the browser polls
+jobs = JobQueue.from_config(config)
+job_poll_interval = config.get('dashboard', {}).get('jobs', {}).get('poll_interval', 300)
+
+# Identical queries running at the same time share one execution
+single_flight = SingleFlight()
+
+# Cache of serialized figures, keyed by range, filters and data version
+figure_cache = FigureCache(config.get('dashboard', {}).get('figure_cache', {})
+                           .get('max_entries', 256))
+
+# With adaptive polling apps are sampled every 1 to max_interval cycles
+scheduling = config['data_fetch'].get('scheduling', {})
+adaptive_polling = scheduling.get('enabled', False)
+max_poll_interval = scheduling.get('max_interval', 12)
+
+# Share of apps a cycle must have sampled to be charted
+min_cycle_coverage = config.get('dashboard', {}).get('min_cycle_coverage', 0.95)
+
+# Total players of the complete cycles after a bucket
+def fetch_complete_cycles(after_bucket, name='sql:fetch_cycle_totals'):
+    query = f"""
+    SELECT bucket, total_players AS count
+    FROM collection_cycle
+    WHERE bucket > {int(after_bucket)}
+    AND finished_at IS NOT NULL
+    AND workers_finished = workers_started
+    AND shards_sampled >= shards_total
+    AND apps_sampled >= {float(min_cycle_coverage)} * apps_expected;
+    """
+    cycles = profiler.read_sql(query, engine, name)
+    cycles['timestamp'] = pd.to_datetime(cycles['bucket'] * 600, unit='s')
+    return cycles
+
+# Total players per complete cycle, read straight from the cycle rows
+@single_flight.coalesce
+def fetch_cycle_totals():
+    # Same six month window as player_count_by_game
+    cutoff = pd.Timestamp.now().normalize() - pd.DateOffset(months=6)
+    cycles = fetch_complete_cycles(int(cutoff.timestamp()) // 600 - 1)
+    
+    # Samples from before cycles were recorded are still summed by timestamp
+    legacy_query = """
     SELECT timestamp, SUM(count) AS count
     FROM player_count_by_game
-    GROUP BY timestamp
-    ORDER BY timestamp DESC;
+    WHERE cycle_bucket IS NULL
+    GROUP BY timestamp;
     """
-    df = pd.read_sql(query, engine)
-    df['timestamp'] = pd.to_datetime(df['timestamp'])
-    return df
+    legacy = profiler.read_sql(legacy_query, engine, 'sql:fetch_cycle_totals')
+    
+    with profiler.stage('pandas:fetch_cycle_totals'):
+        legacy['timestamp'] = pd.to_datetime(legacy['timestamp'])
+        totals = pd.concat([legacy, cycles[['timestamp', 'count']]],
+                           ignore_index=True)
+        totals['count'] = totals['count'].astype('int64')
+        totals = totals.sort_values('timestamp', ascending=False,
+                                    ignore_index=True)
+    return totals
+
+# Initial dataframe
+def fetch_initial_data():
+    return fetch_cycle_totals()
 
 df = fetch_initial_data()
 
@@ -55,21 +124,66 @@ def create_map_id_name():
         SELECT app_id, name
         FROM game_info;
     """
-    result = pd.read_sql(query, engine)
+    result = profiler.read_sql(query, engine, 'sql:create_map_id_name')
     return dict(zip(result['app_id'], result['name']))
 
 map_id_name = create_map_id_name()
 
-# Initialize app
-app = Dash()
+# Initialize app, gzipping responses with flask-compress
+app = Dash(compress=config.get('dashboard', {}).get('compress', True))
+
+# Hidden debug route with profiling numbers, only exists when enabled
+profiling_route = (config.get('dashboard', {}).get('profiling', {})
+                   .get('route', '/_debug/profile'))
+profiler.register_route(app.server, profiling_route,
+                        extras={'pools': database.pool_stats,
+                                'single_flight': single_flight.stats})
+
+# New cycles are pushed to open pages instead of every page reloading
+live_settings = config.get('dashboard', {}).get('live_updates', {}) or {}
+live_updates = live_settings.get('enabled', False)
+live_route = live_settings.get('route', '/live/stream')
+
+# df is replaced by the live feed thread and by refresh jobs, each holds this
+# from reading the current df to replacing it so neither update is lost
+df_lock = threading.Lock()
+
+# Add the cycles finished since the last check to df, once for all pages
+def poll_new_cycles():
+    global df
+    with df_lock:
+        latest = df['timestamp'].max()
+        after_bucket = 0 if pd.isna(latest) else int(latest.timestamp()) // 600
+        cycles = fetch_complete_cycles(after_bucket, 'sql:poll_new_cycles')
+        if cycles.empty:
+            return []
+        cycles = cycles.sort_values('timestamp', ignore_index=True)
+        cycles['count'] = cycles['count'].astype('int64')
+        df = pd.concat([cycles[['timestamp', 'count']].iloc[::-1], df],
+                       ignore_index=True)
+    # Only the new points are sent, as epoch ms like the chart's x values
+    return [{'timestamp': int(timestamp.timestamp() * 1000), 'count': int(count)}
+            for timestamp, count in zip(cycles['timestamp'], cycles['count'])]
+
+live_feed = LiveFeed.from_config(config, poll_new_cycles)
+if live_updates:
+    live_feed.register_route(app.server, live_route)
+    # The debug reloader's parent process only watches files, the feed
+    # runs in the child that serves pages
+    if __name__ != '__main__' or os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        live_feed.start()
 
 # Function to fetch new data
+@single_flight.coalesce
 def fetch_new_data(valid_apps=None):
     if valid_apps:
         valid_apps_str = ", ".join(f"'{app}'" for app in valid_apps)
         where_clause = f"WHERE app_id IN ({valid_apps_str})"
+    # Overall totals come from the cycle rows, leaving out incomplete cycles
     else: 
-        where_clause = ""
+        return fetch_cycle_totals()
+    if adaptive_polling:
+        return fetch_forward_filled(where_clause)
     query = f"""
     SELECT timestamp, SUM(count) AS count
     FROM player_count_by_game
@@ -77,38 +191,233 @@ def fetch_new_data(valid_apps=None):
     GROUP BY timestamp
     ORDER BY timestamp DESC;
     """
-    new_data = pd.read_sql(query, engine)
-    new_data['timestamp'] = pd.to_datetime(new_data['timestamp'])
+    new_data = profiler.read_sql(query, engine, 'sql:fetch_new_data')
+    with profiler.stage('pandas:fetch_new_data'):
+        new_data['timestamp'] = pd.to_datetime(new_data['timestamp'])
     return new_data
 
-# Function to fetch treemap data
-def fetch_treemap_data(start, end, valid_apps):
+# Sum of apps that are sampled at different rates, each carried forward
+# until its next sample
+def fetch_forward_filled(where_clause):
+    query = f"""
+    SELECT app_id, timestamp, count
+    FROM player_count_by_game
+    {where_clause};
+    """
+    samples = profiler.read_sql(query, engine, 'sql:fetch_new_data')
+    with profiler.stage('pandas:fetch_new_data'):
+        samples['timestamp'] = pd.to_datetime(samples['timestamp'])
+        if samples.empty:
+            return samples[['timestamp', 'count']]
+        by_app = samples.pivot_table(index='timestamp', columns='app_id',
+                                     values='count', aggfunc='sum')
+        grid = pd.date_range(by_app.index.min(), by_app.index.max(),
+                             freq='10min')
+        by_app = by_app.reindex(grid).ffill(limit=max_poll_interval - 1)
+        new_data = (by_app.sum(axis=1, min_count=1).dropna()
+                    .rename('count').rename_axis('timestamp').reset_index())
+        new_data = new_data.sort_values('timestamp', ascending=False,
+                                         ignore_index=True)
+    return new_data
+
+# Per game totals of a range as a subquery, only_apps narrows the games
+# down further
+def treemap_counts_query(start, end, valid_apps, only_apps=''):
     # Format our valid apps
     valid_apps_str = ", ".join(f"'{app}'" for app in valid_apps)
     query = f"""
-        SELECT name, SUM(count) AS count 
+        SELECT app_id, name, SUM(count) AS count 
         FROM player_count_by_game
         WHERE timestamp >= '{start.strftime('%Y-%m-%d %H:%M:%S')}'
         AND timestamp <= '{end.strftime('%Y-%m-%d %H:%M:%S')}'
-        AND app_id IN ({valid_apps_str})
-        GROUP BY name;
+        AND app_id IN ({valid_apps_str}) {only_apps}
+        GROUP BY app_id, name
     """
-    treemap_df = pd.read_sql(query, engine)
-    # For formatting the output
-    treemap_df['label'] = treemap_df.apply(
-        lambda row: f"{row['name']}<br>{row['count']} players",
-        axis=1
+    # Each sample counts once for every cycle it is carried forward, so
+    # rarely polled apps aren't undercounted
+    if adaptive_polling:
+        query = f"""
+            SELECT app_id, name, SUM(count * LEAST(COALESCE(
+                TIMESTAMPDIFF(MINUTE, timestamp, next_timestamp) DIV 10, 1),
+                {int(max_poll_interval)})) AS count
+            FROM (
+                SELECT app_id, name, timestamp, count,
+                LEAD(timestamp) OVER (PARTITION BY app_id ORDER BY timestamp)
+                AS next_timestamp
+                FROM player_count_by_game
+                WHERE timestamp >= '{start.strftime('%Y-%m-%d %H:%M:%S')}'
+                AND timestamp <= '{end.strftime('%Y-%m-%d %H:%M:%S')}'
+                AND app_id IN ({valid_apps_str}) {only_apps}
+            ) AS samples
+            GROUP BY app_id, name
+        """
+    return query
+
+# Player count traces switch to WebGL above this many points
+webgl_threshold = config.get('dashboard', {}).get('webgl_threshold', 5000)
+
+# Whether the player count chart is sent as binary typed arrays, turning
+# this off sends the plain px.line figure for comparison
+binary_figures = config.get('dashboard', {}).get('binary_figures', True)
+
+# Encode an array as a base64 typed array, which plotly.js reads without
+# parsing a json number or date string per point
+def typed_array(values, dtype='f8'):
+    array = np.ascontiguousarray(values, dtype=np.dtype(dtype).newbyteorder('<'))
+    return {'dtype': dtype, 'bdata': base64.b64encode(array.tobytes()).decode('ascii')}
+
+# Function to create the player count line chart
+def create_player_count_chart(filtered_df, title, live=False):
+    # live tells assets/live_updates.js to append pushed cycles to the chart
+    if not binary_figures:
+        fig = px.line(filtered_df, x='timestamp', y='count', title=title)
+        fig.update_layout(title_x=0.5, meta={'live': live})
+        return fig
+    
+    filtered_df = filtered_df.sort_values('timestamp')
+    
+    # SVG slows down badly with many points, WebGL doesn't
+    trace = go.Scattergl if len(filtered_df) > webgl_threshold else go.Scatter
+    fig = go.Figure(trace(
+        mode='lines',
+        hovertemplate='timestamp=%{x}<br>count=%{y}<extra></extra>'
+    ))
+    fig.update_layout(
+        title=title,
+        title_x=0.5,
+        xaxis=dict(type='date', title='timestamp'),  # x is sent as epoch ms
+        yaxis=dict(title='count'),
+        meta={'live': live}
     )
-    return treemap_df
+    
+    # Timestamps go as epoch milliseconds instead of ISO strings
+    fig = fig.to_dict()
+    timestamps = filtered_df['timestamp'].to_numpy(dtype='datetime64[ms]')
+    fig['data'][0]['x'] = typed_array(timestamps.astype('int64'))
+    fig['data'][0]['y'] = typed_array(filtered_df['count'])
+    return fig
+
+# The treemap shows this many tiles and an "Other" tile for the rest
+treemap_settings = config.get('dashboard', {}).get('treemap', {}) or {}
+treemap_top_n = treemap_settings.get('top_n', 50)
+
+# Games can be grouped by 'tag' or 'genre', each group's games are only
+# sent once it is clicked
+treemap_group_by = treemap_settings.get('group_by')
+if treemap_group_by not in ('tag', 'genre'):
+    treemap_group_by = None
+
+# The group each game is shown under as a subquery. A game with several
+# goes under the one most games share, so the groups stay few and large
+def treemap_groups_query(group_by):
+    return f"""
+        SELECT app_id, group_id, group_name
+        FROM (
+            SELECT game_{group_by}.app_id, {group_by}.{group_by}_id AS group_id,
+            {group_by}.{group_by} AS group_name,
+            ROW_NUMBER() OVER (PARTITION BY game_{group_by}.app_id
+                               ORDER BY sizes.games DESC, {group_by}.{group_by}) AS choice
+            FROM game_{group_by}
+            INNER JOIN {group_by}
+            ON game_{group_by}.{group_by}_id = {group_by}.{group_by}_id
+            INNER JOIN (
+                SELECT {group_by}_id, COUNT(*) AS games
+                FROM game_{group_by}
+                GROUP BY {group_by}_id
+            ) AS sizes
+            ON sizes.{group_by}_id = game_{group_by}.{group_by}_id
+        ) AS choices
+        WHERE choice = 1
+    """
+
+# Fetch the n biggest of the rows of a subquery of id, name and count, and
+# one row with a null id summing the rest
+@single_flight.coalesce
+def fetch_top_n(counts_query, n, name='sql:fetch_top_n'):
+    query = f"""
+        SELECT CASE WHEN position <= {int(n)} THEN id END AS tile_id,
+        CASE WHEN position <= {int(n)} THEN name END AS tile_name,
+        SUM(count) AS count, COUNT(*) AS tiles
+        FROM (
+            SELECT id, name, count,
+            ROW_NUMBER() OVER (ORDER BY count DESC, id) AS position
+            FROM ({counts_query}) AS counts
+        ) AS ranked
+        GROUP BY tile_id, tile_name;
+    """
+    return profiler.read_sql(query, engine, name)
+
+# Turn fetch_top_n's rows into tiles, biggest first and "Other" last
+def top_n_tiles(top_df, prefix, other_name):
+    top_df = top_df.rename(columns={'tile_name': 'name'})
+    other = top_df['tile_id'].isna()
+    tiles = top_df[~other].sort_values('count', ascending=False)
+    tiles = tiles.assign(id=prefix + tiles['tile_id'].astype('int64').astype(str))
+    if other.any():
+        rest = top_df[other].iloc[0]
+        tiles = pd.concat([tiles, pd.DataFrame({
+            'id': ['other'], 'name': [f"{other_name} ({int(rest['tiles'])})"],
+            'count': [rest['count']]})], ignore_index=True)
+    return tiles[['id', 'name', 'count']].reset_index(drop=True)
+
+# Tiles of the treemap at the top level or inside a group, summed and cut
+# down to the top n by the database. group is the open group's id and name
+def treemap_tiles(start, end, valid_apps, group=None):
+    if treemap_group_by is None:
+        top_df = fetch_top_n(
+            f"""SELECT app_id AS id, name, count
+                FROM ({treemap_counts_query(start, end, valid_apps)}) AS apps""",
+            treemap_top_n, 'sql:fetch_treemap_tiles')
+        return top_n_tiles(top_df, 'app:', 'Other games').assign(parent='')
+    
+    groups_query = treemap_groups_query(treemap_group_by)
+    
+    # Only the groups, their games come when one is clicked. Games without
+    # any go under group -1
+    if group is None:
+        top_df = fetch_top_n(
+            f"""SELECT COALESCE(app_groups.group_id, -1) AS id,
+                COALESCE(app_groups.group_name, 'Ungrouped') AS name,
+                SUM(apps.count) AS count
+                FROM ({treemap_counts_query(start, end, valid_apps)}) AS apps
+                LEFT JOIN ({groups_query}) AS app_groups
+                ON app_groups.app_id = apps.app_id
+                GROUP BY COALESCE(app_groups.group_id, -1),
+                COALESCE(app_groups.group_name, 'Ungrouped')""",
+            treemap_top_n, 'sql:fetch_treemap_tiles')
+        tiles = top_n_tiles(top_df, 'group:', f'Other {treemap_group_by}s')
+        return tiles.assign(parent='')
+    
+    # The group's games are the only ones summed
+    group_id = int(group['id'])
+    if group_id >= 0:
+        only_apps = (f'AND app_id IN (SELECT app_id FROM ({groups_query}) AS app_groups '
+                     f'WHERE group_id = {group_id})')
+    else:
+        only_apps = f'AND app_id NOT IN (SELECT app_id FROM game_{treemap_group_by})'
+    top_df = fetch_top_n(
+        f"""SELECT app_id AS id, name, count
+            FROM ({treemap_counts_query(start, end, valid_apps, only_apps)}) AS apps""",
+        treemap_top_n, 'sql:fetch_treemap_tiles')
+    
+    # The group itself is the root, clicking it goes back up
+    tiles = top_n_tiles(top_df, 'app:', 'Other games').assign(parent=f'group:{group_id}')
+    root = pd.DataFrame({'id': [f'group:{group_id}'], 'name': [group['name']],
+                         'count': [tiles['count'].sum()], 'parent': ['']})
+    return pd.concat([root, tiles], ignore_index=True)
 
 # Function to create our treemap
-def create_treemap(treemap_df):
-    if treemap_df.empty:
+def create_treemap(tiles, group=None):
+    title = 'Player Distribution by Game'
+    if treemap_group_by is not None:
+        title = (f"Player Distribution in {group['name']} (click it to go back)" if group
+                 else f'Player Distribution by {treemap_group_by.title()} (click one to open it)')
+    if tiles.empty:
         return px.treemap(
             pd.DataFrame(columns=['name', 'count']),
             path=['name'],
             values='count',
-            title='Player Distribution by Game',
+            title=title,
         )
     
     custom_colorscale = [
@@ -116,25 +425,30 @@ def create_treemap(treemap_df):
         [1, 'blue']   # Maximum hue blue
     ]
 
-    # Create the treemap
-    fig = px.treemap(
-        treemap_df,
-        path=['name'],  # Treemap hierarchy (game names)
-        values='count',  # Size of areas based on player count
-        title='Player Distribution by Game',
-        color='count',  # Color based on player count
-        color_continuous_scale=custom_colorscale,  # Custom color scale
-        labels = { row['name']:f"{row['name']}\n{row['count']}" 
-                  for (index,row) in treemap_df.iterrows()}
-    )
-    
-    # Add the labels to the treemap
-    fig.data[0].textinfo = 'label'  # Show custom labels
-    fig.data[0].hovertemplate = (
-        "Game: %{label}<br>Total Players: %{value}<extra></extra>"
-    )  # Enhance hover tooltips
+    # Tiles, sizes and colors come straight from the columns
+    counts = tiles['count'].astype(float)
+    labels = tiles['name'] + '<br>' + tiles['count'].astype('int64').astype(str) + ' players'
+    fig = go.Figure(go.Treemap(
+        ids=tiles['id'],
+        labels=tiles['name'],  # Treemap hierarchy (game names)
+        parents=tiles['parent'],
+        values=counts,  # Size of areas based on player count
+        branchvalues='total',  # A group's tile is the sum of its games
+        marker=dict(
+            colors=counts,  # Color based on player count
+            colorscale=custom_colorscale,  # Custom color scale
+            showscale=True,
+            colorbar=dict(title='count')
+        ),
+        text=labels,
+        textinfo='text',  # Show custom labels
+        hovertemplate=(
+            "%{label}<br>Total Players: %{value}<extra></extra>"
+        )  # Enhance hover tooltips
+    ))
     
     fig.update_layout(
+        title=title,
         margin=dict(t=30, l=0, r=0, b=0),  # Adjust layout margins
         title_x=0.5,  # Center-align the title
         height=800  # Increase the height of the plot
@@ -143,6 +457,7 @@ def create_treemap(treemap_df):
     return fig
 
 # Function for returning apps that meet a certain condition
+@single_flight.coalesce
 def return_valid_apps(selected_features: dict = {},
                       range_features: dict = {}) -> list:
     # Base where clause which is always true
@@ -162,7 +477,7 @@ def return_valid_apps(selected_features: dict = {},
         FROM complete_game_info
         {where_clause}
     """
-    return pd.read_sql(query, engine)['valid_apps'].tolist()
+    return profiler.read_sql(query, engine, 'sql:return_valid_apps')['valid_apps'].tolist()
 
 # Create a bubble plot for tag data
 def create_bubble_plot(tag_df):
@@ -206,6 +521,7 @@ def create_bubble_plot(tag_df):
     return fig
 
 # Fetch tag data for bubble chart
+@single_flight.coalesce
 def fetch_tag_data():
     query = """
     SELECT tag.tag, COUNT(*) as tag_count
@@ -214,9 +530,183 @@ def fetch_tag_data():
     ON tag.tag_id = game_tag.tag_id
     GROUP BY tag;
     """
-    tag_df = pd.read_sql(query, engine)
+    tag_df = profiler.read_sql(query, engine, 'sql:fetch_tag_data')
     return tag_df
 
+# Hourly player sums and sample counts of every app for the movers index
+@single_flight.coalesce
+def fetch_hourly_counts(start, end):
+    query = f"""
+        SELECT app_id, DATE(timestamp) AS day, HOUR(timestamp) AS hour_of_day,
+        SUM(count) AS players, COUNT(*) AS samples
+        FROM player_count_by_game
+        WHERE timestamp >= '{start.strftime('%Y-%m-%d %H:00:00')}'
+        AND timestamp <= '{end.strftime('%Y-%m-%d %H:%M:%S')}'
+        GROUP BY app_id, day, hour_of_day;
+    """
+    hourly_df = profiler.read_sql(query, engine, 'sql:fetch_hourly_counts')
+    with profiler.stage('pandas:fetch_hourly_counts'):
+        hourly_df['hour'] = (pd.to_datetime(hourly_df['day'])
+                             + pd.to_timedelta(hourly_df['hour_of_day'], unit='h'))
+    return hourly_df[['app_id', 'hour', 'players', 'samples']]
+
+# The prefix sums are reused while they cover the windows and apps asked for
+# and no new data has arrived
+movers_index = {'index': None, 'version': None, 'apps': None}
+
+# Top gainers and losers between the window before the selection and the
+# selection itself
+def fetch_movers(start, end, version, valid_apps=None, k=10):
+    window_b = (start, end)
+    window_a = (start - (end - start), start - pd.Timedelta(hours=1))
+    index = movers_index['index']
+    if (index is None or movers_index['version'] != version
+            or movers_index['apps'] != valid_apps
+            or not index.covers(window_a[0], end)):
+        hourly_df = fetch_hourly_counts(window_a[0], end)
+        with profiler.stage('pandas:build_movers_index'):
+            index = MoversIndex(hourly_df, window_a[0], end, valid_apps)
+        del hourly_df
+        movers_index.update(index=index, version=version, apps=valid_apps)
+    with profiler.stage('pandas:top_movers'):
+        return index.top_movers(window_a, window_b, k)
+
+# Create a bar chart of the biggest gainers and losers
+def create_movers_chart(gainers, losers):
+    fig = go.Figure()
+    for movers, color, name in [(gainers, 'blue', 'Gained'),
+                                (losers, 'grey', 'Lost')]:
+        fig.add_trace(go.Bar(
+            x=movers['change'],
+            y=movers['app_id'].map(map_id_name).fillna(movers['app_id'].astype(str)),
+            orientation='h',
+            name=name,
+            marker_color=color,
+            customdata=movers[['before', 'after']],
+            hovertemplate=(
+                "%{y}<br>Average players: %{customdata[0]:,.0f} to "
+                "%{customdata[1]:,.0f}<br>Change: %{x:+,.0f}<extra></extra>"
+            )
+        ))
+    fig.update_layout(
+        title='Biggest Movers vs. the Previous Period',
+        title_x=0.5,
+        xaxis_title='Change in Average Players',
+        yaxis=dict(autorange='reversed'),
+        margin=dict(t=50, l=50, r=50, b=50),
+        height=600
+    )
+    return fig
+
+# Streaming trend statistics are only there if the collector keeps them
+trends_enabled = config['data_fetch'].get('trends', {}).get('enabled', False)
+
+# Fetch the top trending games and the sharpest drops from app_trend
+@single_flight.coalesce
+def fetch_trends(limit=10):
+    # Only apps sampled in the last hour, so old scores don't linger
+    base_query = """
+        SELECT name, last_count, ewma_slow, baseline, trend_score,
+        anomaly_score
+        FROM app_trend
+        INNER JOIN game_info ON app_trend.app_id = game_info.app_id
+        WHERE bucket >= (SELECT MAX(bucket) FROM app_trend) - 6
+    """
+    trending_df = profiler.read_sql(
+        f"{base_query} ORDER BY trend_score DESC LIMIT {int(limit)};",
+        engine, 'sql:fetch_trends')
+    drops_df = profiler.read_sql(
+        f"{base_query} AND anomaly_score < 0 "
+        f"ORDER BY anomaly_score ASC LIMIT {int(limit)};",
+        engine, 'sql:fetch_trends')
+    return trending_df, drops_df
+
+# Create a ranked table of games
+def create_trend_table(trend_df, title, score_column, score_name):
+    header = html.Tr([html.Th('Game'), html.Th('Players'),
+                      html.Th('Usual'), html.Th(score_name)])
+    rows = [
+        html.Tr([html.Td(name), html.Td(f'{count:,}'),
+                 html.Td(f'{usual:,.0f}'), html.Td(f'{score:+.2f}')])
+        for name, count, usual, score in zip(
+            trend_df['name'], trend_df['last_count'],
+            trend_df['baseline'].astype(float).fillna(trend_df['ewma_slow']),
+            trend_df[score_column])
+    ]
+    return html.Div([
+        html.H4(title),
+        html.Table([header] + rows, style={'width': '100%'})
+    ], style={'width': '49%', 'display': 'inline-block',
+              'verticalAlign': 'top'})
+
+# Seasonality cubes are only there if the collector keeps them
+seasonality_enabled = config['data_fetch'].get('seasonality', {}).get('enabled', False)
+
+# Create map for tag id and name
+def create_map_tag_name():
+    query = """
+        SELECT tag_id, tag
+        FROM tag;
+    """
+    result = profiler.read_sql(query, engine, 'sql:create_map_tag_name')
+    return dict(zip(result['tag_id'], result['tag']))
+
+map_tag_name = create_map_tag_name() if seasonality_enabled else {}
+
+# Fetch the average and peak players by hour of the week of an app or tag
+@single_flight.coalesce
+def fetch_seasonality(kind, key_id):
+    query = f"""
+        SELECT state
+        FROM {'tag' if kind == 'tag' else 'app'}_seasonality
+        WHERE {'tag' if kind == 'tag' else 'app'}_id = {int(key_id)};
+    """
+    result = profiler.read_sql(query, engine, 'sql:fetch_seasonality')
+    if result.empty:
+        return None
+    return HourlyCube(bytes(result['state'].iloc[0]))
+
+# Create a heatmap of average players by weekday and hour
+def create_seasonality_heatmap(cube, name):
+    fig = go.Figure()
+    if cube is None or cube.peak()[0] is None:
+        title = f'No seasonality for {name} yet' if name else 'Search for a game or tag'
+        fig.update_layout(title=title, title_x=0.5, height=400)
+        return fig
+    
+    slot, average = cube.peak()
+    fig.add_trace(go.Heatmap(
+        z=cube.averages().reshape(7, 24),
+        x=[f'{hour:02d}:00' for hour in range(24)],
+        y=WEEKDAYS,
+        customdata=cube.peaks.reshape(7, 24),
+        colorscale=[[0, 'grey'], [1, 'blue']],
+        colorbar=dict(title='players'),
+        hovertemplate=(
+            "%{y} %{x}<br>Average players: %{z:,.0f}<br>"
+            "Peak players: %{customdata:,}<extra></extra>"
+        )
+    ))
+    fig.update_layout(
+        title=f'Players by Weekday and Hour for {name}, peaking {slot_label(slot)} with {average:,.0f} on average',
+        title_x=0.5,
+        yaxis=dict(autorange='reversed'),  # Monday on top
+        margin=dict(t=50, l=50, r=50, b=50),
+        height=400
+    )
+    return fig
+
+# Panels that only exist when the collector keeps their data
+optional_panels = []
+if trends_enabled:
+    optional_panels.append(html.Div(id='trend-panel', style={'margin': '20px'}))
+if seasonality_enabled:
+    optional_panels.append(html.Div([
+        dcc.Dropdown(id='seasonality-select', options=[],
+                     placeholder='Search for a game or tag'),
+        dcc.Graph(id='seasonality-heatmap')
+    ], style={'margin': '20px'}))
+
 app.layout = html.Div([
     html.Div([
         html.Label('Select Date and Time Range:', style={'fontSize': '18px'}),
@@ -229,72 +719,283 @@ app.layout = html.Div([
         html.Button('Reset Selected Game', id='reset-button', n_clicks=0, style={'margin': '10px 0'})
     ], style={'margin': '20px'}),
     html.Div(id='slider-output', style={'marginTop': '20px', 'fontSize': '16px'}),
+    html.Progress(id='job-progress', max=1, value=0, style={'width': '100%'}),
     dcc.Graph(id='player-count'),
     html.Div([
         dcc.Graph(id='treemap-count', style={'width': '49%', 'display': 'inline-block'}),
         dcc.Graph(id='bubble-chart', style={'width': '49%', 'display': 'inline-block'}),
     ]),
-    dcc.Interval(id='interval-component', interval=10 * 60 * 1000, n_intervals=0)
+    dcc.Graph(id='movers-chart'),
+    *optional_panels,
+    # Tells assets/render_timing.js where to report render times
+    html.Div(profiling_route if profiler.enabled else '',
+             id='render-timing-route', hidden=True),
+    # With live updates the interval only loads the page's first data
+    dcc.Interval(id='interval-component', interval=10 * 60 * 1000, n_intervals=0,
+                 max_intervals=0 if live_updates else -1),
+    # Tells assets/live_updates.js where to listen, and the last cycle it got
+    html.Div(live_route if live_updates else '', id='live-route', hidden=True),
+    dcc.Store(id='live-cycle'),
+    # Id and name of the treemap group that is open, None for the top level
+    dcc.Store(id='treemap-group'),
+    # Id and name of the game clicked in the treemap, None for the totals
+    dcc.Store(id='selected-game'),
+    # Ids of the running background jobs and the intervals polling them
+    dcc.Store(id='refresh-job'),
+    dcc.Store(id='content-job'),
+    dcc.Interval(id='refresh-poll', interval=job_poll_interval, disabled=True),
+    dcc.Interval(id='content-poll', interval=job_poll_interval, disabled=True)
 ])
 
+# Reload the overall totals in the background, every open page asks at
+# the same time so they all share one job
 @callback(
-    [Output('datetime_RangeSlider', 'min'),
-     Output('datetime_RangeSlider', 'max'),
-     Output('datetime_RangeSlider', 'value')],
+    [Output('refresh-job', 'data'),
+     Output('refresh-poll', 'disabled')],
     Input('interval-component', 'n_intervals')
 )
-def update_continuous_slider(n_intervals):
+@profiler.profile_callback
+def start_refresh(n_intervals):
+    return jobs.submit(refresh_data, key='refresh'), False
+
+@profiler.profile_job
+def refresh_data(job):
     global df
-    df = fetch_new_data()  # Fetch updated data
-    min_timestamp = df['timestamp'].min().timestamp()
-    max_timestamp = df['timestamp'].max().timestamp()
+    job.report(0.1, 'Fetching player counts')
+    with df_lock:
+        df = fetch_new_data()  # Fetch updated data
+        return df['timestamp'].min().timestamp(), df['timestamp'].max().timestamp()
+
+@callback(
+    [Output('datetime_RangeSlider', 'min'),
+     Output('datetime_RangeSlider', 'max'),
+     Output('datetime_RangeSlider', 'value'),
+     Output('refresh-poll', 'disabled', allow_duplicate=True)],
+    Input('refresh-poll', 'n_intervals'),
+    State('refresh-job', 'data'),
+    prevent_initial_call=True
+)
+@profiler.profile_callback
+def update_continuous_slider(n_intervals, job_id):
+    status = jobs.status(job_id)
+    if status is None or status['state'] in ('failed', 'cancelled'):
+        return no_update, no_update, no_update, True
+    if status['state'] != 'done':
+        return no_update, no_update, no_update, False
+    
+    min_timestamp, max_timestamp = jobs.result(job_id)
 
     # Set slider's min, max, and initial value (full range)
-    return min_timestamp, max_timestamp, [min_timestamp, max_timestamp]
+    return min_timestamp, max_timestamp, [min_timestamp, max_timestamp], True
 
+if trends_enabled:
+    @callback(
+        Output('trend-panel', 'children'),
+        [Input('interval-component', 'n_intervals'),
+         Input('live-cycle', 'data')]
+    )
+    @profiler.profile_callback
+    def update_trend_panel(n_intervals, live_cycle):
+        trending_df, drops_df = fetch_trends()
+        return [
+            create_trend_table(trending_df, 'Trending Now', 'trend_score',
+                               'Growth'),
+            create_trend_table(drops_df, 'Anomalous Drops', 'anomaly_score',
+                               'Deviation'),
+        ]
+
+if seasonality_enabled:
+    # Only matches of the search are sent, the whole catalog is too big
+    @callback(
+        Output('seasonality-select', 'options'),
+        Input('seasonality-select', 'search_value'),
+        State('seasonality-select', 'value')
+    )
+    def update_seasonality_options(search_value, value):
+        if not search_value:
+            return no_update
+        search = search_value.lower()
+        tags = [{'label': f'Tag: {tag}', 'value': f'tag:{tag_id}'}
+                for tag_id, tag in map_tag_name.items() if search in tag.lower()]
+        games = [{'label': name, 'value': f'app:{app_id}'}
+                 for app_id, name in map_id_name.items() if search in name.lower()]
+        options = tags[:20] + games[:20]
+        # Keep the selected option or the dropdown loses its label
+        if value and value not in [option['value'] for option in options]:
+            kind, key_id = value.split(':')
+            names = map_tag_name if kind == 'tag' else map_id_name
+            label = names.get(int(key_id), key_id)
+            options.insert(0, {'label': f'Tag: {label}' if kind == 'tag' else label,
+                               'value': value})
+        return options
+
+    @callback(
+        Output('seasonality-heatmap', 'figure'),
+        [Input('seasonality-select', 'value'),
+         Input('interval-component', 'n_intervals'),
+         Input('live-cycle', 'data')]
+    )
+    @profiler.profile_callback
+    def update_seasonality_heatmap(value, n_intervals, live_cycle):
+        if not value:
+            return create_seasonality_heatmap(None, None)
+        kind, key_id = value.split(':')
+        names = map_tag_name if kind == 'tag' else map_id_name
+        name = names.get(int(key_id), key_id)
+        return create_seasonality_heatmap(fetch_seasonality(kind, int(key_id)), name)
+
+# Clicking a group of the treemap opens it, clicking the open group's own
+# tile goes back to the top level
 @callback(
-    [Output('slider-output', 'children'),
-     Output('player-count', 'figure'),
-     Output('treemap-count', 'figure'),
-     Output('bubble-chart', 'figure')],
-    [Input('datetime_RangeSlider', 'value'),
-     Input('treemap-count', 'hoverData'),
+    Output('treemap-group', 'data'),
+    Input('treemap-count', 'clickData'),
+    State('treemap-group', 'data'),
+    prevent_initial_call=True
+)
+def open_treemap_group(clickData, group):
+    if treemap_group_by is None or not clickData or not clickData['points']:
+        return no_update
+    point = clickData['points'][0]
+    tile_id = str(point.get('id', ''))
+    if group:
+        return None if tile_id == f"group:{group['id']}" else no_update
+    if tile_id.startswith('group:'):
+        return {'id': int(tile_id[len('group:'):]), 'name': point['label']}
+    return no_update
+
+# Clicking a game's tile selects it, the reset button goes back to the
+# totals. Hovering used to select, which started a job per tile passed over
+@callback(
+    Output('selected-game', 'data'),
+    [Input('treemap-count', 'clickData'),
      Input('reset-button', 'n_clicks')],
-    State('reset-button', 'n_clicks_timestamp')
+    prevent_initial_call=True
+)
+def select_game(clickData, n_clicks):
+    if ctx.triggered_id == 'reset-button':
+        return None
+    if not clickData or not clickData['points']:
+        return no_update
+    # Only game tiles select a game, not groups or "Other"
+    point = clickData['points'][0]
+    tile_id = str(point.get('id', ''))
+    if not tile_id.startswith('app:'):
+        return no_update
+    return {'id': int(tile_id[len('app:'):]), 'name': point['label']}
+
+# Start building the figures for a selection in the background, cancelling
+# the job of the previous selection if it's still going
+@callback(
+    [Output('content-job', 'data'),
+     Output('content-poll', 'disabled')],
+    [Input('datetime_RangeSlider', 'value'),
+     Input('selected-game', 'data'),
+     Input('treemap-group', 'data')],
+    State('content-job', 'data')
 )
-def update_content(value, hoverData, n_clicks, reset_timestamp):
+@profiler.profile_callback
+def start_content(value, game, group, previous_job):
+    if previous_job:
+        jobs.cancel(previous_job)
+    return jobs.submit(build_content, value, game, group), False
+
+@profiler.profile_job
+def build_content(job, value, game=None, group=None):
     if not value:
-        return "Select a range to view details.", px.line(title='Player Count Over Time'), create_treemap(pd.DataFrame()), create_bubble_plot(pd.DataFrame())
+        empty = pd.DataFrame(columns=['app_id', 'before', 'after', 'change'])
+        return "Select a range to view details.", px.line(title='Player Count Over Time'), create_treemap(pd.DataFrame()), create_bubble_plot(pd.DataFrame()), create_movers_chart(empty, empty)
 
+    job.report(0.05, 'Finding games')
     valid_apps = return_valid_apps()
     start, end = [pd.to_datetime(ts, unit='s') for ts in value]
     output_text = f"Selected Range: {start.strftime('%d:%m:%Y %H:%M')} - {end.strftime('%d:%m:%Y %H:%M')}"
 
-    if hoverData and hoverData['points'] and (n_clicks == 0 or n_clicks % 2 == 0):
-        selected_game_name = hoverData['points'][0]['label'].split('<br>')[0]
-        selected_game_id = [app_id for app_id, name in map_id_name.items() if name == selected_game_name]
+    # Any new cycle picked up by the interval refresh changes the data version
+    version = df['timestamp'].max()
+
+    selected_game_name = game['name'] if game else None
+    selected_game_id = [game['id']] if game else []
+
+    def build_player_count():
         if selected_game_id:
             filtered_df = fetch_new_data(valid_apps=selected_game_id)
-            filtered_df = filtered_df[(filtered_df['timestamp'] >= start) & (filtered_df['timestamp'] <= end)]
-            fig = px.line(filtered_df, x='timestamp', y='count', title=f'Player Count Over Time for {selected_game_name}')
+            title = f'Player Count Over Time for {selected_game_name}'
         else:
-            filtered_df = df[(df['timestamp'] >= start) & (df['timestamp'] <= end)]
-            fig = px.line(filtered_df, x='timestamp', y='count', title='Player Count Over Time')
-    else:
-        filtered_df = df[(df['timestamp'] >= start) & (df['timestamp'] <= end)]
-        fig = px.line(filtered_df, x='timestamp', y='count', title='Player Count Over Time')
+            filtered_df = df
+            title = 'Player Count Over Time'
+        with profiler.stage('pandas:filter_range'):
+            filtered_df = filtered_df[(filtered_df['timestamp'] >= start) & (filtered_df['timestamp'] <= end)]
+        # Totals up to the latest cycle keep growing as cycles are pushed
+        live = live_updates and not selected_game_id and end >= version
+        with profiler.stage('figure:player_count'):
+            return create_player_count_chart(filtered_df, title, live)
 
-    fig.update_layout(title_x=0.5)
+    job.report(0.15, 'Loading player counts')
+    fig = figure_cache.get_or_build(
+        make_key('player_count', start, end, selected_game_id, version),
+        build_player_count)
     
     # Get our player count by game graph
-    treemap_df = fetch_treemap_data(start, end, valid_apps)
-    tree_fig = create_treemap(treemap_df)
+    def build_treemap():
+        tiles = treemap_tiles(start, end, valid_apps, group)
+        with profiler.stage('figure:create_treemap'):
+            return create_treemap(tiles, group)
+
+    job.report(0.35, 'Loading player distribution')
+    tree_fig = figure_cache.get_or_build(
+        make_key(f"treemap:{group['id']}" if group else 'treemap', start, end,
+                 valid_apps, version), build_treemap)
     
     # Bubble chart for tags
-    tag_df = fetch_tag_data()
-    bubble_chart_fig = create_bubble_plot(tag_df)
+    def build_bubble_plot():
+        tag_df = fetch_tag_data()
+        with profiler.stage('figure:create_bubble_plot'):
+            return create_bubble_plot(tag_df)
+
+    job.report(0.6, 'Loading tags')
+    bubble_chart_fig = figure_cache.get_or_build(
+        make_key('bubble', version=version), build_bubble_plot)
+    
+    # Gainers and losers against the period before the selection
+    def build_movers_chart():
+        gainers, losers = fetch_movers(start, end, version, valid_apps)
+        with profiler.stage('figure:create_movers_chart'):
+            return create_movers_chart(gainers, losers)
+
+    job.report(0.7, 'Loading movers')
+    movers_fig = figure_cache.get_or_build(
+        make_key('movers', start, end, valid_apps, version),
+        build_movers_chart)
+    
+    return output_text, fig, tree_fig, bubble_chart_fig, movers_fig
+
+# Show the progress of the selection's job and its figures once it's done
+@callback(
+    [Output('slider-output', 'children'),
+     Output('job-progress', 'value'),
+     Output('player-count', 'figure'),
+     Output('treemap-count', 'figure'),
+     Output('bubble-chart', 'figure'),
+     Output('movers-chart', 'figure'),
+     Output('content-poll', 'disabled', allow_duplicate=True)],
+    Input('content-poll', 'n_intervals'),
+    State('content-job', 'data'),
+    prevent_initial_call=True
+)
+@profiler.profile_callback
+def update_content(n_intervals, job_id):
+    status = jobs.status(job_id)
+    unchanged = [no_update] * 4
+    if status is None:
+        return no_update, 0, *unchanged, True
+    if status['state'] == 'failed':
+        return f"Failed to load the selection: {status['error']}", 0, *unchanged, True
+    # A cancelled job has already been replaced by the next selection's
+    if status['state'] != 'done':
+        return f"Loading: {status['message']}...", status['progress'], *unchanged, False
     
-    return output_text, fig, tree_fig, bubble_chart_fig
+    output_text, *figures = jobs.result(job_id)
+    return output_text, 1, *figures, True
 
 if __name__ == '__main__':
     app.run(debug=True)
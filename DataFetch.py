@@ -16,17 +16,64 @@ import yaml
 import keyring
 
 #For os information
+import io
 import os
+import tempfile
 import time
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 
 #For database set up
 import mysql.connector as MSQL
+from mysql.connector import errorcode
+from sqlalchemy.exc import SQLAlchemyError
+
+#For versioned schema migrations
+import Migrations
+
+#For pooled connections to the database
+from Database import Database
+
+#For splitting work across several collectors
+import Sharding
+
+#For spooling samples to disk when the database is slow or down
+from Spool import SampleSpool, SpoolFlusher
+
+#For polling each app as often as it needs
+from Scheduler import PollScheduler
+
+#For streaming trend and anomaly statistics
+from Analytics import TrendEngine
+
+#For average and peak players by hour of the week
+from Seasonality import SeasonalityEngine
+
+#For the registry of data sources
+import Plugins
 
 # Setting pandas option to ignore deprecation
 pd.set_option('future.no_silent_downcasting', True)
 
+#App ids polled last cycle, used if the database is unavailable
+last_app_ids = []
+
+#Cycles that finished while the database was unavailable
+pending_cycles = []
+
+#Next page of steamspy's catalog that app_catalog fetches
+catalog_page = 0
+
+#Length of a collection cycle's bucket in seconds
+BUCKET_SECONDS = 600
+
+#How player counts are sent to the database, updated from config.yaml
+bulk_load = {'strategy': 'executemany', 'batch_size': 1000}
+
+#Functions called with (rows, connector) after player counts are committed,
+#rows being [app_id, timestamp, count, cycle_bucket]
+insert_hooks = []
+
 
 #=================================
 #Setting up Functions
@@ -34,10 +81,12 @@ pd.set_option('future.no_silent_downcasting', True)
 
 
 #Function for creating our database
-def setup_database(credentials):
+def setup_database(credentials, allow_local_infile=False, migrations=None):
     """
-    Function that creates the database STEAM. This function uses MySQL 
-    connector to create the database alongside any tables.
+    Function that connects to the database steam_db, creating it if it does
+    not exist, and brings its tables and views up to date with the
+    migrations in Migrations.py. When the schema is current this is a
+    single version check.
     
 
     Parameters
@@ -46,6 +95,9 @@ def setup_database(credentials):
         username - the username of the connection
         password - the password of the connection
         host - the hostname of the connection
+    allow_local_infile : Whether the connection may use LOAD DATA LOCAL
+        INFILE, needed for the load_data bulk load strategy
+    migrations : Dict of database: migrations from config.yaml
         
     Returns
     -------
@@ -53,139 +105,52 @@ def setup_database(credentials):
 
     """
     
-    #Check to see if credentials exists 
+    migrations = migrations or {}
     
     #Creating our connection
-    cnx = MSQL.connect(user=credentials['username'],
-                                 password=credentials['password'],
-                                 host=credentials['host'])
-    cursor = cnx.cursor()
+    try:
+        cnx = MSQL.connect(user=credentials['username'],
+                           password=credentials['password'],
+                           host=credentials['host'],
+                           database='steam_db',
+                           allow_local_infile=allow_local_infile)
     
-    print('Creating Database: steam')
     #Creating our database if it does not exist
-    cursor.execute(
-        "CREATE DATABASE IF NOT EXISTS steam_db;"
-        )
-    
-    #Closing our cursor and connection
-    cursor.close()
-    cnx.database = 'steam_db'
-    
-    #Now we go through and make our tables
-    #We want to insert many tables, let's create a dict for our tables
-    Tables = {}
-    
-    #Now we can go through and define our tables. These will be strings of the create statements
-    Tables['game_info'] = """
-        CREATE TABLE IF NOT EXISTS steam_db.game_info(
-        app_id INT UNSIGNED UNIQUE NOT NULL,
-        name VARCHAR(200) NOT NULL,
-        developer VARCHAR(200) NOT NULL,
-        rating INT UNSIGNED NOT NULL,
-        price DECIMAL(7,2) NOT NULL,
-        PRIMARY KEY(app_id)
-        );
-        """
-    
-    Tables['player_count'] = """
-        CREATE TABLE IF NOT EXISTS steam_db.player_count(
-            app_id INT UNSIGNED NOT NULL,
-            timestamp DATETIME NOT NULL,
-            count INT UNSIGNED NOT NULL,
-            FOREIGN KEY(app_id) REFERENCES game_info(app_id)
-            ON DELETE CASCADE
-            ON UPDATE CASCADE
-            );
-        """
-    
-    Tables['genre'] = """
-        CREATE TABLE IF NOT EXISTS steam_db.genre(
-            genre_id INT UNSIGNED NOT NULL,
-            genre VARCHAR(100) NOT NULL,
-            PRIMARY KEY (genre_id)
-            );
-    """
-    
-    Tables['game_genre'] = """
-        CREATE TABLE IF NOT EXISTS steam_db.game_genre(
-            app_id INT UNSIGNED NOT NULL,
-            genre_id INT UNSIGNED,
-            PRIMARY KEY(app_id,genre_id),
-            FOREIGN KEY(app_id) REFERENCES game_info(app_id),
-            FOREIGN KEY(genre_id) REFERENCES genre(genre_id)
-            ON DELETE CASCADE
-            ON UPDATE CASCADE
-            );
-    """
-    
-    Tables['tag'] = """
-        CREATE TABLE IF NOT EXISTS steam_db.tag(
-            tag_id INT UNSIGNED NOT NULL,
-            tag VARCHAR(100) NOT NULL,
-            PRIMARY KEY (tag_id))
-    """
-    
-    Tables['game_tag'] = """
-        CREATE TABLE IF NOT EXISTS steam_db.game_tag(
-            app_id INT UNSIGNED NOT NULL,
-            tag_id INT UNSIGNED NOT NULL,
-            PRIMARY KEY(app_id,tag_id),
-            FOREIGN KEY(app_id) REFERENCES game_info(app_id),
-            FOREIGN KEY(tag_id) REFERENCES tag(tag_id)
-            ON DELETE CASCADE
-            ON UPDATE CASCADE
-            );
-    """
-    
-    
-    # We'll also define Views which will make things a lot easier for us to 
-    # analyze later
-    Views = {}
-    
-    Views['player_count_by_game'] = """
-        CREATE OR REPLACE VIEW player_count_by_game AS
-        SELECT game_info.app_id, game_info.name, player_count.timestamp,
-        player_count.count
-        FROM game_info
-        INNER JOIN player_count 
-        ON game_info.app_id = player_count.app_id
-        WHERE player_count.timestamp >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH);
-        """
-        
-    Views['complete_game_info'] = """
-        CREATE OR REPLACE VIEW complete_game_info AS
-        SELECT game_info.app_id, name, developer, rating, price, genre, tag
-        FROM game_info 
-        INNER JOIN game_genre ON game_info.app_id = game_genre.app_id
-        INNER JOIN genre ON game_genre.genre_id = genre.genre_id
-        INNER JOIN game_tag ON game_info.app_id = game_tag.app_id
-        INNER JOIN tag ON game_tag.tag_id = tag.tag_id;
-    """
-    
-    #Creating our cursor again
-    cursor = cnx.cursor()
-    
-    #Looping through our tables and creating them
-    for table in Tables.keys():
-        print(f"\tCreating Table: {table}")
-        cursor.execute(Tables[table])
-        cnx.commit()
-    
-    print("Tables successfully created")
-    
-    #Looping through our views and creating them
-    for view in Views.keys():
-        print(f"\tCreating View: {view}")
-        cursor.execute(Views[view])
-        cnx.commit()
-        
-    print("Views successfully created")
-    
-    #Closing our cursor
-    cursor.close()
+    except MSQL.Error as error:
+        if error.errno != errorcode.ER_BAD_DB_ERROR:
+            raise
+        cnx = MSQL.connect(user=credentials['username'],
+                           password=credentials['password'],
+                           host=credentials['host'],
+                           allow_local_infile=allow_local_infile)
+        cursor = cnx.cursor()
+        print('Creating Database: steam')
+        cursor.execute(
+            "CREATE DATABASE IF NOT EXISTS steam_db;"
+            )
+        cursor.close()
+        cnx.database = 'steam_db'
+    
+    #Running any migrations the database hasn't had yet. Manual ones are
+    #only listed, and if another process is migrating for longer than the
+    #lock timeout we carry on with the schema as it is
+    versions = Migrations.applied_versions(cnx)
+    try:
+        versions.update(Migrations.migrate(
+            cnx, migrations, migrations.get('lock_timeout', 60),
+            versions=versions))
+    except RuntimeError as error:
+        print(f'Skipping migrations: {error}')
+    
+    #Once player_count is partitioned it needs partitions for the coming
+    #months
+    if 3 in versions:
+        Migrations.ensure_partitions(
+            cnx, migrations.get('partition_months_ahead', 3))
     
     return cnx
 
+
 #Function for pinging an API and returning the request
 def get_request(url, params=None,attempt=1):
     """
@@ -203,6 +168,9 @@ def get_request(url, params=None,attempt=1):
 
     """
     
+    #Every attempt waits its turn under the host's rate limit
+    Plugins.acquire_host()
+    
     #Attempt to ping the url
     try:
         response = requests.get(url=url,params=params)
@@ -243,8 +211,143 @@ def get_request(url, params=None,attempt=1):
             return None
 
 
+#Function for streaming a json object from an API one entry at a time
+def stream_request(url, params=None, config=None):
+    """
+    Function for requesting a json object from an API and parsing it
+    incrementally, so that a large response never has to be held in memory
+    as a whole.
+
+    Parameters
+    ----------
+    url : String of the URL we are pinging
+        
+    params : Dict of parameters being passed into the API
+    
+    config : Dict of the full config, used for the retry settings
+
+    Returns
+    -------
+    Generator of (key, value) pairs of the top level json object
+
+    """
+    
+    api_params = (config or {}).get('data_fetch', {}).get('api_run_params', {})
+    max_attempts = api_params.get('max_reattempts', 3)
+    pause = api_params.get('pause_between_null_response', 5)
+    
+    for attempt in range(1, max_attempts + 1):
+        Plugins.acquire_host()
+        try:
+            response = requests.get(url=url, params=params, stream=True,
+                                    timeout=60)
+            response.raise_for_status()
+            
+            #Steamspy doesn't always send a charset
+            response.encoding = response.encoding or 'utf-8'
+            
+            yield from iter_json_object(
+                response.iter_content(chunk_size=65536, decode_unicode=True))
+            return
+        
+        #Entries that were already yielded are upserted, so retrying the
+        #whole request is safe
+        except (requests.RequestException, ValueError) as error:
+            print(f'Streaming request failed ({error}), '
+                  f'attempt {attempt} of {max_attempts}')
+            if attempt < max_attempts:
+                time.sleep(pause)
+    
+    print(f'Max retries exceeded.\nIgnoring request with params {params}.')
+    return
+
+
+#Function for incrementally parsing a json object
+def iter_json_object(chunks):
+    """
+    Function for incrementally parsing a top level json object from chunks
+    of text. Only the unparsed tail of the stream and the entry currently
+    being parsed are kept in memory.
+
+    Parameters
+    ----------
+    chunks : Iterable of strings that together make up one json object
+
+    Returns
+    -------
+    Generator of (key, value) pairs of the object. Nothing is yielded if the
+    document is empty or not an object (steamspy sends [] past the last page)
+
+    """
+    
+    decoder = json.JSONDecoder()
+    chunks = iter(chunks)
+    buffer = ''
+    position = 0
+    
+    #Reads the next chunk onto the unparsed tail of the buffer
+    def more():
+        nonlocal buffer, position
+        for chunk in chunks:
+            if chunk:
+                buffer = buffer[position:] + chunk
+                position = 0
+                return True
+        return False
+    
+    #Skips whitespace and returns the next character without consuming it
+    def next_char():
+        nonlocal position
+        while True:
+            while position < len(buffer) and buffer[position].isspace():
+                position += 1
+            if position < len(buffer):
+                return buffer[position]
+            if not more():
+                return None
+    
+    #Decodes one json value, reading more chunks until it is complete
+    def decode():
+        nonlocal position
+        while True:
+            try:
+                value, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not more():
+                    raise
+                continue
+            #A number can be cut off at the end of a chunk
+            if end == len(buffer) and more():
+                continue
+            position = end
+            return value
+    
+    if next_char() != '{':
+        return
+    position += 1
+    
+    while True:
+        char = next_char()
+        if char is None:
+            raise ValueError('Unexpected end of json object')
+        if char == '}':
+            return
+        if char == ',':
+            position += 1
+            continue
+        
+        key = decode()
+        if next_char() != ':':
+            raise ValueError(f'Expected : after key {key}')
+        position += 1
+        next_char()
+        
+        yield key, decode()
+
+
 #Function for getting game data
-def get_game_data(config,connector,initial=False):
+def get_game_data(config,connector,initial=False,shards=None,spool=None,
+                  scheduler=None):
     """
     Function to get information about games and store in SQL table
 
@@ -256,6 +359,15 @@ def get_game_data(config,connector,initial=False):
         Note that parser is just the name of the function.
     pause : How long in seconds to tell the system to sleep
     connector : Connection to MySQL to update tables
+    shards : List of shard ids this collector holds leases on. Only apps
+        where MOD(app_id, num_shards) is in the list are polled. None polls
+        every app.
+    spool : SampleSpool that data of spooled sources is appended to
+        instead of being inserted. If given, connector can be None when the
+        database is unavailable, in which case last cycle's apps are polled
+        and only spooled data is collected.
+    scheduler : PollScheduler deciding which apps player_counts polls this
+        cycle. None polls every app every cycle.
     
 
     Returns
@@ -274,52 +386,125 @@ def get_game_data(config,connector,initial=False):
     #If we don't have any parsers, we replace the None type with an empty list
     if parsers == None:
         parsers = []
-        
-    #First call to update the game info table
-    if 'app_information' in parsers:
-        app_information(connector)
     
-    #Now pull from the game_info table
-    cursor = connector.cursor()
+    #Registered sources that run this cycle, the catalog functions aren't
+    #per app so they're run on their own below
+    bucket = time_to_bucket(hour_rounder(datetime.now()))
+    plugins = [plugin for plugin in Plugins.get_plugins(
+                   [fn for fn in parsers
+                    if fn not in ('app_information', 'app_catalog')], config)
+               if initial or plugin.is_due(bucket)]
     
-    cursor.execute("""
-                   SELECT app_id
-                   FROM game_info;
-                   """
-                   )
-    
-    #Create a dict that has data for each function
-    return_dict = {}
+    #Without a database we can only collect what goes to the spool
+    if connector is None:
+        parsers = []
+        plugins = [plugin for plugin in plugins
+                   if spool is not None and plugin.spooled]
+        
+    #First call to update the game info table. When sharded only the holder
+    #of shard 0 refreshes it so the workers don't all hit steamspy
+    if 'app_information' in parsers and (shards is None or 0 in shards):
+        app_information(connector)
     
-    functions = [fn for fn in parsers if fn != 'app_information']
+    #Or walk the full catalog instead of just the top 100
+    if 'app_catalog' in parsers and (shards is None or 0 in shards):
+        app_catalog(connector, config, initial=initial)
     
-    for fn in parsers:
-        return_dict[fn] = []
+    #Without a database we poll the same apps as last cycle
+    if connector is None:
+        app_ids = list(last_app_ids)
+        cursor = None
     
-    #Loop through the rows of our game_list
-    for appid in cursor:
+    #Now pull from the game_info table
+    else:
+        cursor = connector.cursor()
+    
+    if cursor is None:
+        pass
+    elif shards is None:
+        cursor.execute("""
+                       SELECT app_id
+                       FROM game_info;
+                       """
+                       )
+    #Only our shards if we're one of several collectors
+    elif shards:
+        num_shards = config['data_fetch']['sharding']['num_shards']
+        shard_str = ', '.join(str(int(shard)) for shard in shards)
+        cursor.execute(f"""
+                       SELECT app_id
+                       FROM game_info
+                       WHERE MOD(app_id, %s) IN ({shard_str});
+                       """, (num_shards,)
+                       )
+    #No shards held this cycle so there is nothing to poll
+    else:
+        cursor.close()
+        return
+    
+    if cursor is not None:
+        app_ids = cursor.fetchall()
+        last_app_ids[:] = app_ids
+    
+    #Player counts are collected as one cycle with a single bucket
+    cycle = None
+    due_apps = None
+    if any(plugin.name == 'player_counts' for plugin in plugins):
+        num_shards = config['data_fetch'].get('sharding', {}).get('num_shards', 1)
+        cycle = open_cycle(None, len(app_ids), shards, num_shards)
         
-        #Loop through our functions
-        for fn in functions:
-                       
-            #Now we retrieve the data with the parser logic
-            data = eval(f'{fn}(appid)')
-            if data:
-                return_dict[fn].append(data)
+        #Only the apps that are due get polled when polling is adaptive
+        if scheduler is not None:
+            due_apps = scheduler.due([appid[0] for appid in app_ids],
+                                     cycle['bucket'])
+            cycle['apps_expected'] = len(due_apps)
         
+        if connector is not None:
+            record_cycle_start(connector, cycle)
     
+    #The apps each source polls this cycle
+    app_rows = {}
+    for plugin in plugins:
+        app_rows[plugin.name] = list(app_ids)
         
-        #Prevents overloading the api
-        time.sleep(config['data_fetch']['api_run_params']['pause_between_calls'])
+        #Skip player counts of apps that aren't due this cycle
+        if plugin.name == 'player_counts' and due_apps is not None:
+            app_rows[plugin.name] = [appid for appid in app_ids
+                                     if appid[0] in due_apps]
+    
+    #Now we retrieve the data of every source at once, each at its own rate
+    return_dict = Plugins.run_plugins(plugins, app_rows, cycle,
+                                      Plugins.limiters_from_config(config))
     
     #Insert data into SQL table
-    for fn in functions:
-        # Check that we have the data 
-        if fn in return_dict.keys():
-            eval(f'{fn}_insert(return_dict[fn],connector)')
+    for plugin in plugins:
+        #Spooled data is loaded into the database by the flusher
+        if spool is not None and plugin.spooled:
+            spool.append(return_dict[plugin.name])
+            print(f'{len(return_dict[plugin.name])} {plugin.name} samples '
+                  f'spooled at {get_current_time()}')
+        else:
+            plugin.insert(return_dict[plugin.name], connector)
+    
+    #Recording the cycle's coverage and total
+    if cycle is not None:
+        carried = (0, 0)
+        
+        #Apps that weren't due carry their last count into the total
+        if scheduler is not None:
+            samples = return_dict['player_counts']
+            scheduler.update(samples, cycle['bucket'])
+            carried = scheduler.carried_players(
+                [appid[0] for appid in app_ids],
+                {sample[0] for sample in samples}, cycle['bucket'])
+            if connector is not None:
+                scheduler.save(connector)
+        
+        close_cycle(connector, cycle, return_dict['player_counts'], carried)
 
     
-    cursor.close()
+    if cursor is not None:
+        cursor.close()
     
     return
 
@@ -372,10 +557,186 @@ def get_current_time():
     current_time = f'{year}-{month}-{day}-{hour}:{minute}:00'
     
     return current_time
+
+
+#Function for getting the epoch bucket of a time
+def time_to_bucket(t):
+    """
+    Function for converting a time to its integer 10 minute epoch bucket.
+    Times are naive local times and are treated as UTC so that the bucket
+    converts back to the same wall clock time.
+
+    Parameters
+    ----------
+    t : datetime, already rounded with hour_rounder
+
+    Returns
+    -------
+    Integer bucket, seconds since the epoch divided by BUCKET_SECONDS
+
+    """
+    return int(t.replace(tzinfo=timezone.utc).timestamp()) // BUCKET_SECONDS
+
+
+#Function for getting the time of an epoch bucket
+def bucket_to_string(bucket):
+    """
+    Function for converting a 10 minute epoch bucket to the timestamp string
+    stored in player_count
+
+    Parameters
+    ----------
+    bucket : Integer bucket from time_to_bucket
+
+    Returns
+    -------
+    Timestamp string in the same format as get_current_time
+
+    """
+    return datetime.fromtimestamp(bucket * BUCKET_SECONDS,
+                                  timezone.utc).strftime('%Y-%m-%d-%H:%M:00')
+
+
+#Function for starting a collection cycle
+def open_cycle(connector, app_count, shards=None, num_shards=1):
+    """
+    Function for starting a collection cycle. The cycle gets one bucket,
+    taken from the time it starts, which every sample of the cycle uses so
+    that a cycle can't straddle two buckets.
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server, or None if it is unavailable
+        in which case the cycle is recorded when it is closed
+    app_count : Number of apps this collector will poll
+    shards : List of shards this collector holds, None if not sharded
+    num_shards : Total number of shards
+
+    Returns
+    -------
+    Dict describing the cycle
+
+    """
+    started_at = datetime.now()
+    bucket = time_to_bucket(hour_rounder(started_at))
+    
+    cycle = {
+        'bucket' : bucket,
+        'timestamp' : bucket_to_string(bucket),
+        'started_at' : started_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'shards_total' : num_shards if shards is not None else 1,
+        'shards_sampled' : len(shards) if shards is not None else 1,
+        'apps_expected' : app_count,
+        'started' : False
+        }
+    
+    if connector is not None:
+        record_cycle_start(connector, cycle)
+    
+    return cycle
+
+
+#Function for recording the start of a cycle
+def record_cycle_start(connector, cycle):
+    """
+    Function for adding this collector's start of a cycle to its
+    collection_cycle row
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    cycle : Dict from open_cycle
+
+    Returns
+    -------
+    None
+
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+                   INSERT INTO collection_cycle
+                   (bucket, started_at, shards_total, workers_started,
+                    apps_expected)
+                   VALUES (%(bucket)s, %(started_at)s, %(shards_total)s, 1,
+                           %(apps_expected)s)
+                   ON DUPLICATE KEY UPDATE
+                       started_at = LEAST(started_at, VALUES(started_at)),
+                       shards_total = VALUES(shards_total),
+                       workers_started = workers_started + 1,
+                       apps_expected = apps_expected + VALUES(apps_expected);
+                   """, cycle)
+    connector.commit()
+    cursor.close()
+    
+    cycle['started'] = True
+    
+    return
+
+
+#Function for finishing a collection cycle
+def close_cycle(connector, cycle, samples, carried=(0, 0)):
+    """
+    Function for recording the coverage and total players of a finished
+    cycle. If the database is unavailable the cycle is kept in
+    pending_cycles and recorded with the next cycle that can reach it.
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server, or None if it is unavailable
+    cycle : Dict from open_cycle
+    samples : List of player_counts samples collected in the cycle
+    carried : Tuple of (apps, players) forward filled from earlier cycles
+        for apps that weren't polled this cycle
+
+    Returns
+    -------
+    None
+
+    """
+    cycle['finished_at'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    cycle['apps_sampled'] = len(samples)
+    cycle['apps_carried'] = carried[0]
+    cycle['total_players'] = int(sum(sample[2] for sample in samples)
+                                 + carried[1])
+    
+    pending_cycles.append(cycle)
+    
+    if connector is None:
+        return
+    
+    cursor = connector.cursor()
+    
+    while pending_cycles:
+        pending = pending_cycles[0]
+        
+        if not pending['started']:
+            record_cycle_start(connector, pending)
+        
+        cursor.execute("""
+                       UPDATE collection_cycle
+                       SET finished_at = GREATEST(
+                               COALESCE(finished_at, %(finished_at)s),
+                               %(finished_at)s),
+                           workers_finished = workers_finished + 1,
+                           shards_sampled = shards_sampled + %(shards_sampled)s,
+                           apps_sampled = apps_sampled + %(apps_sampled)s,
+                           apps_carried = apps_carried + %(apps_carried)s,
+                           total_players = total_players + %(total_players)s
+                       WHERE bucket = %(bucket)s;
+                       """, pending)
+        connector.commit()
+        pending_cycles.pop(0)
+    
+    cursor.close()
+    
+    print(f"Cycle {cycle['timestamp']} sampled {cycle['apps_sampled']} of "
+          f"{cycle['apps_expected']} apps, {cycle['total_players']} players")
+    
+    return
     
 
 #Creating function to parse a steam player count
-def player_counts(appid):
+def player_counts(appid, cycle=None):
     """
     Function for parsing player count. Current player count is inserted into 
     the corresponding SQL table
@@ -384,6 +745,8 @@ def player_counts(appid):
     ----------
     appid : The ID of the game we are attempting
     name : The name of the game we are attempting (unused)
+    cycle : Dict from open_cycle, the sample gets the cycle's timestamp.
+        Without one the current time is rounded instead.
 
     Returns
     -------
@@ -397,18 +760,23 @@ def player_counts(appid):
 
     #Only if we get a response
     if response:
+        #Every sample of a cycle shares the cycle's timestamp
+        if cycle is not None:
+            current_time = cycle['timestamp']
+        
         #Now we get our timestamp to insert into the table
-        current_time = hour_rounder(datetime.now())
-    
-        #Making this a string
-        year = current_time.year
-        month = f'0{current_time.month}'[-2:]
-        day = f'0{current_time.day}'[-2:]
-        hour = f'0{current_time.hour}'[-2:]
-        minute = f'0{current_time.minute}'[-2:]
-    
-        #Actually making the string
-        current_time = f'{year}-{month}-{day}-{hour}:{minute}:00'
+        else:
+            current_time = hour_rounder(datetime.now())
+        
+            #Making this a string
+            year = current_time.year
+            month = f'0{current_time.month}'[-2:]
+            day = f'0{current_time.day}'[-2:]
+            hour = f'0{current_time.hour}'[-2:]
+            minute = f'0{current_time.minute}'[-2:]
+        
+            #Actually making the string
+            current_time = f'{year}-{month}-{day}-{hour}:{minute}:00'
     
         return_data = [appid[0],current_time,response['response']['player_count']]
     
@@ -420,7 +788,8 @@ def player_counts(appid):
 
 
 #Creating function to insert player counts into table
-def player_counts_insert(data, connector):
+def player_counts_insert(data, connector, strategy=None, batch_size=None,
+                         hooks=True, commit=True):
     """
     Function for inserting player count values into a table. 
 
@@ -433,6 +802,22 @@ def player_counts_insert(data, connector):
             playercount
     
     connector : A connector to MySQL server to use to insert data
+    
+    strategy : How the rows are sent, defaults to bulk_load['strategy']
+        executemany - one executemany of single row inserts
+        values - multi-row INSERT ... VALUES statements of batch_size rows
+        load_data - LOAD DATA LOCAL INFILE of the rows written out as tab
+            separated text. The connection needs allow_local_infile=True
+            and the server needs local_infile enabled.
+    
+    batch_size : Rows per statement for the values strategy, defaults to
+        bulk_load['batch_size']
+    
+    hooks : Whether to run the insert hooks once the rows are committed.
+        The spool flusher runs them itself after recording its offset.
+    
+    commit : Whether to commit the rows. The spool flusher commits them
+        together with its offset.
 
     Returns
     -------
@@ -440,18 +825,42 @@ def player_counts_insert(data, connector):
 
     """
     
+    strategy = strategy or bulk_load['strategy']
+    batch_size = batch_size or bulk_load['batch_size']
+    
+    rows = player_count_rows(data)
+    columns = ['app_id', 'timestamp', 'count', 'cycle_bucket']
+    
     #Creating the cursor
     cursor = connector.cursor()
     
     #Inserting our data into the player_counts table
-    cursor.executemany("""
-                       INSERT INTO player_count(app_id, timestamp, count)
-                       VALUES ( %s, %s, %s)
-                       """,data)
+    if strategy == 'values':
+        insert_values_batches(cursor, 'player_count', columns, rows,
+                              batch_size)
+    
+    elif strategy == 'load_data':
+        load_data_infile(cursor, 'player_count', columns, rows)
+    
+    elif strategy == 'executemany':
+        cursor.executemany("""
+                           INSERT INTO player_count(app_id, timestamp, count,
+                                                    cycle_bucket)
+                           VALUES ( %s, %s, %s, %s)
+                           """,rows)
+    
+    else:
+        cursor.close()
+        raise ValueError(f'Unknown bulk load strategy {strategy}')
 
-    connector.commit()
+    if commit:
+        connector.commit()
     cursor.close()
     
+    #Anything that keeps statistics up to date as samples arrive
+    if hooks:
+        run_insert_hooks(rows, connector)
+    
 
     #Actually making the string
     current_time = get_current_time()
@@ -460,6 +869,145 @@ def player_counts_insert(data, connector):
     
     return
 
+#Function for adding the cycle bucket to player count samples
+def player_count_rows(data):
+    """
+    Function for the rows of player_count of a list of samples
+
+    Parameters
+    ----------
+    data : List of [app_id, timestamp string, player count]
+
+    Returns
+    -------
+    List of [app_id, timestamp string, player count, cycle_bucket]
+
+    """
+    
+    #Each sample refers to the cycle bucket of its timestamp
+    buckets = {}
+    for row in data:
+        if row[1] not in buckets:
+            buckets[row[1]] = time_to_bucket(
+                datetime.strptime(row[1], '%Y-%m-%d-%H:%M:%S'))
+    
+    return [[app_id, timestamp, count, buckets[timestamp]]
+            for app_id, timestamp, count in data]
+
+
+#Function for running the insert hooks on committed rows
+def run_insert_hooks(rows, connector):
+    """
+    Function for calling every insert hook with rows that have been
+    committed. The rows are already in the database, so a failing hook is
+    reported and the rest still run rather than the insert being retried.
+
+    Parameters
+    ----------
+    rows : List of [app_id, timestamp, count, cycle_bucket]
+    
+    connector : A connector to MySQL server
+
+    Returns
+    -------
+    None
+
+    """
+    
+    for hook in insert_hooks:
+        try:
+            hook(rows, connector)
+        except Exception as error:
+            print(f'Insert hook {getattr(hook, "__qualname__", hook)} '
+                  f'failed: {error!r}')
+    
+    return
+
+
+#Function for inserting rows with multi-row VALUES statements
+def insert_values_batches(cursor, table, columns, data, batch_size):
+    """
+    Function for inserting rows as INSERT statements of up to batch_size
+    rows each, so the server does one statement per batch instead of one
+    per row. Nothing is committed.
+
+    Parameters
+    ----------
+    cursor : Cursor of a MySQL connection
+    table : Name of the table to insert into
+    columns : List of column names, in the order of each row
+    data : List of rows to insert
+    batch_size : Maximum number of rows per statement
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    row_placeholder = '(' + ', '.join(['%s'] * len(columns)) + ')'
+    column_str = ', '.join(columns)
+    
+    for start in range(0, len(data), batch_size):
+        batch = data[start:start + batch_size]
+        
+        query = (f'INSERT INTO {table}({column_str}) VALUES '
+                 + ', '.join([row_placeholder] * len(batch)))
+        
+        cursor.execute(query, [value for row in batch for value in row])
+    
+    return
+
+
+#Function for streaming rows to the server with LOAD DATA
+def load_data_infile(cursor, table, columns, data):
+    """
+    Function for loading rows with LOAD DATA LOCAL INFILE. The rows are
+    written to an in-memory tab separated buffer, which is handed to the
+    connector through a temporary file since mysql-connector can only send
+    local files by name. Nothing is committed.
+
+    Parameters
+    ----------
+    cursor : Cursor of a MySQL connection opened with allow_local_infile
+    table : Name of the table to load into
+    columns : List of column names, in the order of each row
+    data : List of rows to load
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    if len(data) == 0:
+        return
+    
+    buffer = io.StringIO()
+    for row in data:
+        buffer.write('\t'.join(str(value) for value in row))
+        buffer.write('\n')
+    
+    #Closed before loading so this also works on Windows
+    file = tempfile.NamedTemporaryFile('w', suffix='.tsv', delete=False,
+                                       encoding='utf-8')
+    try:
+        file.write(buffer.getvalue())
+        file.close()
+        
+        cursor.execute(f"""
+                       LOAD DATA LOCAL INFILE %s
+                       INTO TABLE {table}
+                       FIELDS TERMINATED BY '\\t'
+                       LINES TERMINATED BY '\\n'
+                       ({', '.join(columns)});
+                       """, (file.name,))
+    finally:
+        os.remove(file.name)
+    
+    return
+
+
 #Function for fetching the top 100 games of the last 2 weeks
 def app_information(connector):
     """
@@ -542,14 +1090,155 @@ def app_information(connector):
     return
     
 
+#Function for walking steamspy's full catalog
+def app_catalog(connector, config, initial=False):
+    """
+    Function for fetching every app steamspy lists. Steamspy's all request
+    is paged and only allowed once a minute, so the first run walks every
+    page and each cycle after that fetches the next pages_per_cycle pages,
+    starting over once it's past the end. Each page is parsed incrementally
+    and upserted into game_info in bounded batches, so memory use and commit
+    size stay the same however large the catalog gets, and a cycle doesn't
+    wait on more than a few pages.
+    
+    Parameters
+    ----------    
+    connector : A connector to MySQL server to use to insert data
+    
+    config : Dict of the full config
+    
+    initial : Whether to walk the whole catalog from the first page
+    
+    Returns
+    -------
+    None
+
+    """
+    
+    global catalog_page
+    
+    settings = config['data_fetch'].get('catalog', {})
+    batch_size = settings.get('batch_size', 500)
+    max_pages = settings.get('max_pages')
+    pause = settings.get('pause_between_pages', 60)
+    pages_per_cycle = settings.get('pages_per_cycle', 1)
+    
+    if initial:
+        catalog_page = 0
+    
+    pages = 0
+    total = 0
+    
+    while initial or pages < pages_per_cycle:
+        
+        #Steamspy only allows one request of all per minute
+        if pages:
+            time.sleep(pause)
+        
+        batch = []
+        page_apps = 0
+        
+        for appid, app in stream_request('https://steamspy.com/api.php',
+                                         params={'request': 'all',
+                                                 'page': catalog_page},
+                                         config=config):
+            page_apps += 1
+            
+            #Some listings have no name, we can't show those
+            if not app.get('name'):
+                continue
+            
+            positive = int(app.get('positive') or 0)
+            negative = int(app.get('negative') or 0)
+            reviews = positive + negative
+            
+            batch.append({
+                'app_id' : int(appid),
+                'name' : app['name'][:200],
+                'developer' : (app.get('developer') or '')[:200],
+                'rating' : int(positive / reviews * 100) if reviews else 0,
+                'price' : int(app.get('initialprice') or 0) / 100
+                })
+            
+            if len(batch) >= batch_size:
+                app_catalog_insert(batch, connector)
+                total += len(batch)
+                batch = []
+        
+        if batch:
+            app_catalog_insert(batch, connector)
+            total += len(batch)
+        
+        pages += 1
+        
+        #An empty page means we're past the end of the catalog, the next
+        #cycle starts over from the first page
+        if page_apps == 0 or (max_pages is not None
+                              and catalog_page + 1 >= max_pages):
+            print(f'Catalog walked to page {catalog_page}, starting over')
+            catalog_page = 0
+            break
+        
+        print(f'Catalog page {catalog_page} ingested, {total} apps so far')
+        catalog_page += 1
+    
+    current_time = get_current_time()
+    
+    print(f'game_info table updated with {total} catalog apps at {current_time}')
+    
+    return
+
+
+#Function for upserting a batch of catalog apps
+def app_catalog_insert(data, connector):
+    """
+    Function for upserting a batch of apps into game_info and committing it
+
+    Parameters
+    ----------
+    data : list of dicts with app_id, name, developer, rating and price
+    
+    connector : A connector to MySQL server to use to insert data
+
+    Returns
+    -------
+    None.
+
+    """
+    
+    cursor = connector.cursor()
+    
+    cursor.executemany("""
+                       INSERT INTO game_info
+                       (app_id,
+                        name,
+                        developer,
+                        rating,
+                        price)
+                       VALUES (
+                           %(app_id)s,%(name)s,%(developer)s,%(rating)s,%(price)s)
+                       ON DUPLICATE KEY UPDATE
+                           name = VALUES(name),
+                           developer = VALUES(developer),
+                           rating = VALUES(rating),
+                           price = VALUES(price);
+                       """, data)
+    
+    connector.commit()
+    cursor.close()
+    
+    return
+    
+
 #Function for getting other information about a game
-def game_tags_genres(app_id):
+def game_tags_genres(app_id, cycle=None):
     """
     Function for getting the game genre and tags for a specific game.
 
     Parameters
     ----------
     app_id : The app ID of the game you are querying for.
+    cycle : Dict from open_cycle (unused)
 
     Returns
     -------
@@ -777,6 +1466,21 @@ def game_tags_genres_insert(data, connector):
         
     
     
+#=================================
+#Registered Data Sources
+#=================================
+
+
+Plugins.register(Plugins.SourcePlugin(
+    'player_counts', fetch=player_counts, insert=player_counts_insert,
+    concurrency=4, host='api.steampowered.com', spooled=True))
+
+Plugins.register(Plugins.SourcePlugin(
+    'game_tags_genres', fetch=game_tags_genres,
+    insert=game_tags_genres_insert, host='steamspy.com'))
+        
+    
+    
 #Now we actually do the main function
 if __name__ == '__main__':
     
@@ -801,11 +1505,74 @@ if __name__ == '__main__':
         credentials['password'] = str(input("Password:"))
         credentials['host'] = str(input('Host:'))
     
+    #Sources from other modules register themselves when imported
+    Plugins.load_plugin_modules(config)
+    
+    #How player counts are inserted
+    bulk_load.update(config['data_fetch'].get('bulk_load', {}))
+    
+    #Trend statistics are updated as player counts are inserted
+    trends = None
+    if config['data_fetch'].get('trends', {}).get('enabled'):
+        trends = TrendEngine.from_config(config)
+        insert_hooks.append(trends.update)
+    
+    #So are the seasonality cubes of each app and tag
+    seasonality = None
+    if config['data_fetch'].get('seasonality', {}).get('enabled'):
+        seasonality = SeasonalityEngine.from_config(config)
+        insert_hooks.append(seasonality.update)
+    local_infile = bulk_load['strategy'] == 'load_data'
+    
     #Setting up our connection and database
-    cnx = setup_database(credentials)
+    cnx = setup_database(
+        credentials, allow_local_infile=local_infile,
+        migrations=config.get('database', {}).get('migrations'))
+    
+    #If we are one of several collectors we only poll the shards we lease
+    sharding = config['data_fetch'].get('sharding', {})
+    shards = None
+    if sharding.get('enabled'):
+        worker_id = Sharding.worker_identity(config)
+        Sharding.ensure_shards(cnx, sharding['num_shards'])
+        shards = Sharding.claim_shards(cnx, worker_id,
+                                       sharding['num_shards'],
+                                       sharding['lease_seconds'])
+        print(f'Worker {worker_id} holds shards {shards}')
+    
+    #Connections come from a pool once the database has been set up.
+    #Closing one hands it back to the pool
+    database = Database.from_config(
+        config, credentials, 'collector',
+        connect_args={'allow_local_infile': local_infile})
+    connect = database.connect
+    
+    #Samples are written to a local spool first and loaded in the background
+    spool_settings = config['data_fetch'].get('spool', {})
+    spool = None
+    if spool_settings.get('enabled'):
+        spool = SampleSpool(spool_settings['path'])
+        flusher = SpoolFlusher(
+            spool, connect,
+            lambda data, cnx: player_counts_insert(data, cnx, hooks=False,
+                                                   commit=False),
+            interval=spool_settings['flush_interval'],
+            batch_size=spool_settings['batch_size'],
+            on_commit=lambda data, cnx: run_insert_hooks(
+                player_count_rows(data), cnx))
+        flusher.start()
+        print(f'Spooling samples to {spool.path}, {spool.pending()} pending')
+    
+    #Polling each app as often as its player count needs
+    scheduler = None
+    if config['data_fetch'].get('scheduling', {}).get('enabled'):
+        scheduler = PollScheduler.from_config(config)
+        scheduler.load(cnx)
+        print(f'Loaded polling schedule of {len(scheduler.state)} apps')
     
     #Run initial functions
-    get_game_data(config,cnx,initial=True)
+    get_game_data(config,cnx,initial=True,shards=shards,spool=spool,
+                  scheduler=scheduler)
     
     #Closing the connection, we reopen when we need to update the table
     cnx.close()
@@ -813,46 +1580,87 @@ if __name__ == '__main__':
 
     
     #Creating our program loop
-    while(True):
-        
-        #Determining how long until next cycle
-        minutes = config['data_fetch']['run_on_cycle']['update_cycle_time']
-        current_time = datetime.now()
-        
-        min_wait = 60
-        #Loop through times
-        for minute in minutes:
-            #If replacing the minute is smaller, we've passed that time
-            if current_time.replace(minute=minute) < current_time:
-                wait = (current_time.replace(minute=minute)+timedelta(hours=1)-
-                        current_time)
-            #Otherwise we haven't
-            else:
-                wait = (current_time.replace(minute=minute)-current_time)
+    try:
+        while(True):
+        
+            #Determining how long until next cycle
+            minutes = config['data_fetch']['run_on_cycle']['update_cycle_time']
+            current_time = datetime.now()
+        
+            min_wait = 60
+            #Loop through times
+            for minute in minutes:
+                #If replacing the minute is smaller, we've passed that time
+                if current_time.replace(minute=minute) < current_time:
+                    wait = (current_time.replace(minute=minute)+timedelta(hours=1)-
+                            current_time)
+                #Otherwise we haven't
+                else:
+                    wait = (current_time.replace(minute=minute)-current_time)
                 
-            #Is the min wait smaller?
-            if min_wait > wait.seconds//60:
-                min_wait = wait.seconds//60
+                #Is the min wait smaller?
+                if min_wait > wait.seconds//60:
+                    min_wait = wait.seconds//60
         
-        #Waiting specified minutes for next API attempt
-        print(f'\rWaiting {min_wait} minutes for next update cycle',end='')
-        time.sleep(30)  
+            #Waiting specified minutes for next API attempt
+            print(f'\rWaiting {min_wait} minutes for next update cycle',end='')
+            time.sleep(30)  
         
-        if datetime.now().minute in config['data_fetch']['run_on_cycle']['update_cycle_time']:
+            if datetime.now().minute in config['data_fetch']['run_on_cycle']['update_cycle_time']:
             
-            print('\n',end='')
+                print('\n',end='')
             
-            #Connect to the database
-            cnx = MSQL.connect(user=credentials['username'],
-                                         password=credentials['password'],
-                                         host=credentials['host'],
-                                         database='steam_db')
+                #Connect to the database. With a spool we keep collecting
+                #even if it is down
+                try:
+                    cnx = connect()
+                except (MSQL.Error, SQLAlchemyError) as error:
+                    if spool is None:
+                        raise
+                    print(f'Database unavailable ({error}), spooling samples')
+                    cnx = None
             
-            #Updating our game_info table
-            get_game_data(config,cnx)
+                #Renewing our leases and picking up any orphaned shards
+                if shards is not None and cnx is not None:
+                    shards = Sharding.claim_shards(cnx, worker_id,
+                                                   sharding['num_shards'],
+                                                   sharding['lease_seconds'])
+                    print(f'Worker {worker_id} holds shards {shards}')
+                
+                #Updating our game_info table
+                get_game_data(config,cnx,shards=shards,spool=spool,
+                              scheduler=scheduler)
             
-            #Now that we're done with the connection for now, we close the database
-            cnx.close()
+                #Now that we're done with the connection for now, we close the database
+                if cnx is not None:
+                    cnx.close()
+                
+                #Load this cycle's samples straight away
+                if spool is not None:
+                    flusher.wake()
+                
+                #How long the cycle and the flusher waited on the pool
+                wait = database.pool_stats()['write'].get('wait_ms')
+                if wait:
+                    print(f'Connection pool wait p50 {wait["p50"]:.1f}ms, '
+                          f'p95 {wait["p95"]:.1f}ms')
             
-            #So we don't double insert at a minute
-            time.sleep(60)
\ No newline at end of file
+                #So we don't double insert at a minute
+                time.sleep(60)
+    
+    #Hand our shards back so other workers don't wait for the leases to expire
+    except KeyboardInterrupt:
+        if spool is not None:
+            flusher.stop()
+        #Trend states and seasonality cubes are only written every
+        #save_interval
+        for engine in (trends, seasonality):
+            if engine is not None:
+                cnx = connect()
+                engine.flush(cnx)
+                cnx.close()
+        if shards is not None:
+            cnx = connect()
+            Sharding.release_shards(cnx, worker_id)
+            cnx.close()
+            print(f'\nWorker {worker_id} released its shards')
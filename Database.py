@@ -0,0 +1,199 @@
+# -*- coding: utf-8 -*-
+"""
+Shared database access for the collector and the dashboard.
+
+Both sides get their connections from SQLAlchemy connection pools built
+from one database section of config.yaml: pool size, overflow, pre-ping and
+recycle are set per role, so the collector keeps a small pool of writers
+and the dashboard a larger pool of readers. Dashboard reads can be routed
+to a read replica so long analysis scans don't compete with ingest writes
+on the primary. The time every checkout waits for a connection is recorded
+so a starved pool shows up in the stats.
+"""
+
+import os
+import threading
+import time
+from collections import deque
+
+import numpy as np
+from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
+from sqlalchemy.pool import QueuePool
+
+
+class TimedQueuePool(QueuePool):
+    """
+    QueuePool that records how long each checkout waited for a connection,
+    including the time to open a new one.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = deque(maxlen=1000)
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except Exception:
+            with self._stats_lock:
+                self.timeouts += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.waits.append((time.perf_counter() - start) * 1000)
+
+    def recreate(self):
+        #Keep the stats when the pool is rebuilt, e.g. after dispose
+        pool = super().recreate()
+        pool.waits = self.waits
+        pool.timeouts = self.timeouts
+        return pool
+
+    def stats(self):
+        """
+        Checkout and wait statistics of the pool
+
+        Returns
+        -------
+        Dict of size, checked_out, overflow, timeouts and wait_ms p50, p95
+        and max over the recent checkouts
+
+        """
+        with self._stats_lock:
+            waits = list(self.waits)
+            timeouts = self.timeouts
+        stats = {'size': self.size(), 'checked_out': self.checkedout(),
+                 'overflow': max(self.overflow(), 0), 'timeouts': timeouts,
+                 'checkouts': len(waits)}
+        if waits:
+            stats['wait_ms'] = {'p50': float(np.percentile(waits, 50)),
+                                'p95': float(np.percentile(waits, 95)),
+                                'max': float(np.max(waits))}
+        return stats
+
+
+#Function for the SQLAlchemy URL of a set of credentials
+def mysql_url(credentials, database='steam_db'):
+    """
+    Function for building a mysql-connector URL from config credentials
+
+    Parameters
+    ----------
+    credentials : Dict with username, password, host and optionally port
+    database : Name of the database
+
+    Returns
+    -------
+    sqlalchemy URL
+
+    """
+    return URL.create('mysql+mysqlconnector',
+                      username=credentials['username'],
+                      password=credentials['password'],
+                      host=credentials['host'],
+                      port=credentials.get('port', 3306),
+                      database=database)
+
+
+class Database:
+    """
+    Pooled engines for writes to the primary and reads from the primary or
+    a replica.
+
+    Parameters
+    ----------
+    write_url : URL of the primary database
+    read_url : URL of a read replica, None to read from the primary
+    pool_size : Connections kept open in each pool
+    max_overflow : Extra connections a pool may open under load
+    pool_timeout : Seconds a checkout waits for a connection before failing
+    pre_ping : Whether connections are checked before being handed out
+    recycle : Seconds after which a connection is replaced, -1 never
+    connect_args : Dict of extra arguments for the driver's connect
+
+    """
+
+    def __init__(self, write_url, read_url=None, pool_size=5, max_overflow=10,
+                 pool_timeout=30, pre_ping=True, recycle=1800,
+                 connect_args=None):
+        settings = dict(poolclass=TimedQueuePool, pool_size=pool_size,
+                        max_overflow=max_overflow, pool_timeout=pool_timeout,
+                        pool_pre_ping=pre_ping, pool_recycle=recycle,
+                        connect_args=connect_args or {})
+        self.write_engine = create_engine(write_url, **settings)
+        self.read_engine = (create_engine(read_url, **settings) if read_url
+                            else self.write_engine)
+
+    @classmethod
+    def from_config(cls, config, credentials, role, connect_args=None):
+        """
+        Build the database access of the collector or the dashboard from the
+        database section of config.yaml
+
+        Parameters
+        ----------
+        config : Dict of the full config
+        credentials : Dict of the primary's credentials
+        role : 'collector' or 'dashboard', whose pool settings are used.
+            Only the dashboard's reads go to the replica.
+        connect_args : Dict of extra arguments for the driver's connect
+
+        Returns
+        -------
+        Database
+
+        """
+        settings = config.get('database', {}) or {}
+        pool = dict(settings.get('pool', {}) or {})
+        pool.update(settings.get(role, {}) or {})
+
+        write_url = mysql_url(credentials)
+        read_url = None
+        replica = settings.get('replica') or {}
+        if role == 'dashboard' and replica.get('host'):
+            read_url = mysql_url({**credentials, **{
+                key: value for key, value in replica.items()
+                if value is not None}})
+
+        #STEAM_DB_URL replaces both, e.g. a synthetic benchmark database
+        if os.environ.get('STEAM_DB_URL'):
+            write_url = os.environ['STEAM_DB_URL']
+            read_url = None
+
+        return cls(write_url, read_url,
+                   pool_size=pool.get('pool_size', 5),
+                   max_overflow=pool.get('max_overflow', 10),
+                   pool_timeout=pool.get('pool_timeout', 30),
+                   pre_ping=pool.get('pre_ping', True),
+                   recycle=pool.get('recycle', 1800),
+                   connect_args=connect_args)
+
+    def connect(self):
+        """
+        Check out a DB-API connection to the primary. Closing it returns it
+        to the pool.
+
+        Returns
+        -------
+        Pooled connection with the driver's cursor, commit and close
+
+        """
+        return self.write_engine.raw_connection()
+
+    def pool_stats(self):
+        """
+        Stats of the write pool and, if reads go elsewhere, the read pool
+
+        Returns
+        -------
+        Dict of pool name to TimedQueuePool.stats
+
+        """
+        stats = {'write': self.write_engine.pool.stats()}
+        if self.read_engine is not self.write_engine:
+            stats['read'] = self.read_engine.pool.stats()
+        return stats
@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""
+In-memory cache of serialized Plotly figures for Dashboard.py.
+
+Figures are stored as json strings keyed by (figure type, quantized range,
+filter set, data version) so that repeat views of the same range skip both
+the pandas work and the Plotly work of building the figure.
+"""
+
+import hashlib
+import json
+import threading
+from collections import OrderedDict
+
+from plotly.io.json import to_json_plotly
+
+
+#Function for building a cache key
+def make_key(figure_type, start=None, end=None, filters=(), version=None,
+             quantum=600):
+    """
+    Function for building a hashable cache key for a figure
+
+    Parameters
+    ----------
+    figure_type : Name of the figure, e.g. 'treemap'
+    start : Start of the selected range as a timestamp, or None
+    end : End of the selected range as a timestamp, or None
+    filters : Iterable of the app ids (or other values) the figure is
+        filtered on. Order does not matter.
+    version : Data version the figure was built from
+    quantum : Number of seconds the range is rounded down to
+
+    Returns
+    -------
+    Tuple usable as a cache key
+
+    """
+    def quantize(ts):
+        if ts is None:
+            return None
+        return int(ts.timestamp()) // quantum * quantum
+
+    #Filter sets can hold thousands of apps, so we key on a digest of them
+    filter_str = ','.join(sorted(str(value) for value in filters))
+    filter_digest = hashlib.sha1(filter_str.encode()).hexdigest()
+
+    return (figure_type, quantize(start), quantize(end), filter_digest,
+            str(version))
+
+
+class FigureCache:
+    """
+    Least recently used cache of serialized figures.
+
+    Parameters
+    ----------
+    max_entries : Maximum number of figures kept before the least recently
+        used one is evicted. 0 disables the cache.
+
+    """
+
+    def __init__(self, max_entries=256):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get_or_build(self, key, build):
+        """
+        Return the cached figure for key, building and caching it on a miss
+
+        Parameters
+        ----------
+        key : Key from make_key
+        build : Function with no arguments returning a plotly Figure
+
+        Returns
+        -------
+        Dict of the figure, ready to be returned from a Dash callback
+
+        """
+        with self._lock:
+            cached = self._entries.get(key)
+            if cached is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+
+        if cached is not None:
+            return json.loads(cached)
+
+        serialized = to_json_plotly(build())
+
+        with self._lock:
+            self.misses += 1
+            if self.max_entries > 0:
+                self._entries[key] = serialized
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+
+        return json.loads(serialized)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
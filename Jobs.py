@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+"""
+Background job queue for the heavy Dash callbacks in Dashboard.py.
+
+A callback submits its work to the queue and returns straight away with the
+job's id. The browser then polls the job for its progress and picks up the
+result once it is done, so the request threads never sit on a long query.
+Jobs run on a pool of threads rather than processes so they share the
+figure cache and movers index with the rest of the dashboard.
+
+Cancellation is cooperative: a job checks whether it was cancelled each
+time it reports progress, which it does between its queries.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    """Raised inside a job that has been cancelled"""
+
+
+class Job:
+    """
+    State of one submitted job. The job function gets it as its first
+    argument to report progress.
+
+    Parameters
+    ----------
+    job_id : Unique id of the job
+
+    """
+
+    def __init__(self, job_id):
+        self.id = job_id
+        self.state = 'queued'
+        self.progress = 0.0
+        self.message = ''
+        self.result = None
+        self.error = None
+        self.finished = None
+        self.future = None
+        self._cancelled = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    def check(self):
+        """Raise JobCancelled if the job has been cancelled"""
+        if self.cancelled:
+            raise JobCancelled(self.id)
+
+    def report(self, progress, message=''):
+        """
+        Report progress, stopping the job here if it was cancelled
+
+        Parameters
+        ----------
+        progress : Share of the work done, from 0 to 1
+        message : Short description of what the job is doing
+
+        """
+        self.check()
+        self.progress = progress
+        self.message = message
+
+
+class JobQueue:
+    """
+    Thread pool running dashboard jobs, with their state kept for polling.
+
+    Parameters
+    ----------
+    max_workers : Number of jobs that can run at once
+    keep_finished : Number of finished jobs whose results are kept for
+        browsers that haven't polled them yet
+
+    """
+
+    def __init__(self, max_workers=4, keep_finished=256):
+        self.keep_finished = keep_finished
+        self._executor = ThreadPoolExecutor(max_workers,
+                                            thread_name_prefix='dashboard-job')
+        self._jobs = OrderedDict()
+        self._keys = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a queue from the dashboard section of config.yaml
+
+        Parameters
+        ----------
+        config : Dict of the full config
+
+        Returns
+        -------
+        JobQueue
+
+        """
+        settings = config.get('dashboard', {}).get('jobs', {}) or {}
+        return cls(max_workers=settings.get('max_workers', 4),
+                   keep_finished=settings.get('keep_finished', 256))
+
+    def submit(self, fn, *args, key=None, **kwargs):
+        """
+        Queue fn(job, *args, **kwargs) to run in the background
+
+        Parameters
+        ----------
+        fn : Job function, taking the Job as its first argument
+        key : Optional key shared by identical jobs. While a job with the
+            same key is queued or running its id is returned instead of
+            starting another one.
+
+        Returns
+        -------
+        Id of the job
+
+        """
+        with self._lock:
+            if key is not None:
+                existing = self._jobs.get(self._keys.get(key))
+                if existing and existing.state in ('queued', 'running'):
+                    return existing.id
+
+            job = Job(uuid.uuid4().hex)
+            self._jobs[job.id] = job
+            if key is not None:
+                self._keys[key] = job.id
+            self._prune()
+
+        job.future = self._executor.submit(self._run, job, fn, args, kwargs)
+        return job.id
+
+    def _run(self, job, fn, args, kwargs):
+        #Cancelled before a worker got to it
+        if job.cancelled:
+            job.state = 'cancelled'
+            return
+
+        job.state = 'running'
+        try:
+            job.result = fn(job, *args, **kwargs)
+            job.progress = 1.0
+            job.state = 'done'
+        except JobCancelled:
+            job.state = 'cancelled'
+        except Exception as error:
+            print(f'\nDashboard job {job.id} failed: {error!r}')
+            job.error = str(error)
+            job.state = 'failed'
+        finally:
+            job.finished = time.monotonic()
+
+    def status(self, job_id):
+        """
+        Where a job stands
+
+        Parameters
+        ----------
+        job_id : Id from submit
+
+        Returns
+        -------
+        Dict of state, progress, message and error, or None for an unknown
+        or pruned job
+
+        """
+        job = self._jobs.get(job_id)
+        if job is None:
+            return None
+        return {'state': job.state, 'progress': job.progress,
+                'message': job.message, 'error': job.error}
+
+    def result(self, job_id):
+        """
+        Return value of a finished job, None if it isn't done
+
+        Parameters
+        ----------
+        job_id : Id from submit
+
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.state != 'done':
+            return None
+        return job.result
+
+    def cancel(self, job_id):
+        """
+        Cancel a job. A queued job never runs, a running job stops the next
+        time it reports progress.
+
+        Parameters
+        ----------
+        job_id : Id from submit
+
+        Returns
+        -------
+        None
+
+        """
+        job = self._jobs.get(job_id)
+        if job is None or job.state not in ('queued', 'running'):
+            return
+        job._cancelled.set()
+        if job.future is not None and job.future.cancel():
+            job.state = 'cancelled'
+            job.finished = time.monotonic()
+
+        return
+
+    def _prune(self):
+        #Drop the oldest finished jobs once there are too many
+        finished = [job_id for job_id, job in self._jobs.items()
+                    if job.finished is not None]
+        for job_id in finished[:max(len(finished) - self.keep_finished, 0)]:
+            del self._jobs[job_id]
+        self._keys = {key: job_id for key, job_id in self._keys.items()
+                      if job_id in self._jobs}
@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+Server-sent events feed of new collection cycles for the dashboard.
+
+One background thread per dashboard process checks for cycles the collector
+has finished since the last check, so the work is done once however many
+pages are open. Each new cycle is broadcast to every open page as a small
+json event over a text/event-stream route, and assets/live_updates.js
+appends it to the page's chart. Streams are closed after max_age seconds
+and the browser reconnects on its own, getting any events it missed in
+between, so a page never holds a server thread for good.
+"""
+
+import collections
+import json
+import queue
+import threading
+import time
+import uuid
+
+
+class LiveFeed(threading.Thread):
+    """
+    Polls for new data and broadcasts it to every subscriber.
+
+    Parameters
+    ----------
+    poll : Function with no arguments returning a list of json-serializable
+        events that are new since its last call
+    interval : Seconds between polls
+    heartbeat : Seconds between keepalive comments on an idle stream, so
+        proxies don't close it
+    backlog : Events kept for a subscriber that isn't reading before the
+        oldest are dropped, and for replaying to reconnecting pages
+    max_subscribers : Streams open at once, further pages are told to try
+        again later
+    max_age : Seconds a stream is kept open before the page has to
+        reconnect
+
+    """
+
+    def __init__(self, poll, interval=15, heartbeat=30, backlog=100,
+                 max_subscribers=100, max_age=300):
+        super().__init__(name='live-feed', daemon=True)
+        self.poll = poll
+        self.interval = interval
+        self.heartbeat = heartbeat
+        self.backlog = backlog
+        self.max_subscribers = max_subscribers
+        self.max_age = max_age
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        #Event ids are only meaningful to this process, a page that last
+        #heard from another one gets nothing replayed
+        self._epoch = uuid.uuid4().hex[:8]
+        self._next_id = 0
+        self._history = collections.deque(maxlen=backlog)
+
+    @classmethod
+    def from_config(cls, config, poll):
+        """
+        Build a feed from the dashboard section of config.yaml
+
+        Parameters
+        ----------
+        config : Dict of the full config
+        poll : Function returning the new events
+
+        Returns
+        -------
+        LiveFeed
+
+        """
+        settings = config.get('dashboard', {}).get('live_updates', {}) or {}
+        return cls(poll, interval=settings.get('poll_interval', 15),
+                   heartbeat=settings.get('heartbeat', 30),
+                   max_subscribers=settings.get('max_connections', 100),
+                   max_age=settings.get('max_age', 300))
+
+    @property
+    def subscribers(self):
+        return len(self._subscribers)
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                events = self.poll()
+            except Exception as error:
+                print(f'\nLive update poll failed, will retry: {error!r}')
+                continue
+            for event in events:
+                self.broadcast(event)
+
+    def stop(self):
+        self._stop_event.set()
+
+    def broadcast(self, event):
+        """
+        Send an event to every subscriber
+
+        Parameters
+        ----------
+        event : json-serializable event
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._next_id += 1
+            message = (f'id: {self._epoch}:{self._next_id}\n'
+                       f'data: {json.dumps(event)}\n\n')
+            self._history.append((self._next_id, message))
+            subscribers = list(self._subscribers)
+        for subscriber in subscribers:
+            #A page that stopped reading loses its oldest events, not ours
+            while True:
+                try:
+                    subscriber.put_nowait(message)
+                    break
+                except queue.Full:
+                    try:
+                        subscriber.get_nowait()
+                    except queue.Empty:
+                        pass
+
+        return
+
+    def _missed(self, last_event_id):
+        epoch, _, number = (last_event_id or '').partition(':')
+        if epoch != self._epoch or not number.isdigit():
+            return []
+        return [message for event_id, message in self._history
+                if event_id > int(number)]
+
+    def stream(self, last_event_id=None):
+        """
+        Generator of the server-sent events of one subscriber, ending after
+        max_age seconds
+
+        Parameters
+        ----------
+        last_event_id : Last-Event-ID header of a reconnecting page, whose
+            missed events are sent first
+
+        Returns
+        -------
+        Generator of event-stream strings
+
+        """
+        subscriber = queue.Queue(maxsize=self.backlog)
+        with self._lock:
+            full = len(self._subscribers) >= self.max_subscribers
+            if not full:
+                self._subscribers.add(subscriber)
+                missed = self._missed(last_event_id)
+
+        #Browsers reconnect after this many milliseconds once a stream ends
+        if full:
+            yield f'retry: {int(self.max_age * 1000)}\n\n'
+            return
+        try:
+            yield 'retry: 10000\n\n'
+            yield from missed
+            deadline = time.monotonic() + self.max_age
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    yield subscriber.get(timeout=min(self.heartbeat,
+                                                     remaining))
+                except queue.Empty:
+                    yield ': keepalive\n\n'
+        finally:
+            with self._lock:
+                self._subscribers.discard(subscriber)
+
+    def register_route(self, server, route):
+        """
+        Register the event-stream route on the Flask server behind Dash
+
+        Parameters
+        ----------
+        server : Flask server, i.e. app.server
+        route : URL path of the stream
+
+        """
+        from flask import Response, request
+
+        @server.route(route)
+        def live_stream():
+            return Response(self.stream(request.headers.get('Last-Event-ID')),
+                            mimetype='text/event-stream',
+                            headers={'Cache-Control': 'no-cache',
+                                     'X-Accel-Buffering': 'no'})
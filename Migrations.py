@@ -0,0 +1,910 @@
+# -*- coding: utf-8 -*-
+"""
+Versioned schema migrations of steam_db.
+
+Every migration has a version and is recorded in schema_version once it has
+run, so starting against a current schema costs a single query. Pending
+migrations run in order of version under a database lock, so several
+collectors starting at once don't run them twice. Migration 1 is the schema
+setup_database used to create on every start, before anything was added to
+it; it is written so that it also runs against databases from before
+migrations, and every later migration is too.
+
+Migrations that change player_count are online: indexes are built in place
+without blocking inserts, and partitioning copies the table into a
+partitioned copy in daily batches and swaps it in, blocking writes only for
+the last, current day. They can still take hours on a large table, so they
+are manual: collectors starting up only say they are pending, and they are
+run from the command line, which lists every migration without arguments:
+    python Migrations.py --apply 2 --apply 3
+Adding cycle_bucket to player_count is manual too, unless player_count is
+still empty.
+"""
+
+import argparse
+from datetime import date, datetime, timedelta
+
+import yaml
+
+import mysql.connector as MSQL
+from mysql.connector import errorcode
+
+
+#Every migration, in order of version
+MIGRATIONS = []
+
+
+class Migration:
+    """
+    A change to the schema.
+
+    Parameters
+    ----------
+    version : Integer version, migrations run in increasing order
+    description : What the migration does, recorded in schema_version
+    apply : Function taking (connector, options) that makes the change. It
+        has to be safe to run again if it was interrupted
+    option : Key under database: migrations that enables the migration,
+        None if it always runs
+    manual : Whether the migration is too long to run when a collector
+        starts, and only runs when asked for from the command line. Can be
+        a function taking a connector, asked only while the migration is
+        pending
+
+    """
+
+    def __init__(self, version, description, apply, option=None,
+                 manual=False):
+        self.version = version
+        self.description = description
+        self.apply = apply
+        self.option = option
+        self.manual = manual
+
+    def enabled(self, options):
+        return self.option is None or bool(options.get(self.option))
+
+    def is_manual(self, connector):
+        if callable(self.manual):
+            return self.manual(connector)
+        return self.manual
+
+
+#Decorator for adding a function to the migrations
+def migration(version, description, option=None, manual=False):
+    """
+    Decorator registering a function as a migration
+
+    Parameters
+    ----------
+    version : Integer version, unique
+    description : What the migration does
+    option : Key under database: migrations that enables it, None for always
+    manual : Whether it only runs when asked for, see Migration
+
+    Returns
+    -------
+    Decorator returning the function unchanged
+
+    """
+    def register(apply):
+        if any(existing.version == version for existing in MIGRATIONS):
+            raise ValueError(f'Migration {version} is already registered')
+        MIGRATIONS.append(Migration(version, description, apply, option,
+                                    manual))
+        MIGRATIONS.sort(key=lambda existing: existing.version)
+        return apply
+
+    return register
+
+
+#Function for the migrations a database has had
+def applied_versions(connector):
+    """
+    Function for fetching the versions recorded in schema_version
+
+    Parameters
+    ----------
+    connector : A connector to steam_db
+
+    Returns
+    -------
+    Set of versions, empty if schema_version doesn't exist yet
+
+    """
+    cursor = connector.cursor()
+    try:
+        cursor.execute('SELECT version FROM schema_version;')
+        versions = {int(version) for (version,) in cursor.fetchall()}
+    except MSQL.Error as error:
+        if error.errno != errorcode.ER_NO_SUCH_TABLE:
+            raise
+        versions = set()
+    finally:
+        cursor.close()
+
+    return versions
+
+
+#Function for bringing the schema up to date
+def migrate(connector, options=None, lock_timeout=600, manual=(),
+            versions=None):
+    """
+    Function for running every enabled migration that hasn't run yet,
+    leaving out manual migrations that weren't asked for
+
+    Parameters
+    ----------
+    connector : A connector to steam_db
+    options : Dict of database: migrations from config.yaml
+    lock_timeout : Seconds to wait for another process's migrations
+    manual : Versions of manual migrations to run as well
+    versions : Versions from applied_versions if they were already read, to
+        save reading them again
+
+    Returns
+    -------
+    List of the versions that were applied
+
+    Raises
+    ------
+    RuntimeError if another process held the migration lock for longer
+    than lock_timeout
+
+    """
+    options = options or {}
+    manual = set(manual)
+
+    def pending(versions=None):
+        if versions is None:
+            versions = applied_versions(connector)
+        return [step for step in MIGRATIONS
+                if step.version not in versions and step.enabled(options)]
+
+    def runnable(steps):
+        return [step for step in steps
+                if step.version not in waiting]
+
+    #The only query when the schema is current
+    steps = pending(versions)
+    waiting = {step.version for step in steps
+               if step.version not in manual and step.is_manual(connector)}
+    if waiting:
+        listed = ' '.join(f'--apply {version}' for version in sorted(waiting))
+        print(f'Manual migrations {sorted(waiting)} are pending, run '
+              f'python Migrations.py {listed}')
+    if not runnable(steps):
+        return []
+
+    cursor = connector.cursor()
+    cursor.execute("SELECT GET_LOCK('steam_db.migrations', %s);",
+                   (lock_timeout,))
+    if cursor.fetchone()[0] != 1:
+        cursor.close()
+        raise RuntimeError('Timed out waiting for another process to '
+                           'finish migrating steam_db')
+
+    applied = []
+    try:
+        cursor.execute("""
+                       CREATE TABLE IF NOT EXISTS steam_db.schema_version(
+                           version INT UNSIGNED NOT NULL,
+                           description VARCHAR(200) NOT NULL,
+                           applied_at DATETIME NOT NULL,
+                           PRIMARY KEY(version)
+                           );
+                       """)
+
+        #Another process may have run some while we waited for the lock
+        for step in runnable(pending()):
+            print(f'Applying migration {step.version}: {step.description}')
+            step.apply(connector, options)
+            cursor.execute("""
+                           INSERT INTO schema_version
+                           (version, description, applied_at)
+                           VALUES (%s, %s, %s);
+                           """, (step.version, step.description,
+                                 datetime.now()))
+            connector.commit()
+            applied.append(step.version)
+    finally:
+        cursor.execute("SELECT RELEASE_LOCK('steam_db.migrations');")
+        cursor.fetchall()
+        cursor.close()
+
+    if applied:
+        print(f'Schema migrated to version {max(applied)}')
+
+    return applied
+
+
+#Function for whether a table has any rows
+def table_has_rows(connector, table):
+    """
+    Function for checking whether a table in steam_db has any rows, without
+    counting them
+
+    Parameters
+    ----------
+    connector : A connector to steam_db
+    table : Name of the table
+
+    Returns
+    -------
+    True if the table exists and has a row
+
+    """
+    cursor = connector.cursor()
+    try:
+        cursor.execute(f'SELECT 1 FROM steam_db.{table} LIMIT 1;')
+        has_rows = cursor.fetchone() is not None
+    except MSQL.Error as error:
+        if error.errno != errorcode.ER_NO_SUCH_TABLE:
+            raise
+        has_rows = False
+    finally:
+        cursor.close()
+
+    return has_rows
+
+
+#Function for adding a column to an existing table
+def add_column_if_missing(connector, table, column, definition):
+    """
+    Function for adding a column to a table in steam_db if it doesn't
+    already have it. CREATE TABLE IF NOT EXISTS doesn't change tables that
+    already exist, so new columns are added this way.
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    table : Name of the table
+    column : Name of the column
+    definition : Column definition following the name in ALTER TABLE
+
+    Returns
+    -------
+    True if the column was added
+
+    """
+
+    cursor = connector.cursor()
+    cursor.execute("""
+                   SELECT COUNT(*)
+                   FROM information_schema.COLUMNS
+                   WHERE TABLE_SCHEMA = 'steam_db'
+                   AND TABLE_NAME = %s AND COLUMN_NAME = %s;
+                   """, (table, column))
+    exists = cursor.fetchone()[0] > 0
+
+    if not exists:
+        print(f"\tAdding column {column} to {table}")
+        cursor.execute(f'ALTER TABLE steam_db.{table} '
+                       f'ADD COLUMN {column} {definition};')
+        connector.commit()
+
+    cursor.close()
+
+    return not exists
+
+
+#Function for adding an index without blocking writes
+def add_index_online(connector, table, name, columns):
+    """
+    Function for adding an index to a table in steam_db if it doesn't
+    already have it. The index is built in place while inserts carry on,
+    and MySQL refuses rather than falls back to locking the table.
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    table : Name of the table
+    name : Name of the index
+    columns : List of the indexed columns
+
+    Returns
+    -------
+    True if the index was added
+
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+                   SELECT COUNT(*)
+                   FROM information_schema.STATISTICS
+                   WHERE TABLE_SCHEMA = 'steam_db'
+                   AND TABLE_NAME = %s AND INDEX_NAME = %s;
+                   """, (table, name))
+    exists = cursor.fetchone()[0] > 0
+
+    if not exists:
+        print(f'\tAdding index {name} to {table}')
+        cursor.execute(f'ALTER TABLE steam_db.{table} '
+                       f'ADD INDEX {name} ({", ".join(columns)}), '
+                       'ALGORITHM=INPLACE, LOCK=NONE;')
+
+    cursor.close()
+
+    return not exists
+
+
+#Function for the monthly partitions from one month to another
+def month_partitions(first, last):
+    """
+    Function for the partition definitions of player_count, one per month
+    from first to last and a catch-all for anything later
+
+    Parameters
+    ----------
+    first : date in the first month
+    last : date in the last month
+
+    Returns
+    -------
+    String of comma separated partition definitions
+
+    """
+    partitions = []
+    month = first.replace(day=1)
+    while month <= last:
+        following = (month + timedelta(days=32)).replace(day=1)
+        partitions.append(f"PARTITION p{month:%Y%m} VALUES LESS THAN "
+                          f"('{following:%Y-%m-%d}')")
+        month = following
+    partitions.append('PARTITION pmax VALUES LESS THAN (MAXVALUE)')
+
+    return ', '.join(partitions)
+
+
+#Function for the partitions player_count has
+def player_count_partitions(connector):
+    """
+    Function for the names of player_count's partitions
+
+    Parameters
+    ----------
+    connector : A connector to steam_db
+
+    Returns
+    -------
+    List of partition names in order, empty if it isn't partitioned
+
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+                   SELECT PARTITION_NAME
+                   FROM information_schema.PARTITIONS
+                   WHERE TABLE_SCHEMA = 'steam_db'
+                   AND TABLE_NAME = 'player_count'
+                   AND PARTITION_NAME IS NOT NULL
+                   ORDER BY PARTITION_ORDINAL_POSITION;
+                   """)
+    partitions = [name for (name,) in cursor.fetchall()]
+    cursor.close()
+
+    return partitions
+
+
+#Function for keeping partitions ready for the coming months
+def ensure_partitions(connector, months_ahead=3):
+    """
+    Function for splitting the catch-all partition of player_count so that
+    the coming months each have their own. Splitting is quick while the
+    catch-all is empty, which it is as long as this runs at least once
+    every months_ahead months.
+
+    Parameters
+    ----------
+    connector : A connector to steam_db
+    months_ahead : Months after the current one that need a partition
+
+    Returns
+    -------
+    Number of partitions added
+
+    """
+    partitions = player_count_partitions(connector)
+    if 'pmax' not in partitions:
+        return 0
+
+    monthly = [name for name in partitions if name != 'pmax']
+    first = (datetime.strptime(monthly[-1][1:], '%Y%m').date()
+             + timedelta(days=32)).replace(day=1)
+    last = date.today().replace(day=1)
+    for _ in range(months_ahead):
+        last = (last + timedelta(days=32)).replace(day=1)
+    if first > last:
+        return 0
+
+    cursor = connector.cursor()
+    cursor.execute('ALTER TABLE steam_db.player_count '
+                   'REORGANIZE PARTITION pmax INTO '
+                   f'({month_partitions(first, last)});')
+    cursor.close()
+
+    added = len(player_count_partitions(connector)) - len(partitions)
+    print(f'Added {added} monthly partitions to player_count')
+
+    return added
+
+
+#=================================
+#Migrations
+#=================================
+
+
+@migration(1, 'Baseline schema')
+def baseline(connector, options):
+    """
+    The tables and views setup_database created before anything was added
+    to them. Everything is created only if missing, so this also runs
+    against databases from before migrations.
+    """
+
+    #We want to insert many tables, let's create a dict for our tables
+    Tables = {}
+
+    #Now we can go through and define our tables. These will be strings of the create statements
+    Tables['game_info'] = """
+        CREATE TABLE IF NOT EXISTS steam_db.game_info(
+        app_id INT UNSIGNED UNIQUE NOT NULL,
+        name VARCHAR(200) NOT NULL,
+        developer VARCHAR(200) NOT NULL,
+        rating INT UNSIGNED NOT NULL,
+        price DECIMAL(7,2) NOT NULL,
+        PRIMARY KEY(app_id)
+        );
+        """
+    
+    Tables['player_count'] = """
+        CREATE TABLE IF NOT EXISTS steam_db.player_count(
+            app_id INT UNSIGNED NOT NULL,
+            timestamp DATETIME NOT NULL,
+            count INT UNSIGNED NOT NULL,
+            FOREIGN KEY(app_id) REFERENCES game_info(app_id)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+            );
+        """
+    
+    Tables['genre'] = """
+        CREATE TABLE IF NOT EXISTS steam_db.genre(
+            genre_id INT UNSIGNED NOT NULL,
+            genre VARCHAR(100) NOT NULL,
+            PRIMARY KEY (genre_id)
+            );
+    """
+    
+    Tables['game_genre'] = """
+        CREATE TABLE IF NOT EXISTS steam_db.game_genre(
+            app_id INT UNSIGNED NOT NULL,
+            genre_id INT UNSIGNED,
+            PRIMARY KEY(app_id,genre_id),
+            FOREIGN KEY(app_id) REFERENCES game_info(app_id),
+            FOREIGN KEY(genre_id) REFERENCES genre(genre_id)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+            );
+    """
+    
+    Tables['tag'] = """
+        CREATE TABLE IF NOT EXISTS steam_db.tag(
+            tag_id INT UNSIGNED NOT NULL,
+            tag VARCHAR(100) NOT NULL,
+            PRIMARY KEY (tag_id))
+    """
+    
+    Tables['game_tag'] = """
+        CREATE TABLE IF NOT EXISTS steam_db.game_tag(
+            app_id INT UNSIGNED NOT NULL,
+            tag_id INT UNSIGNED NOT NULL,
+            PRIMARY KEY(app_id,tag_id),
+            FOREIGN KEY(app_id) REFERENCES game_info(app_id),
+            FOREIGN KEY(tag_id) REFERENCES tag(tag_id)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+            );
+    """
+    
+    
+    # We'll also define Views which will make things a lot easier for us to 
+    # analyze later
+    Views = {}
+    
+    Views['player_count_by_game'] = """
+        CREATE OR REPLACE VIEW player_count_by_game AS
+        SELECT game_info.app_id, game_info.name, player_count.timestamp,
+        player_count.count
+        FROM game_info
+        INNER JOIN player_count 
+        ON game_info.app_id = player_count.app_id
+        WHERE player_count.timestamp >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH);
+        """
+        
+    Views['complete_game_info'] = """
+        CREATE OR REPLACE VIEW complete_game_info AS
+        SELECT game_info.app_id, name, developer, rating, price, genre, tag
+        FROM game_info 
+        INNER JOIN game_genre ON game_info.app_id = game_genre.app_id
+        INNER JOIN genre ON game_genre.genre_id = genre.genre_id
+        INNER JOIN game_tag ON game_info.app_id = game_tag.app_id
+        INNER JOIN tag ON game_tag.tag_id = tag.tag_id;
+    """
+    
+    cursor = connector.cursor()
+
+    #Looping through our tables and creating them
+    for table in Tables.keys():
+        print(f"\tCreating Table: {table}")
+        cursor.execute(Tables[table])
+
+    #Looping through our views and creating them
+    for view in Views.keys():
+        print(f"\tCreating View: {view}")
+        cursor.execute(Views[view])
+
+    cursor.close()
+
+
+@migration(2, 'Index player_count by app and time', manual=True)
+def index_player_count(connector, options):
+    """
+    Per-game series filter on app_id and a time range, overall scans and the
+    six month window of player_count_by_game on the time alone. Built in
+    place, but long on a large table, so it is manual.
+    """
+    add_index_online(connector, 'player_count', 'idx_app_timestamp',
+                     ['app_id', 'timestamp'])
+    add_index_online(connector, 'player_count', 'idx_timestamp',
+                     ['timestamp'])
+
+
+@migration(3, 'Partition player_count by month', manual=True)
+def partition_player_count(connector, options):
+    """
+    Copies player_count into a copy partitioned by month, one day per
+    transaction, then copies the current day and swaps the tables under a
+    write lock. The old table is kept as player_count_old. Partitioned
+    tables can't have foreign keys, so the copy has none.
+
+    Samples dated before the current day must not arrive while this runs,
+    so the spool should be empty and no backfill running. Collectors keep
+    polling meanwhile; any that start wait up to database: migrations:
+    lock_timeout for the migration lock and then carry on without it. The
+    copy keeps cycle_bucket, so the column is added first if migration 7
+    hasn't run.
+    """
+    if player_count_partitions(connector):
+        return
+
+    cycle_buckets(connector, options)
+
+    cursor = connector.cursor()
+    cursor.execute('SELECT MIN(timestamp) FROM player_count;')
+    oldest = cursor.fetchone()[0]
+    today = datetime.combine(date.today(), datetime.min.time())
+    day = (oldest.replace(hour=0, minute=0, second=0, microsecond=0)
+           if oldest is not None else today)
+    last = today.date().replace(day=1)
+    for _ in range(options.get('partition_months_ahead', 3)):
+        last = (last + timedelta(days=32)).replace(day=1)
+
+    #A copy left by an interrupted run is started over
+    cursor.execute('DROP TABLE IF EXISTS steam_db.player_count_new;')
+    cursor.execute('CREATE TABLE steam_db.player_count_new '
+                   'LIKE steam_db.player_count;')
+    cursor.execute('ALTER TABLE steam_db.player_count_new '
+                   'PARTITION BY RANGE COLUMNS(timestamp) '
+                   f'({month_partitions(day.date(), last)});')
+
+    copy_query = """
+        INSERT INTO player_count_new (app_id, timestamp, count, cycle_bucket)
+        SELECT app_id, timestamp, count, cycle_bucket
+        FROM player_count
+        WHERE timestamp >= %s AND timestamp < %s;
+    """
+    copied = 0
+    while day < today:
+        cursor.execute(copy_query, (day, day + timedelta(days=1)))
+        connector.commit()
+        copied += cursor.rowcount
+        day += timedelta(days=1)
+        if day.day == 1:
+            print(f'\tCopied player_count up to {day:%Y-%m-%d}, '
+                  f'{copied:,} rows')
+
+    #Writes wait for the current day and the swap
+    cursor.execute('LOCK TABLES player_count WRITE, player_count_new WRITE;')
+    try:
+        cursor.execute("""
+                       INSERT INTO player_count_new
+                       (app_id, timestamp, count, cycle_bucket)
+                       SELECT app_id, timestamp, count, cycle_bucket
+                       FROM player_count
+                       WHERE timestamp >= %s;
+                       """, (today,))
+        cursor.execute('RENAME TABLE player_count TO player_count_old, '
+                       'player_count_new TO player_count;')
+    finally:
+        cursor.execute('UNLOCK TABLES;')
+
+    print('\tplayer_count is partitioned, the unpartitioned table is kept '
+          'as player_count_old to drop once checked')
+
+    cursor.close()
+
+
+@migration(4, 'Seasonality cubes of apps and tags')
+def seasonality_tables(connector, options):
+    """
+    Average and peak players by hour of the week of each app and tag, kept
+    by Seasonality.py. peak_slot is the hour of the week with the highest
+    average, Monday 00:00 being 0.
+    """
+    cursor = connector.cursor()
+    for kind, parent in [('app', 'game_info'), ('tag', 'tag')]:
+        cursor.execute(f"""
+            CREATE TABLE IF NOT EXISTS steam_db.{kind}_seasonality(
+                {kind}_id INT UNSIGNED NOT NULL,
+                bucket INT UNSIGNED NOT NULL,
+                peak_slot SMALLINT UNSIGNED,
+                peak_average DOUBLE,
+                state BLOB NOT NULL,
+                PRIMARY KEY({kind}_id),
+                FOREIGN KEY({kind}_id) REFERENCES {parent}({kind}_id)
+                ON DELETE CASCADE
+                ON UPDATE CASCADE
+                );
+            """)
+    cursor.close()
+
+
+@migration(5, 'Heartbeats of sharded collectors')
+def collector_workers(connector, options):
+    """
+    Every running collector with sharding on, renewed each cycle like its
+    leases. Sharding.py counts the live rows for each worker's fair share.
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS steam_db.collector_worker(
+            worker_id VARCHAR(100) NOT NULL,
+            heartbeat_expires DATETIME NOT NULL,
+            PRIMARY KEY(worker_id)
+            );
+        """)
+    cursor.close()
+
+
+@migration(6, 'Committed offsets of spool files')
+def spool_offsets(connector, options):
+    """
+    How far each spool file being flushed is loaded, committed with its
+    rows by Spool.py so a batch is never loaded twice
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS steam_db.spool_offset(
+            token CHAR(32) NOT NULL,
+            committed BIGINT UNSIGNED NOT NULL,
+            PRIMARY KEY(token)
+            );
+        """)
+    cursor.close()
+
+
+@migration(7, 'Cycle buckets of player counts',
+           manual=lambda connector: table_has_rows(connector, 'player_count'))
+def cycle_buckets(connector, options):
+    """
+    The cycle each sample was collected in, see DataFetch.time_to_bucket,
+    and player_count_by_game with it. The column is added instantly, the
+    index in place without blocking inserts; it is only manual while
+    player_count has rows, and collectors can't insert until it has run.
+    """
+    add_column_if_missing(connector, 'player_count', 'cycle_bucket',
+                          'INT UNSIGNED, ALGORITHM=INSTANT')
+    add_index_online(connector, 'player_count', 'cycle_bucket',
+                     ['cycle_bucket'])
+
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE OR REPLACE VIEW player_count_by_game AS
+        SELECT game_info.app_id, game_info.name, player_count.timestamp,
+        player_count.count, player_count.cycle_bucket
+        FROM game_info
+        INNER JOIN player_count 
+        ON game_info.app_id = player_count.app_id
+        WHERE player_count.timestamp >= DATE_SUB(CURDATE(), INTERVAL 6 MONTH);
+        """)
+    cursor.close()
+
+
+@migration(8, 'Leases of app id shards')
+def collector_leases(connector, options):
+    """
+    Leases on app id shards for running several collectors, see Sharding.py
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS steam_db.collector_lease(
+            shard_id INT UNSIGNED NOT NULL,
+            worker_id VARCHAR(100),
+            lease_expires DATETIME,
+            PRIMARY KEY(shard_id)
+            );
+        """)
+    cursor.close()
+
+
+@migration(9, 'Collection cycles')
+def collection_cycles(connector, options):
+    """
+    One row per collection cycle, keyed by its 10 minute epoch bucket.
+    Sharded collectors add their share of the stats to the same row.
+    apps_carried came after the table, so it is added if missing.
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS steam_db.collection_cycle(
+            bucket INT UNSIGNED NOT NULL,
+            started_at DATETIME NOT NULL,
+            finished_at DATETIME,
+            shards_total INT UNSIGNED NOT NULL DEFAULT 1,
+            shards_sampled INT UNSIGNED NOT NULL DEFAULT 0,
+            workers_started INT UNSIGNED NOT NULL DEFAULT 0,
+            workers_finished INT UNSIGNED NOT NULL DEFAULT 0,
+            apps_expected INT UNSIGNED NOT NULL DEFAULT 0,
+            apps_sampled INT UNSIGNED NOT NULL DEFAULT 0,
+            apps_carried INT UNSIGNED NOT NULL DEFAULT 0,
+            total_players BIGINT UNSIGNED NOT NULL DEFAULT 0,
+            PRIMARY KEY(bucket)
+            );
+        """)
+    cursor.close()
+
+    add_column_if_missing(connector, 'collection_cycle', 'apps_carried',
+                          'INT UNSIGNED NOT NULL DEFAULT 0')
+
+
+@migration(10, 'Trend statistics of apps')
+def app_trends(connector, options):
+    """
+    Streaming trend statistics of each app, with the packed state that they
+    are updated from, kept by Analytics.py
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS steam_db.app_trend(
+            app_id INT UNSIGNED NOT NULL,
+            bucket INT UNSIGNED NOT NULL,
+            last_count INT UNSIGNED NOT NULL,
+            ewma_fast DOUBLE NOT NULL,
+            ewma_slow DOUBLE NOT NULL,
+            ew_std DOUBLE NOT NULL,
+            rolling_mean DOUBLE NOT NULL,
+            rolling_std DOUBLE NOT NULL,
+            baseline DOUBLE,
+            trend_score DOUBLE NOT NULL,
+            anomaly_score DOUBLE NOT NULL,
+            state BLOB NOT NULL,
+            PRIMARY KEY(app_id),
+            INDEX(trend_score),
+            INDEX(anomaly_score),
+            FOREIGN KEY(app_id) REFERENCES game_info(app_id)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+            );
+        """)
+    cursor.close()
+
+
+@migration(11, 'Polling schedule of apps')
+def poll_schedules(connector, options):
+    """
+    Polling interval and moving statistics of each app when polling is
+    adaptive, see Scheduler.py
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS steam_db.poll_schedule(
+            app_id INT UNSIGNED NOT NULL,
+            next_bucket INT UNSIGNED NOT NULL,
+            interval_cycles INT UNSIGNED NOT NULL,
+            last_bucket INT UNSIGNED NOT NULL,
+            last_count INT UNSIGNED NOT NULL,
+            ewma DOUBLE NOT NULL,
+            ewvar DOUBLE NOT NULL,
+            PRIMARY KEY(app_id),
+            FOREIGN KEY(app_id) REFERENCES game_info(app_id)
+            ON DELETE CASCADE
+            ON UPDATE CASCADE
+            );
+        """)
+    cursor.close()
+
+
+@migration(12, 'Loaded chunks of backfilled dumps')
+def backfill_chunks(connector, options):
+    """
+    Byte ranges of dump files already loaded by Backfill.py, committed with
+    their rows so an interrupted import resumes where it stopped
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS steam_db.backfill_chunk(
+            source VARCHAR(255) NOT NULL,
+            start_byte BIGINT UNSIGNED NOT NULL,
+            end_byte BIGINT UNSIGNED NOT NULL,
+            rows_loaded INT UNSIGNED NOT NULL,
+            loaded_at DATETIME NOT NULL,
+            PRIMARY KEY(source, start_byte)
+            );
+        """)
+    cursor.close()
+
+
+#Function for printing every migration and whether it has run
+def print_status(connector, options=None):
+    """
+    Function for listing the migrations with their state
+
+    Parameters
+    ----------
+    connector : A connector to steam_db
+    options : Dict of database: migrations from config.yaml
+
+    Returns
+    -------
+    None
+
+    """
+    options = options or {}
+    versions = applied_versions(connector)
+    for step in MIGRATIONS:
+        if step.version in versions:
+            state = 'applied'
+        elif not step.enabled(options):
+            state = f'disabled, enable {step.option}'
+        elif step.manual:
+            state = 'pending, manual'
+        else:
+            state = 'pending'
+        print(f'{step.version:>3}  {step.description:<45} {state}')
+
+    return
+
+
+if __name__ == '__main__':
+
+    #Imported here since DataFetch imports this module
+    from DataFetch import setup_database
+
+    parser = argparse.ArgumentParser(
+        description='List the schema migrations of steam_db or apply '
+        'manual ones')
+    parser.add_argument('--apply', action='append', default=[],
+                        metavar='VERSION',
+                        help='Version of a manual migration to run, or all. '
+                        'Can be given more than once')
+    parser.add_argument('--lock-timeout', type=int, default=600,
+                        help='Seconds to wait for another process that is '
+                        'migrating')
+    args = parser.parse_args()
+
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+    options = config.get('database', {}).get('migrations') or {}
+
+    #Brings the schema up to everything but the manual migrations first
+    cnx = setup_database(config['mysql_credentials'], migrations=options)
+    try:
+        if 'all' in args.apply:
+            manual = [step.version for step in MIGRATIONS if step.manual]
+        else:
+            manual = [int(version) for version in args.apply]
+        if manual:
+            migrate(cnx, options, args.lock_timeout, manual)
+            ensure_partitions(cnx, options.get('partition_months_ahead', 3))
+        print_status(cnx, options)
+    finally:
+        cnx.close()
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+"""
+Top-N movers between two time windows.
+
+Hourly player count sums and sample counts of the apps asked about are laid
+out as a dense app by hour matrix over the requested range and turned into
+prefix sums along the time axis in place, so the index takes no more memory
+than the two prefix arrays. Player sums are float64, whose running totals
+stay exact far past what a large app adds up to over years, and sample
+counts int32. The average players of any app over any window is then two lookups per
+array, and the biggest gainers and losers are picked with argpartition
+instead of sorting every app.
+"""
+
+import numpy as np
+import pandas as pd
+
+
+class MoversIndex:
+    """
+    Prefix sums of hourly player counts of a set of apps.
+
+    Parameters
+    ----------
+    hourly_df : DataFrame with columns app_id, hour, players and samples
+        where players is the sum of the counts of an app in the hour and
+        samples is how many counts were summed
+    start : First hour the index covers, the first hour in hourly_df if None
+    end : Last hour the index covers, the last hour in hourly_df if None
+    app_ids : Apps to index, every app in hourly_df if None. Only apps with
+        samples in the range get a row.
+
+    """
+
+    def __init__(self, hourly_df, start=None, end=None, app_ids=None):
+        hours = pd.to_datetime(hourly_df['hour'])
+        if start is None and len(hourly_df):
+            start = hours.min()
+        if end is None and len(hourly_df):
+            end = hours.max()
+        if start is not None and end is not None:
+            self.hours = pd.date_range(pd.Timestamp(start).floor('h'),
+                                       pd.Timestamp(end).floor('h'),
+                                       freq='h')
+        else:
+            self.hours = pd.DatetimeIndex([])
+        hour_index = self.hours.get_indexer(hours)
+
+        keep = hour_index >= 0
+        if app_ids is not None:
+            keep &= hourly_df['app_id'].isin(app_ids).to_numpy()
+        hour_index = hour_index[keep]
+        self.app_ids, app_index = np.unique(
+            hourly_df['app_id'].to_numpy()[keep], return_inverse=True)
+
+        #A leading column of zeros so window [i, j) is P[:, j] - P[:, i].
+        #The hourly values are added straight into the prefix arrays and
+        #summed in place, so no other app by hour matrix is allocated
+        shape = (len(self.app_ids), len(self.hours) + 1)
+        self.player_prefix = np.zeros(shape, dtype=np.float64)
+        self.sample_prefix = np.zeros(shape, dtype=np.int32)
+        np.add.at(self.player_prefix, (app_index, hour_index + 1),
+                  hourly_df['players'].to_numpy(dtype=np.float64)[keep])
+        np.add.at(self.sample_prefix, (app_index, hour_index + 1),
+                  hourly_df['samples'].to_numpy(dtype=np.int32)[keep])
+        np.cumsum(self.player_prefix, axis=1, out=self.player_prefix)
+        np.cumsum(self.sample_prefix, axis=1, out=self.sample_prefix)
+
+    def covers(self, start, end):
+        """Whether the index was built for every hour from start to end"""
+        return (len(self.hours) > 0 and self.hours[0] <= start.floor('h')
+                and end.floor('h') <= self.hours[-1])
+
+    def window_average(self, start, end):
+        """
+        Average player count of every app from start to end
+
+        Parameters
+        ----------
+        start : Start of the window as a timestamp
+        end : End of the window as a timestamp, inclusive
+
+        Returns
+        -------
+        Array of averages in the order of app_ids, NaN for apps with no
+        samples in the window
+
+        """
+        i = self.hours.searchsorted(start.floor('h'), side='left')
+        j = self.hours.searchsorted(end.floor('h'), side='right')
+        players = self.player_prefix[:, j] - self.player_prefix[:, i]
+        samples = self.sample_prefix[:, j] - self.sample_prefix[:, i]
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(samples > 0, players / samples, np.nan)
+
+    def top_movers(self, window_a, window_b, k=10):
+        """
+        Apps with the biggest gain and loss in average players from window A
+        to window B. Only apps with samples in both windows are ranked.
+
+        Parameters
+        ----------
+        window_a : Tuple of (start, end) timestamps of the earlier window
+        window_b : Tuple of (start, end) timestamps of the later window
+        k : Number of gainers and of losers
+
+        Returns
+        -------
+        Tuple of (gainers, losers) DataFrames with columns app_id, before,
+        after and change, biggest movers first
+
+        """
+        before = self.window_average(*window_a)
+        after = self.window_average(*window_b)
+        change = after - before
+
+        ranked = np.flatnonzero(np.isfinite(change))
+        k = min(k, len(ranked))
+        if k == 0:
+            empty = pd.DataFrame(columns=['app_id', 'before', 'after',
+                                          'change'])
+            return empty, empty
+
+        #Partial selection of the k largest and k smallest changes, then
+        #only those k are sorted
+        ranked_change = change[ranked]
+        top = ranked[np.argpartition(-ranked_change, k - 1)[:k]]
+        bottom = ranked[np.argpartition(ranked_change, k - 1)[:k]]
+        top = top[np.argsort(-change[top])]
+        bottom = bottom[np.argsort(change[bottom])]
+
+        def frame(index):
+            return pd.DataFrame({'app_id': self.app_ids[index],
+                                 'before': before[index],
+                                 'after': after[index],
+                                 'change': change[index]})
+
+        gainers = frame(top)
+        losers = frame(bottom)
+        return gainers[gainers['change'] > 0], losers[losers['change'] < 0]
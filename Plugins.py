@@ -0,0 +1,319 @@
+# -*- coding: utf-8 -*-
+"""
+Registry of the per-app data sources run by DataFetch.get_game_data.
+
+Each source registers a SourcePlugin declaring how it fetches (one app at a
+time or a batch of apps per call), how many fetches it runs at once, which
+API host it is rate limited against, how often it runs and how its rows are
+inserted. run_plugins fetches every source of a cycle concurrently, each on
+its own thread pool, with requests to the same host spaced out by a shared
+HostLimiter so concurrent sources can't overrun an API between them. The
+limiter is taken before every request, retries included: DataFetch's
+request functions call acquire_host, and sources that send their own
+requests call it before each one.
+
+New sources live in their own module, call register at import and are
+listed under data_fetch: plugin_modules in config.yaml.
+"""
+
+import copy
+import importlib
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+
+#Every registered source, by name
+REGISTRY = {}
+
+#Rate limiter of the host the source fetching on this thread uses
+_context = threading.local()
+
+
+class SourcePlugin:
+    """
+    A data source polled for every app.
+
+    Parameters
+    ----------
+    name : Name of the source as listed in config.yaml
+    fetch : Function taking (app_row, cycle=cycle) and returning the data of
+        one app or None. Not needed if fetch_batch is given.
+    fetch_batch : Function taking (app_rows, cycle=cycle) and returning a
+        list of data, for APIs that answer for several apps per request
+    insert : Function taking (data, connector) that inserts and commits a
+        list of data. Required, a source's data has to go somewhere
+    batch_size : Number of apps per fetch_batch call
+    concurrency : Number of fetches of this source running at once
+    host : API host the source is rate limited against, None for no limit
+    cadence : Run every this many cycles
+    spooled : Whether the data can go through the local sample spool
+        instead of straight to the database
+
+    """
+
+    def __init__(self, name, fetch=None, fetch_batch=None, insert=None,
+                 batch_size=1, concurrency=1, host=None, cadence=1,
+                 spooled=False):
+        if fetch is None and fetch_batch is None:
+            raise ValueError(f'Source {name} needs fetch or fetch_batch')
+        if insert is None:
+            raise ValueError(f'Source {name} needs an insert function')
+        self.name = name
+        self.fetch = fetch
+        self.fetch_batch = fetch_batch
+        self.insert = insert
+        self.batch_size = batch_size if fetch_batch is not None else 1
+        self.concurrency = concurrency
+        self.host = host
+        self.cadence = cadence
+        self.spooled = spooled
+
+    def configure(self, settings):
+        """
+        Copy of the plugin with throughput settings from config.yaml
+
+        Parameters
+        ----------
+        settings : Dict of any of batch_size, concurrency, host and cadence
+
+        Returns
+        -------
+        SourcePlugin
+
+        """
+        plugin = copy.copy(self)
+        for setting in ('batch_size', 'concurrency', 'host', 'cadence'):
+            if settings.get(setting) is not None:
+                setattr(plugin, setting, settings[setting])
+        if plugin.fetch_batch is None:
+            plugin.batch_size = 1
+        return plugin
+
+    def is_due(self, bucket):
+        """Whether the source runs in the cycle of a bucket"""
+        return bucket is None or bucket % max(int(self.cadence), 1) == 0
+
+    def fetch_many(self, app_rows, cycle=None):
+        """
+        Fetch a batch of apps
+
+        Parameters
+        ----------
+        app_rows : List of game_info rows, app_id first
+        cycle : Dict from DataFetch.open_cycle or None
+
+        Returns
+        -------
+        List of data, without the apps that returned nothing
+
+        """
+        if self.fetch_batch is not None:
+            data = self.fetch_batch(app_rows, cycle=cycle)
+        else:
+            data = [self.fetch(app_row, cycle=cycle) for app_row in app_rows]
+        return [item for item in data if item]
+
+
+class HostLimiter:
+    """
+    Spaces out requests to one API host, shared by every thread fetching
+    from it.
+
+    Parameters
+    ----------
+    rate : Requests per second allowed
+
+    """
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """Block until the next request to the host may be sent"""
+        with self._lock:
+            now = time.monotonic()
+            wait = max(self._next - now, 0)
+            self._next = max(now, self._next) + self.interval
+        if wait:
+            time.sleep(wait)
+
+
+#Function for registering a source
+def register(plugin):
+    """
+    Function for adding a source to the registry, replacing any source of
+    the same name
+
+    Parameters
+    ----------
+    plugin : SourcePlugin
+
+    Returns
+    -------
+    The plugin
+
+    """
+    REGISTRY[plugin.name] = plugin
+    return plugin
+
+
+#Function for importing the modules of extra sources
+def load_plugin_modules(config):
+    """
+    Function for importing the modules listed under data_fetch:
+    plugin_modules, which register their sources on import
+
+    Parameters
+    ----------
+    config : Dict of the full config
+
+    Returns
+    -------
+    None
+
+    """
+    for module in config['data_fetch'].get('plugin_modules') or []:
+        importlib.import_module(module)
+
+    return
+
+
+#Function for getting the configured sources of a list of names
+def get_plugins(names, config):
+    """
+    Function for looking up sources by name with their throughput settings
+    from data_fetch: sources in config.yaml applied
+
+    Parameters
+    ----------
+    names : Iterable of source names
+    config : Dict of the full config
+
+    Returns
+    -------
+    List of SourcePlugin, names that aren't registered are skipped with a
+    warning
+
+    """
+    settings = config['data_fetch'].get('sources') or {}
+    plugins = []
+    for name in names:
+        if name not in REGISTRY:
+            print(f'No data source named {name} is registered, skipping')
+            continue
+        plugins.append(REGISTRY[name].configure(settings.get(name) or {}))
+    return plugins
+
+
+#Function for building the rate limiters of every host
+def limiters_from_config(config):
+    """
+    Function for creating a HostLimiter for every host under
+    data_fetch: rate_limits. Other hosts get one request per
+    pause_between_calls.
+
+    Parameters
+    ----------
+    config : Dict of the full config
+
+    Returns
+    -------
+    Function taking a host and returning its HostLimiter
+
+    """
+    pause = config['data_fetch']['api_run_params']['pause_between_calls']
+    rates = config['data_fetch'].get('rate_limits') or {}
+    limiters = {}
+    lock = threading.Lock()
+
+    def limiter(host):
+        with lock:
+            if host not in limiters:
+                limiters[host] = HostLimiter(rates.get(host,
+                                                       1 / pause if pause
+                                                       else 0))
+            return limiters[host]
+
+    return limiter
+
+
+#Function for waiting on the rate limit of the current source's host
+def acquire_host():
+    """
+    Function for blocking until the source fetching on this thread may send
+    its next request. Called before every request attempt; does nothing
+    outside of run_plugins or for sources without a host.
+
+    Returns
+    -------
+    None
+
+    """
+    limiter = getattr(_context, 'limiter', None)
+    if limiter is not None:
+        limiter.acquire()
+
+    return
+
+
+#Function for fetching one batch with its host's rate limit on the thread
+def _fetch_batch(plugin, app_rows, cycle, limiter):
+    _context.limiter = (limiter(plugin.host) if plugin.host is not None
+                        else None)
+    try:
+        return plugin.fetch_many(app_rows, cycle=cycle)
+    finally:
+        _context.limiter = None
+
+
+#Function for running every source of a cycle
+def run_plugins(plugins, app_rows, cycle, limiter):
+    """
+    Function for fetching every source concurrently, each with its own
+    batch size and concurrency
+
+    Parameters
+    ----------
+    plugins : List of SourcePlugin
+    app_rows : Dict of source name to the list of game_info rows it polls
+    cycle : Dict from DataFetch.open_cycle or None
+    limiter : Function taking a host and returning its HostLimiter, from
+        limiters_from_config
+
+    Returns
+    -------
+    Dict of source name to list of data
+
+    """
+    results = {plugin.name: [] for plugin in plugins}
+    executors = []
+    futures = {}
+
+    #Batches of every source are queued up front so the sources interleave
+    for plugin in plugins:
+        executor = ThreadPoolExecutor(max(int(plugin.concurrency), 1),
+                                      thread_name_prefix=plugin.name)
+        executors.append(executor)
+        rows = app_rows.get(plugin.name, [])
+        for i in range(0, len(rows), plugin.batch_size):
+            future = executor.submit(_fetch_batch, plugin,
+                                     rows[i:i + plugin.batch_size], cycle,
+                                     limiter)
+            futures[future] = plugin.name
+
+    try:
+        for future in as_completed(futures):
+            name = futures[future]
+            #A failed batch loses its apps for this cycle only
+            try:
+                results[name].extend(future.result())
+            except Exception as error:
+                print(f'\n{name} batch failed: {error!r}')
+    finally:
+        for executor in executors:
+            executor.shutdown(wait=True)
+
+    return results
@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+"""
+Opt-in profiling hooks for the Dash callbacks in Dashboard.py.
+
+Each profiled callback produces one record holding the time spent in every
+stage (SQL, pandas, figure construction, serialization), the text and row
+count of every query it ran and the size of the response payload. Records
+are kept in memory for the debug route and appended to a rolling log file.
+"""
+
+import gzip
+import json
+import logging
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+from logging.handlers import RotatingFileHandler
+
+import numpy as np
+from plotly.io.json import to_json_plotly
+
+
+#=================================
+#Profiler
+#=================================
+
+
+class CallbackProfiler:
+    """
+    Collects per-stage timings for Dash callbacks.
+
+    Parameters
+    ----------
+    enabled : Whether profiling is switched on. When False every hook is a
+        no-op and callbacks are returned undecorated.
+    log_file : Path of the rolling log that each record is written to as a
+        line of json. None disables the log.
+    max_bytes : Size in bytes at which the log file is rotated
+    backup_count : Number of rotated log files to keep
+    history : Number of records to keep in memory for the debug route
+
+    """
+
+    def __init__(self, enabled=False, log_file=None, max_bytes=5_000_000,
+                 backup_count=3, history=500):
+        self.enabled = enabled
+        self.records = deque(maxlen=history)
+        self.renders = deque(maxlen=history)
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._logger = None
+
+        if enabled and log_file:
+            self._logger = logging.getLogger('dashboard.profiling')
+            self._logger.setLevel(logging.INFO)
+            self._logger.propagate = False
+            handler = RotatingFileHandler(log_file, maxBytes=max_bytes,
+                                          backupCount=backup_count)
+            handler.setFormatter(logging.Formatter('%(message)s'))
+            self._logger.addHandler(handler)
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a profiler from the dashboard section of config.yaml.
+
+        Parameters
+        ----------
+        config : Dict of the full config
+
+        Returns
+        -------
+        CallbackProfiler
+
+        """
+        settings = config.get('dashboard', {}).get('profiling', {}) or {}
+        return cls(enabled=settings.get('enabled', False),
+                   log_file=settings.get('log_file'),
+                   max_bytes=settings.get('max_bytes', 5_000_000),
+                   backup_count=settings.get('backup_count', 3),
+                   history=settings.get('history', 500))
+
+    #Record of the callback running on this thread, if any
+    @property
+    def current(self):
+        return getattr(self._local, 'record', None)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time a stage of the current callback. Nested or repeated stages with
+        the same name are summed.
+
+        Parameters
+        ----------
+        name : Name of the stage, e.g. 'sql:fetch_treemap_data'
+
+        """
+        record = self.current
+        if not self.enabled or record is None:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = (time.perf_counter() - start) * 1000
+            record['stages'][name] = record['stages'].get(name, 0) + elapsed
+
+    def record_query(self, query, rows, elapsed_ms):
+        """
+        Attach a query to the current callback record.
+
+        Parameters
+        ----------
+        query : The SQL text that was run
+        rows : Number of rows returned
+        elapsed_ms : Time taken by the query in milliseconds
+
+        """
+        record = self.current
+        if not self.enabled or record is None:
+            return
+        record['queries'].append({
+            'query': ' '.join(query.split()),
+            'rows': int(rows),
+            'ms': round(elapsed_ms, 3),
+            })
+
+    def read_sql(self, query, engine, name='sql'):
+        """
+        Run pd.read_sql under a stage and record the query and its row count.
+
+        Parameters
+        ----------
+        query : SQL text to run
+        engine : SQLAlchemy engine or connection
+        name : Stage name the query time is charged to
+
+        Returns
+        -------
+        pandas DataFrame of the result
+
+        """
+        #Imported here so the profiler itself does not require pandas
+        import pandas as pd
+
+        start = time.perf_counter()
+        with self.stage(name):
+            result = pd.read_sql(query, engine)
+        self.record_query(query, len(result),
+                          (time.perf_counter() - start) * 1000)
+        return result
+
+    def profile_callback(self, fn):
+        """
+        Decorator for a Dash callback. Times the whole callback, measures the
+        serialized size of its return value and stores the record.
+
+        Parameters
+        ----------
+        fn : The callback function
+
+        Returns
+        -------
+        Wrapped callback, or fn itself when profiling is disabled
+
+        """
+        return self._profile(fn, payload=True)
+
+    def profile_job(self, fn):
+        """
+        Decorator for a function run as a background job. Times it like a
+        callback, but its result isn't a response, so it isn't measured;
+        the callback that sends it on is profiled on its own.
+
+        Parameters
+        ----------
+        fn : The job function
+
+        Returns
+        -------
+        Wrapped function, or fn itself when profiling is disabled
+
+        """
+        return self._profile(fn, payload=False)
+
+    def _profile(self, fn, payload):
+        if not self.enabled:
+            return fn
+
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            record = {
+                'callback': fn.__name__,
+                'started': datetime.now().isoformat(timespec='seconds'),
+                'stages': {},
+                'queries': [],
+                }
+            self._local.record = record
+            start = time.perf_counter()
+            try:
+                with self.stage('callback'):
+                    result = fn(*args, **kwargs)
+
+                #Dash serializes the response with the plotly encoder, so we
+                #measure the same thing
+                if payload:
+                    with self.stage('serialize'):
+                        encoded = to_json_plotly(result).encode()
+                    record['payload_bytes'] = len(encoded)
+                    record['payload_gzip_bytes'] = len(
+                        gzip.compress(encoded, 6))
+                return result
+            finally:
+                record['total_ms'] = round(
+                    (time.perf_counter() - start) * 1000, 3)
+                record['stages'] = {k: round(v, 3)
+                                    for k, v in record['stages'].items()}
+                self._local.record = None
+                self._store(record)
+
+        return wrapper
+
+    def _store(self, record):
+        with self._lock:
+            self.records.append(record)
+        if self._logger:
+            self._logger.info(json.dumps(record))
+
+    def summary(self):
+        """
+        Aggregate the in-memory records into p50/p95 timings per callback
+        and stage.
+
+        Returns
+        -------
+        Dict of callback name to dict of stage name to stats
+
+        """
+        with self._lock:
+            records = list(self.records)
+
+        timings = {}
+        for record in records:
+            stages = timings.setdefault(record['callback'], {})
+            stages.setdefault('total', []).append(record['total_ms'])
+            #Jobs have no response of their own
+            for size in ('payload_bytes', 'payload_gzip_bytes'):
+                if size in record:
+                    stages.setdefault(size, []).append(record[size])
+            for stage, ms in record['stages'].items():
+                stages.setdefault(stage, []).append(ms)
+
+        #Browser render times reported by assets/render_timing.js
+        for render in list(self.renders):
+            stages = timings.setdefault(f"render:{render['graph']}", {})
+            stages.setdefault('render_ms', []).append(render['ms'])
+            stages.setdefault('points', []).append(render['points'])
+
+        summary = {}
+        for callback_name, stages in timings.items():
+            summary[callback_name] = {
+                stage: {
+                    'calls': len(values),
+                    'p50': float(np.percentile(values, 50)),
+                    'p95': float(np.percentile(values, 95)),
+                    'max': float(np.max(values)),
+                    }
+                for stage, values in stages.items()
+                }
+        return summary
+
+    def register_route(self, server, route, extras=None):
+        """
+        Register the hidden debug route on the Flask server behind Dash.
+
+        Parameters
+        ----------
+        server : Flask server, i.e. app.server
+        route : URL path of the debug page
+        extras : Dict of name to function with no arguments whose results
+            are added to the page, e.g. connection pool stats
+
+        """
+        if not self.enabled:
+            return
+
+        @server.route(route)
+        def profiling_report():
+            with self._lock:
+                recent = list(self.records)[-50:]
+            report = {'summary': self.summary(), 'recent': recent[::-1]}
+            for name, fn in (extras or {}).items():
+                report[name] = fn()
+            return report
+
+        #The browser posts how long each graph took to draw
+        @server.route(f'{route.rstrip("/")}/render', methods=['POST'])
+        def profiling_render():
+            from flask import request
+
+            body = request.get_json(silent=True) or {}
+            render = {'graph': str(body.get('graph', 'unknown')),
+                      'ms': round(float(body.get('ms', 0)), 3),
+                      'points': int(body.get('points', 0))}
+            with self._lock:
+                self.renders.append(render)
+            if self._logger:
+                self._logger.info(json.dumps({'render': render}))
+            return {'ok': True}
@@ -0,0 +1,266 @@
+# -*- coding: utf-8 -*-
+"""
+Adaptive per-app polling for the player_counts collector.
+
+Each app gets a polling interval, in cycles, from its recent player count
+and how much that count moves. Popular or volatile games are polled every
+cycle and long-tail games as rarely as max_interval cycles. Apps that are
+due are taken from a priority queue ordered by how overdue they are, so if
+a cycle has a polling budget the stalest and most important apps go first.
+State is kept in the poll_schedule table between runs.
+"""
+
+import heapq
+import math
+
+
+class PollScheduler:
+    """
+    Priority queue scheduler of player count polls.
+
+    Parameters
+    ----------
+    min_interval : Fewest cycles between polls of an app
+    max_interval : Most cycles between polls of an app
+    popular_players : Player count at which an app is polled every cycle
+    volatile_cv : Coefficient of variation at which an app is polled every
+        cycle however few players it has
+    alpha : Weight of the newest sample in the moving average and variance
+    max_polls_per_cycle : Cap on polls per cycle, None for no cap
+
+    """
+
+    def __init__(self, min_interval=1, max_interval=12, popular_players=10000,
+                 volatile_cv=0.5, alpha=0.3, max_polls_per_cycle=None):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.popular_players = popular_players
+        self.volatile_cv = volatile_cv
+        self.alpha = alpha
+        self.max_polls_per_cycle = max_polls_per_cycle
+
+        #app_id -> dict of next_bucket, interval, last_bucket, last_count,
+        #ewma and ewvar
+        self.state = {}
+        self._changed = set()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build a scheduler from the data_fetch section of config.yaml
+
+        Parameters
+        ----------
+        config : Dict of the full config
+
+        Returns
+        -------
+        PollScheduler
+
+        """
+        settings = config['data_fetch'].get('scheduling', {})
+        return cls(min_interval=settings.get('min_interval', 1),
+                   max_interval=settings.get('max_interval', 12),
+                   popular_players=settings.get('popular_players', 10000),
+                   volatile_cv=settings.get('volatile_cv', 0.5),
+                   alpha=settings.get('alpha', 0.3),
+                   max_polls_per_cycle=settings.get('max_polls_per_cycle'))
+
+    def load(self, connector):
+        """
+        Load the saved schedule from poll_schedule
+
+        Parameters
+        ----------
+        connector : A connector to MySQL server
+
+        Returns
+        -------
+        None
+
+        """
+        cursor = connector.cursor()
+        cursor.execute("""
+                       SELECT app_id, next_bucket, interval_cycles,
+                       last_bucket, last_count, ewma, ewvar
+                       FROM poll_schedule;
+                       """)
+        for (app_id, next_bucket, interval, last_bucket, last_count, ewma,
+             ewvar) in cursor:
+            self.state[app_id] = {
+                'next_bucket': next_bucket,
+                'interval': interval,
+                'last_bucket': last_bucket,
+                'last_count': last_count,
+                'ewma': ewma,
+                'ewvar': ewvar,
+                }
+        cursor.close()
+
+        return
+
+    def urgency(self, app_state):
+        """
+        How important it is to poll an app often, from 0 to 1
+
+        Parameters
+        ----------
+        app_state : Dict of the app's state
+
+        Returns
+        -------
+        float
+
+        """
+        ewma = app_state['ewma']
+        level = math.log1p(ewma) / math.log1p(self.popular_players)
+        volatility = (math.sqrt(app_state['ewvar']) / max(ewma, 1)
+                      / self.volatile_cv)
+        return min(max(level, volatility), 1.0)
+
+    def due(self, app_ids, bucket):
+        """
+        Select the apps to poll this cycle
+
+        Parameters
+        ----------
+        app_ids : Iterable of every app id this collector is responsible for
+        bucket : Bucket of the current cycle
+
+        Returns
+        -------
+        Set of app ids to poll
+
+        """
+        queue = []
+        for app_id in app_ids:
+            app_state = self.state.get(app_id)
+
+            #Apps we have never seen are due straight away
+            if app_state is None:
+                heapq.heappush(queue, (bucket - self.max_interval, -1.0,
+                                       app_id))
+                continue
+
+            if app_state['next_bucket'] <= bucket:
+                heapq.heappush(queue, (app_state['next_bucket'],
+                                       -self.urgency(app_state), app_id))
+
+        #Most overdue first, then most urgent
+        budget = self.max_polls_per_cycle or len(queue)
+        return {heapq.heappop(queue)[2]
+                for _ in range(min(budget, len(queue)))}
+
+    def update(self, samples, bucket):
+        """
+        Update the moving statistics and next poll of every sampled app
+
+        Parameters
+        ----------
+        samples : List of player_counts samples, [app_id, timestamp, count]
+        bucket : Bucket of the current cycle
+
+        Returns
+        -------
+        None
+
+        """
+        for app_id, _, count in samples:
+            app_state = self.state.get(app_id)
+
+            if app_state is None:
+                app_state = {'ewma': float(count), 'ewvar': 0.0}
+                self.state[app_id] = app_state
+            else:
+                #Exponentially weighted mean and variance
+                diff = count - app_state['ewma']
+                increment = self.alpha * diff
+                app_state['ewma'] += increment
+                app_state['ewvar'] = ((1 - self.alpha)
+                                      * (app_state['ewvar']
+                                         + diff * increment))
+
+            interval = round(self.max_interval
+                             ** (1 - self.urgency(app_state)))
+            interval = min(max(interval, self.min_interval),
+                           self.max_interval)
+
+            app_state['interval'] = interval
+            app_state['next_bucket'] = bucket + interval
+            app_state['last_bucket'] = bucket
+            app_state['last_count'] = int(count)
+            self._changed.add(app_id)
+
+        return
+
+    def carried_players(self, app_ids, sampled, bucket):
+        """
+        Last known player count of apps that weren't sampled this cycle, so
+        the cycle total can be forward filled
+
+        Parameters
+        ----------
+        app_ids : Iterable of every app id this collector is responsible for
+        sampled : Set of app ids sampled this cycle
+        bucket : Bucket of the current cycle
+
+        Returns
+        -------
+        Tuple of (number of apps carried, total players carried)
+
+        """
+        apps = 0
+        players = 0
+        for app_id in app_ids:
+            app_state = self.state.get(app_id)
+            if app_id in sampled or app_state is None:
+                continue
+            #Only carry samples that are still within their interval
+            if bucket - app_state['last_bucket'] <= self.max_interval:
+                apps += 1
+                players += app_state['last_count']
+        return apps, players
+
+    def save(self, connector):
+        """
+        Upsert the state of every app that changed since the last save
+
+        Parameters
+        ----------
+        connector : A connector to MySQL server
+
+        Returns
+        -------
+        None
+
+        """
+        if not self._changed:
+            return
+
+        rows = [[app_id, self.state[app_id]['next_bucket'],
+                 self.state[app_id]['interval'],
+                 self.state[app_id]['last_bucket'],
+                 self.state[app_id]['last_count'],
+                 self.state[app_id]['ewma'], self.state[app_id]['ewvar']]
+                for app_id in self._changed]
+
+        cursor = connector.cursor()
+        cursor.executemany("""
+                           INSERT INTO poll_schedule
+                           (app_id, next_bucket, interval_cycles,
+                            last_bucket, last_count, ewma, ewvar)
+                           VALUES (%s, %s, %s, %s, %s, %s, %s)
+                           ON DUPLICATE KEY UPDATE
+                               next_bucket = VALUES(next_bucket),
+                               interval_cycles = VALUES(interval_cycles),
+                               last_bucket = VALUES(last_bucket),
+                               last_count = VALUES(last_count),
+                               ewma = VALUES(ewma),
+                               ewvar = VALUES(ewvar);
+                           """, rows)
+        connector.commit()
+        cursor.close()
+
+        self._changed.clear()
+
+        return
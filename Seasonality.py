@@ -0,0 +1,477 @@
+# -*- coding: utf-8 -*-
+"""
+Seasonality cubes of player counts by weekday and hour.
+
+For every app and every tag, the average and peak players of each hour of
+the week are kept as arrays of 168 values, Monday 00:00 being the first.
+They are updated as player counts are inserted. A tag's players in a cycle
+are the sum over its apps, so its cube describes the whole tag and not a
+typical game. Each cube is packed into a blob of under 3 KB in
+app_seasonality or tag_seasonality, next to its peak hour. When a game or
+tag peaks is then read from one small row instead of a scan of the
+history.
+
+A cycle is only added to the cube once a later cycle arrives, since samples
+of one cycle can come in several inserts. Changed cubes are written every
+save_interval seconds rather than every cycle, since a catalog's worth of
+cubes is over 100 MB.
+"""
+
+import argparse
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+
+from Analytics import BUCKET_SECONDS, HOURS_PER_WEEK, hour_of_week
+
+#Positions of the scalars at the start of the packed state
+OPEN_BUCKET, OPEN_TOTAL = range(2)
+HEADER_LENGTH = 2
+
+#Names of the days, in the order of the cube's rows
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+
+
+class HourlyCube:
+    """
+    Sum, number and peak of the players seen in each hour of the week.
+
+    Parameters
+    ----------
+    state : Packed state from to_bytes, or None for a new cube
+
+    """
+
+    def __init__(self, state=None):
+        if state is None:
+            self.header = np.array([-1.0, 0.0])
+            self.sums = np.zeros(HOURS_PER_WEEK)
+            self.counts = np.zeros(HOURS_PER_WEEK, dtype=np.uint32)
+            self.peaks = np.zeros(HOURS_PER_WEEK, dtype=np.uint32)
+        else:
+            self.header = np.frombuffer(state, dtype=np.float64,
+                                        count=HEADER_LENGTH).copy()
+            offset = HEADER_LENGTH * 8
+            self.sums = np.frombuffer(state, dtype=np.float64,
+                                      count=HOURS_PER_WEEK,
+                                      offset=offset).copy()
+            offset += HOURS_PER_WEEK * 8
+            self.counts = np.frombuffer(state, dtype=np.uint32,
+                                        count=HOURS_PER_WEEK,
+                                        offset=offset).copy()
+            offset += HOURS_PER_WEEK * 4
+            self.peaks = np.frombuffer(state, dtype=np.uint32,
+                                       count=HOURS_PER_WEEK,
+                                       offset=offset).copy()
+
+    def to_bytes(self):
+        return (self.header.tobytes() + self.sums.tobytes()
+                + self.counts.tobytes() + self.peaks.tobytes())
+
+    @property
+    def open_bucket(self):
+        return int(self.header[OPEN_BUCKET])
+
+    def add(self, bucket, count, accumulate=False):
+        """
+        Add players seen in a cycle
+
+        Parameters
+        ----------
+        bucket : Bucket of the cycle
+        count : Players seen
+        accumulate : Whether players already seen in the same cycle are
+            added to, as for a tag, instead of replaced, as for an app
+
+        Returns
+        -------
+        False if the cycle is older than the open one and was ignored
+
+        """
+        header = self.header
+        if bucket < header[OPEN_BUCKET]:
+            return False
+
+        if bucket > header[OPEN_BUCKET]:
+            self.close()
+            header[OPEN_BUCKET] = bucket
+            header[OPEN_TOTAL] = 0
+        if accumulate:
+            header[OPEN_TOTAL] += count
+        else:
+            header[OPEN_TOTAL] = count
+
+        return True
+
+    def close(self):
+        """
+        Add the open cycle to the hour of the week it fell in
+        """
+        header = self.header
+        if header[OPEN_BUCKET] < 0:
+            return
+        slot = hour_of_week(int(header[OPEN_BUCKET]))
+        total = header[OPEN_TOTAL]
+        self.sums[slot] += total
+        self.counts[slot] += 1
+        self.peaks[slot] = max(self.peaks[slot], int(total))
+        header[OPEN_BUCKET] = -1
+        header[OPEN_TOTAL] = 0
+
+    def averages(self):
+        """
+        Average players of each hour of the week
+
+        Returns
+        -------
+        Array of 168 averages, NaN for hours never seen
+
+        """
+        with np.errstate(invalid='ignore', divide='ignore'):
+            return np.where(self.counts > 0, self.sums / self.counts, np.nan)
+
+    def peak(self):
+        """
+        Hour of the week with the highest average
+
+        Returns
+        -------
+        Tuple of (hour of the week, average), (None, None) if empty
+
+        """
+        averages = self.averages()
+        if np.isnan(averages).all():
+            return None, None
+        slot = int(np.nanargmax(averages))
+        return slot, float(averages[slot])
+
+
+#Function for the label of an hour of the week
+def slot_label(slot):
+    """
+    Function for naming an hour of the week, e.g. Sat 20:00
+
+    Parameters
+    ----------
+    slot : Hour of the week, Monday 00:00 being 0
+
+    Returns
+    -------
+    String label
+
+    """
+    return f'{WEEKDAYS[slot // 24]} {slot % 24:02d}:00'
+
+
+class SeasonalityEngine:
+    """
+    Keeps the HourlyCube of every app and tag and writes them to
+    app_seasonality and tag_seasonality. Use update as an insert hook of
+    player_counts_insert.
+
+    Parameters
+    ----------
+    tags : Whether tag cubes are kept. A tag's cube needs every one of its
+        apps in every cycle, so collectors that only poll some shards or
+        only the apps that are due keep app cubes only
+    tag_refresh : Seconds between reloads of the tags of each app
+    save_interval : Seconds between writes of the changed cubes. Samples
+        since the last write are lost from the cubes if the collector dies
+
+    """
+
+    def __init__(self, tags=True, tag_refresh=3600, save_interval=3600):
+        self.tags = tags
+        self.tag_refresh = tag_refresh
+        self.save_interval = save_interval
+        self.cubes = {'app': {}, 'tag': {}}
+        self.app_tags = {}
+        self.app_tags_loaded = None
+        self.dirty = {'app': set(), 'tag': set()}
+        self.last_save = time.monotonic()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config):
+        """
+        Build an engine from the data_fetch section of config.yaml
+
+        Parameters
+        ----------
+        config : Dict of the full config
+
+        Returns
+        -------
+        SeasonalityEngine
+
+        """
+        settings = config['data_fetch'].get('seasonality', {})
+        sharded = config['data_fetch'].get('sharding', {}).get('enabled',
+                                                               False)
+        #Apps that aren't due are carried forward in the cycle totals but
+        #have no samples to add to their tags
+        scheduled = config['data_fetch'].get('scheduling', {}).get('enabled',
+                                                                   False)
+        return cls(tags=not (sharded or scheduled),
+                   tag_refresh=settings.get('tag_refresh', 3600),
+                   save_interval=settings.get('save_interval', 3600))
+
+    def _load_tags(self, connector):
+        if (self.app_tags_loaded is not None
+                and time.monotonic() - self.app_tags_loaded
+                < self.tag_refresh):
+            return
+
+        cursor = connector.cursor()
+        cursor.execute('SELECT app_id, tag_id FROM game_tag;')
+        app_tags = {}
+        for app_id, tag_id in cursor:
+            app_tags.setdefault(app_id, []).append(tag_id)
+        cursor.close()
+
+        self.app_tags = app_tags
+        self.app_tags_loaded = time.monotonic()
+
+    def _load(self, connector, kind, ids):
+        #Only cubes we haven't seen since starting are read from the table
+        cubes = self.cubes[kind]
+        missing = [key for key in ids if key not in cubes]
+        if not missing:
+            return
+
+        cursor = connector.cursor()
+        missing_str = ', '.join(str(int(key)) for key in missing)
+        cursor.execute(f"""
+                       SELECT {kind}_id, state
+                       FROM {kind}_seasonality
+                       WHERE {kind}_id IN ({missing_str});
+                       """)
+        for key, state in cursor:
+            cubes[key] = HourlyCube(bytes(state))
+        cursor.close()
+
+        for key in missing:
+            if key not in cubes:
+                cubes[key] = HourlyCube()
+
+    def add(self, rows):
+        """
+        Add a batch of samples to the cubes already loaded
+
+        Parameters
+        ----------
+        rows : List of [app_id, timestamp, count, bucket]
+
+        Returns
+        -------
+        Dict of 'app' and 'tag' to the set of ids of changed cubes
+
+        """
+        changed = {'app': set(), 'tag': set()}
+        apps = self.cubes['app']
+        tags = self.cubes['tag']
+        for app_id, _, count, bucket in sorted(rows, key=lambda row: row[3]):
+            if not apps[app_id].add(bucket, count):
+                continue
+            changed['app'].add(app_id)
+            if self.tags:
+                for tag_id in self.app_tags.get(app_id, ()):
+                    tags[tag_id].add(bucket, count, accumulate=True)
+                    changed['tag'].add(tag_id)
+
+        return changed
+
+    def save(self, connector, changed):
+        """
+        Write changed cubes with their peak hour
+
+        Parameters
+        ----------
+        connector : A connector to MySQL server
+        changed : Dict from add
+
+        Returns
+        -------
+        None
+
+        """
+        cursor = connector.cursor()
+        for kind, ids in changed.items():
+            if not ids:
+                continue
+            values = []
+            for key in ids:
+                cube = self.cubes[kind][key]
+                slot, average = cube.peak()
+                values.append([key, max(cube.open_bucket, 0), slot, average,
+                               cube.to_bytes()])
+            cursor.executemany(f"""
+                               INSERT INTO {kind}_seasonality
+                               ({kind}_id, bucket, peak_slot, peak_average,
+                                state)
+                               VALUES (%s, %s, %s, %s, %s)
+                               ON DUPLICATE KEY UPDATE
+                                   bucket = VALUES(bucket),
+                                   peak_slot = VALUES(peak_slot),
+                                   peak_average = VALUES(peak_average),
+                                   state = VALUES(state);
+                               """, values)
+        connector.commit()
+        cursor.close()
+
+        return
+
+    def flush(self, connector):
+        """
+        Write every cube changed since the last write
+
+        Parameters
+        ----------
+        connector : A connector to MySQL server
+
+        Returns
+        -------
+        None
+
+        """
+        with self._lock:
+            self._flush(connector)
+
+        return
+
+    def _flush(self, connector):
+        self.save(connector, self.dirty)
+        self.dirty = {'app': set(), 'tag': set()}
+        self.last_save = time.monotonic()
+
+    def update(self, rows, connector):
+        """
+        Add a batch of inserted samples to the cubes of their apps and tags,
+        writing the changed cubes once save_interval has passed since the
+        last write. Samples older than a cube's open cycle are ignored, so
+        replaying a spool doesn't count samples twice.
+
+        Parameters
+        ----------
+        rows : List of [app_id, timestamp, count, bucket]
+        connector : A connector to MySQL server
+
+        Returns
+        -------
+        None
+
+        """
+        if not rows:
+            return
+
+        with self._lock:
+            app_ids = {row[0] for row in rows}
+            self._load(connector, 'app', app_ids)
+            if self.tags:
+                self._load_tags(connector)
+                self._load(connector, 'tag', {tag_id for app_id in app_ids
+                                              for tag_id in self.app_tags.get(
+                                                  app_id, ())})
+
+            for kind, ids in self.add(rows).items():
+                self.dirty[kind] |= ids
+
+            if time.monotonic() - self.last_save >= self.save_interval:
+                self._flush(connector)
+
+        return
+
+    def rebuild(self, connector, days=None):
+        """
+        Replace every cube with one built from the stored player counts, a
+        day at a time. The collector should be stopped while this runs.
+
+        Parameters
+        ----------
+        connector : A connector to MySQL server
+        days : Only use the last this many days, None for all
+
+        Returns
+        -------
+        Number of samples added
+
+        """
+        cursor = connector.cursor()
+        cursor.execute('SELECT MIN(timestamp), MAX(timestamp) '
+                       'FROM player_count;')
+        first, last = cursor.fetchone()
+        cursor.execute('DELETE FROM app_seasonality;')
+        cursor.execute('DELETE FROM tag_seasonality;')
+        connector.commit()
+        if first is None:
+            cursor.close()
+            return 0
+
+        self.cubes = {'app': {}, 'tag': {}}
+        self.dirty = {'app': set(), 'tag': set()}
+        self.app_tags_loaded = None
+        if self.tags:
+            self._load_tags(connector)
+            for tag_ids in self.app_tags.values():
+                for tag_id in tag_ids:
+                    self.cubes['tag'].setdefault(tag_id, HourlyCube())
+
+        day = first.replace(hour=0, minute=0, second=0, microsecond=0)
+        if days is not None:
+            day = max(day, last.replace(hour=0, minute=0, second=0,
+                                        microsecond=0) - timedelta(days=days))
+
+        #Samples from before cycles were recorded get the bucket of their
+        #timestamp, read as UTC like DataFetch.time_to_bucket
+        query = f"""
+            SELECT app_id, timestamp, count,
+            COALESCE(cycle_bucket, TIMESTAMPDIFF(
+                SECOND, '1970-01-01', timestamp) DIV {BUCKET_SECONDS})
+            FROM player_count
+            WHERE timestamp >= %s AND timestamp < %s;
+        """
+        changed = {'app': set(), 'tag': set()}
+        added = 0
+        while day <= last:
+            following = day + timedelta(days=1)
+            cursor.execute(query, (day, following))
+            rows = [[app_id, timestamp, count, int(bucket)]
+                    for app_id, timestamp, count, bucket in cursor.fetchall()]
+            for app_id in {row[0] for row in rows}:
+                self.cubes['app'].setdefault(app_id, HourlyCube())
+            for kind, ids in self.add(rows).items():
+                changed[kind] |= ids
+            added += len(rows)
+            day = following
+        cursor.close()
+
+        self.save(connector, changed)
+
+        return added
+
+
+if __name__ == '__main__':
+
+    import yaml
+
+    from DataFetch import setup_database
+
+    parser = argparse.ArgumentParser(
+        description='Rebuild the seasonality cubes from stored player counts')
+    parser.add_argument('--days', type=int,
+                        help='Only use the last this many days')
+    args = parser.parse_args()
+
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    cnx = setup_database(
+        config['mysql_credentials'],
+        migrations=config.get('database', {}).get('migrations'))
+    start = time.perf_counter()
+    added = SeasonalityEngine.from_config(config).rebuild(cnx, args.days)
+    print(f'Rebuilt seasonality from {added:,} samples in '
+          f'{time.perf_counter() - start:.1f}s')
+    cnx.close()
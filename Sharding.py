@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""
+Lease-based work assignment for running several DataFetch.py collectors.
+
+App ids are split into a fixed number of shards by MOD(app_id, num_shards).
+Each collector registers itself with a heartbeat in the collector_worker
+table, claims time-limited leases on a fair share of the shards in the
+collector_lease table and only polls apps in its own shards. The fair share
+is counted from the registered workers, so a collector that starts while
+another holds every shard gets its share once the other renews and gives
+the extra shards back. Heartbeats and leases are renewed every cycle; when
+a worker dies they expire and the remaining workers pick up its shards on
+their next cycle.
+"""
+
+import math
+import os
+import socket
+
+
+#Function for getting a name for this worker
+def worker_identity(config):
+    """
+    Function for getting the id this collector uses on its leases
+
+    Parameters
+    ----------
+    config : Dict of the full config
+
+    Returns
+    -------
+    String worker id, from the config if set otherwise hostname-pid
+
+    """
+    worker_id = config['data_fetch'].get('sharding', {}).get('worker_id')
+    if worker_id:
+        return str(worker_id)
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+#Function for making sure every shard has a lease row
+def ensure_shards(connector, num_shards):
+    """
+    Function for inserting a lease row for each shard if it does not exist
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    num_shards : Number of shards app ids are split into
+
+    Returns
+    -------
+    None
+
+    """
+    cursor = connector.cursor()
+    cursor.executemany("""
+                       INSERT IGNORE INTO collector_lease(shard_id)
+                       VALUES (%s)
+                       """, [[shard] for shard in range(num_shards)])
+    connector.commit()
+    cursor.close()
+
+    return
+
+
+#Function for claiming and renewing our share of the shards
+def claim_shards(connector, worker_id, num_shards, lease_seconds):
+    """
+    Function for renewing this worker's leases and claiming free or expired
+    shards until it holds its fair share. Shards held above the fair share
+    are released so that newly started workers can claim them.
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    worker_id : Id of this worker
+    num_shards : Number of shards app ids are split into
+    lease_seconds : How long a claimed lease is valid for
+
+    Returns
+    -------
+    Sorted list of shard ids this worker holds
+
+    """
+    cursor = connector.cursor()
+
+    #Register ourselves so other workers count us in their fair share
+    cursor.execute("""
+                   INSERT INTO collector_worker(worker_id, heartbeat_expires)
+                   VALUES (%s, NOW() + INTERVAL %s SECOND)
+                   ON DUPLICATE KEY UPDATE
+                   heartbeat_expires = VALUES(heartbeat_expires);
+                   """, (worker_id, lease_seconds))
+
+    #Renew the leases we still hold
+    cursor.execute("""
+                   UPDATE collector_lease
+                   SET lease_expires = NOW() + INTERVAL %s SECOND
+                   WHERE worker_id = %s AND lease_expires >= NOW();
+                   """, (lease_seconds, worker_id))
+    connector.commit()
+
+    #Our fair share depends on how many workers are alive, whether or not
+    #they hold any shards yet
+    cursor.execute("""
+                   SELECT COUNT(*)
+                   FROM collector_worker
+                   WHERE heartbeat_expires >= NOW() AND worker_id <> %s;
+                   """, (worker_id,))
+    workers = cursor.fetchone()[0] + 1
+    target = math.ceil(num_shards / workers)
+
+    cursor.execute("""
+                   SELECT shard_id
+                   FROM collector_lease
+                   WHERE worker_id = %s AND lease_expires >= NOW()
+                   ORDER BY shard_id;
+                   """, (worker_id,))
+    owned = [row[0] for row in cursor.fetchall()]
+
+    #Give back shards above our share
+    for shard in owned[target:]:
+        cursor.execute("""
+                       UPDATE collector_lease
+                       SET worker_id = NULL, lease_expires = NULL
+                       WHERE shard_id = %s AND worker_id = %s;
+                       """, (shard, worker_id))
+    owned = owned[:target]
+
+    #Try to claim free or expired shards until we hold our share. The
+    #conditional update makes sure only one worker wins each shard.
+    if len(owned) < target:
+        cursor.execute("""
+                       SELECT shard_id
+                       FROM collector_lease
+                       WHERE shard_id < %s
+                       AND (worker_id IS NULL OR lease_expires < NOW())
+                       ORDER BY shard_id;
+                       """, (num_shards,))
+        free = [row[0] for row in cursor.fetchall()]
+
+        for shard in free:
+            if len(owned) >= target:
+                break
+            cursor.execute("""
+                           UPDATE collector_lease
+                           SET worker_id = %s,
+                           lease_expires = NOW() + INTERVAL %s SECOND
+                           WHERE shard_id = %s
+                           AND (worker_id IS NULL OR lease_expires < NOW());
+                           """, (worker_id, lease_seconds, shard))
+            if cursor.rowcount == 1:
+                owned.append(shard)
+
+    connector.commit()
+    cursor.close()
+
+    return sorted(owned)
+
+
+#Function for giving up all of our leases
+def release_shards(connector, worker_id):
+    """
+    Function for releasing every lease held by this worker and removing its
+    heartbeat, used on a clean shutdown so other workers do not have to wait
+    for them to expire
+
+    Parameters
+    ----------
+    connector : A connector to MySQL server
+    worker_id : Id of this worker
+
+    Returns
+    -------
+    None
+
+    """
+    cursor = connector.cursor()
+    cursor.execute("""
+                   UPDATE collector_lease
+                   SET worker_id = NULL, lease_expires = NULL
+                   WHERE worker_id = %s;
+                   """, (worker_id,))
+    cursor.execute("""
+                   DELETE FROM collector_worker
+                   WHERE worker_id = %s;
+                   """, (worker_id,))
+    connector.commit()
+    cursor.close()
+
+    return
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Single-flight coalescing of identical dashboard queries.
+
+When several callbacks ask for the same data at the same time, e.g. every
+open page right after a refresh, only the first runs the query. The others
+wait for it and get the same result, so a burst of N viewers costs one
+query instead of N. Nothing is cached: once the query returns, the next
+call runs it again.
+
+Results are shared between the callers, so they must not be modified in
+place.
+"""
+
+import threading
+from functools import wraps
+
+import pandas as pd
+
+
+#Function for turning call arguments into a hashable key
+def normalize(value):
+    """
+    Function for normalizing an argument so that equal queries give equal
+    keys, e.g. the same apps in a different order
+
+    Parameters
+    ----------
+    value : Any argument of a coalesced function
+
+    Returns
+    -------
+    Hashable normalized value
+
+    """
+    if isinstance(value, (list, tuple, set, frozenset)):
+        items = [normalize(item) for item in value]
+        try:
+            return tuple(sorted(items))
+        except TypeError:
+            return tuple(items)
+    if isinstance(value, dict):
+        return tuple(sorted((key, normalize(item))
+                            for key, item in value.items()))
+    if isinstance(value, (pd.Timestamp, pd.Timedelta)):
+        return value.isoformat()
+    return value
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls with the same key into one execution.
+    """
+
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def do(self, key, fn):
+        """
+        Run fn, or wait for the call of the same key that is already
+        running and return its result
+
+        Parameters
+        ----------
+        key : Hashable key of the query
+        fn : Function with no arguments running the query
+
+        Returns
+        -------
+        Result of fn, shared with every caller of the same key. Errors are
+        raised to every caller too.
+
+        """
+        name = key[0] if isinstance(key, tuple) else key
+        with self._lock:
+            stats = self._stats.setdefault(name, {'executions': 0,
+                                                  'coalesced': 0})
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                stats['executions'] += 1
+            else:
+                stats['coalesced'] += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except Exception as error:
+            call.error = error
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+
+    def coalesce(self, fn):
+        """
+        Decorator coalescing concurrent calls of fn with equal normalized
+        arguments
+
+        Parameters
+        ----------
+        fn : Data access function
+
+        Returns
+        -------
+        Wrapped function
+
+        """
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            key = (fn.__name__, normalize(args), normalize(kwargs))
+            return self.do(key, lambda: fn(*args, **kwargs))
+
+        return wrapper
+
+    def stats(self):
+        """
+        Executions and coalesced calls of every function so far
+
+        Returns
+        -------
+        Dict of function name to dict of executions, coalesced and
+        in_flight
+
+        """
+        with self._lock:
+            in_flight = {}
+            for key in self._calls:
+                name = key[0] if isinstance(key, tuple) else key
+                in_flight[name] = in_flight.get(name, 0) + 1
+            return {name: {**stats, 'in_flight': in_flight.get(name, 0)}
+                    for name, stats in self._stats.items()}
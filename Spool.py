@@ -0,0 +1,359 @@
+# -*- coding: utf-8 -*-
+"""
+Durable local spool for player count samples.
+
+The collector appends every cycle's samples to an append-only file of
+fixed-width binary records before anything touches the database. A flusher
+thread bulk-loads the spool into MySQL in large batches and removes it once
+every batch has been committed, so collection never waits on the database
+and samples survive the database being down or the collector restarting.
+Each batch is committed in the same transaction as the spool's offset in
+spool_offset, so a batch is never loaded twice whenever the flush stops.
+"""
+
+import os
+import struct
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+
+
+#Header written at the start of every spool file: magic, version, record size
+HEADER = struct.Struct('<4sHH')
+MAGIC = b'STSP'
+VERSION = 1
+
+#One sample: app_id, bucket timestamp in epoch seconds, player count
+RECORD = struct.Struct('<IqI')
+
+#Format player_counts uses for its timestamps
+TIME_FORMAT = '%Y-%m-%d-%H:%M:%S'
+
+
+#Function for converting a sample to a binary record
+def pack_sample(sample):
+    """
+    Function for packing a player_counts sample into a fixed-width record
+
+    Parameters
+    ----------
+    sample : [app_id, timestamp string, player count]
+
+    Returns
+    -------
+    bytes of length RECORD.size
+
+    """
+    app_id, timestamp, count = sample
+    #Timestamps are naive local times, we store them as if they were UTC so
+    #they come back out unchanged
+    epoch = datetime.strptime(timestamp, TIME_FORMAT).replace(
+        tzinfo=timezone.utc).timestamp()
+    return RECORD.pack(int(app_id), int(epoch), int(count))
+
+
+#Function for converting a binary record back to a sample
+def unpack_sample(record):
+    """
+    Function for unpacking a fixed-width record into a player_counts sample
+
+    Parameters
+    ----------
+    record : bytes of length RECORD.size
+
+    Returns
+    -------
+    [app_id, timestamp string, player count]
+
+    """
+    app_id, epoch, count = RECORD.unpack(record)
+    timestamp = datetime.fromtimestamp(epoch, timezone.utc).strftime(
+        TIME_FORMAT)
+    return [app_id, timestamp, count]
+
+
+class SampleSpool:
+    """
+    Append-only write-ahead file of player count samples.
+
+    Appends go to path. Flushing renames path to path.flushing, so new
+    samples start a fresh file, and gives the renamed file a random token.
+    The file is loaded in batches, each committed together with its offset
+    in the spool_offset row of the token, and the offset is also kept in
+    path.offset. A flush interrupted by a crash resumes from the database's
+    offset, which is ahead of the local one if the crash came between the
+    commit and the local write.
+
+    Parameters
+    ----------
+    path : Path of the spool file
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.flushing_path = f'{path}.flushing'
+        self.offset_path = f'{path}.offset'
+        self._lock = threading.Lock()
+
+    def append(self, samples):
+        """
+        Append samples to the spool and fsync them to disk
+
+        Parameters
+        ----------
+        samples : List of [app_id, timestamp string, player count]
+
+        Returns
+        -------
+        None
+
+        """
+        if not samples:
+            return
+
+        data = b''.join(pack_sample(sample) for sample in samples)
+
+        with self._lock:
+            with open(self.path, 'ab') as file:
+                size = file.tell()
+                if size == 0:
+                    file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+                    size = HEADER.size
+
+                #Drop a record torn by a crash so appends stay aligned
+                torn = (size - HEADER.size) % RECORD.size
+                if torn:
+                    file.truncate(size - torn)
+                    file.seek(size - torn)
+
+                file.write(data)
+                file.flush()
+                os.fsync(file.fileno())
+
+        return
+
+    def pending(self):
+        """
+        Number of samples waiting to be flushed
+
+        Returns
+        -------
+        int
+
+        """
+        total = 0
+        with self._lock:
+            for path in (self.flushing_path, self.path):
+                if os.path.exists(path):
+                    total += max(os.path.getsize(path) - HEADER.size,
+                                 0) // RECORD.size
+            total -= self._read_progress()[1]
+        return max(total, 0)
+
+    def flush(self, connector, insert, batch_size=5000, on_commit=None):
+        """
+        Load everything in the spool into the database
+
+        Parameters
+        ----------
+        connector : A connector to MySQL server
+        insert : Function taking (samples, connector) that inserts a batch
+            without committing, i.e. player_counts_insert with commit=False
+        batch_size : Number of samples per insert and commit
+        on_commit : Function taking (samples, connector) called after a
+            batch is committed and its offset recorded. Its errors are
+            reported without failing the flush, since the batch can't be
+            loaded again.
+
+        Returns
+        -------
+        Number of samples flushed
+
+        """
+        flushed = 0
+
+        with self._lock:
+            #Rotate the live spool unless an earlier flush didn't finish
+            if not os.path.exists(self.flushing_path):
+                if not os.path.exists(self.path):
+                    return 0
+                os.replace(self.path, self.flushing_path)
+                self._write_progress(uuid.uuid4().hex, 0)
+
+            token, offset = self._read_progress()
+            if token is None:
+                token = uuid.uuid4().hex
+                self._write_progress(token, offset)
+
+        offset = max(offset, self._committed_offset(connector, token))
+
+        with open(self.flushing_path, 'rb') as file:
+            magic, version, record_size = HEADER.unpack(
+                file.read(HEADER.size))
+            if magic != MAGIC or record_size != RECORD.size:
+                raise ValueError(f'{self.flushing_path} is not a version '
+                                 f'{VERSION} spool file')
+
+            file.seek(HEADER.size + offset * RECORD.size)
+
+            while True:
+                #Only whole records, a torn record at the end is dropped
+                data = file.read(batch_size * RECORD.size)
+                data = data[:len(data) - len(data) % RECORD.size]
+                if not data:
+                    break
+
+                batch = [unpack_sample(data[i:i + RECORD.size])
+                         for i in range(0, len(data), RECORD.size)]
+                #The rows and the offset past them commit together
+                try:
+                    insert(batch, connector)
+                    self._record_offset(connector, token,
+                                        offset + len(batch))
+                    connector.commit()
+                except Exception:
+                    connector.rollback()
+                    raise
+
+                offset += len(batch)
+                flushed += len(batch)
+                self._write_progress(token, offset)
+
+                if on_commit is not None:
+                    try:
+                        on_commit(batch, connector)
+                    except Exception as error:
+                        print(f'\nSpooled batch committed but its follow-up '
+                              f'failed: {error!r}')
+
+        #Everything is committed so the file can go. If we stop before it
+        #is removed, the local offset is already at its end
+        cursor = connector.cursor()
+        cursor.execute('DELETE FROM spool_offset WHERE token = %s;',
+                       (token,))
+        connector.commit()
+        cursor.close()
+        with self._lock:
+            os.remove(self.flushing_path)
+            os.remove(self.offset_path)
+
+        return flushed
+
+    def _committed_offset(self, connector, token):
+        cursor = connector.cursor()
+        cursor.execute('SELECT committed FROM spool_offset WHERE token = %s;',
+                       (token,))
+        row = cursor.fetchone()
+        cursor.close()
+        return int(row[0]) if row else 0
+
+    def _record_offset(self, connector, token, offset):
+        cursor = connector.cursor()
+        cursor.execute("""
+                       INSERT INTO spool_offset (token, committed)
+                       VALUES (%s, %s)
+                       ON DUPLICATE KEY UPDATE committed = VALUES(committed);
+                       """, (token, offset))
+        cursor.close()
+
+    def _read_progress(self):
+        #Token and offset of the file being flushed, files from before
+        #tokens only hold the offset
+        if not os.path.exists(self.offset_path):
+            return None, 0
+        with open(self.offset_path, 'r') as file:
+            fields = file.read().split()
+        if len(fields) < 2:
+            return None, int(fields[0]) if fields else 0
+        return fields[0], int(fields[1])
+
+    def _write_progress(self, token, offset):
+        #Write then rename so the offset file is never half written
+        temp_path = f'{self.offset_path}.tmp'
+        with open(temp_path, 'w') as file:
+            file.write(f'{token} {offset}')
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_path, self.offset_path)
+
+
+class SpoolFlusher(threading.Thread):
+    """
+    Background thread that periodically flushes a spool into the database.
+    Database errors are reported and retried on the next interval; the
+    samples stay in the spool until they are committed.
+
+    Parameters
+    ----------
+    spool : The SampleSpool to flush
+    connect : Function with no arguments returning a MySQL connection
+    insert : Function taking (samples, connector) that inserts a batch
+        without committing
+    interval : Seconds between flushes
+    batch_size : Number of samples per insert and commit
+    on_commit : Function taking (samples, connector) run after each batch
+        is committed, see SampleSpool.flush
+
+    """
+
+    def __init__(self, spool, connect, insert, interval=30, batch_size=5000,
+                 on_commit=None):
+        super().__init__(name='spool-flusher', daemon=True)
+        self.spool = spool
+        self.connect = connect
+        self.insert = insert
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_commit = on_commit
+        self._stop_event = threading.Event()
+        self._wake = threading.Event()
+
+    def run(self):
+        while not self._stop_event.is_set():
+            self.flush_once()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def wake(self):
+        """Flush now instead of waiting for the interval"""
+        self._wake.set()
+
+    def stop(self):
+        """Stop flushing, waiting for a flush in progress to finish"""
+        self._stop_event.set()
+        self._wake.set()
+        if self.is_alive():
+            self.join()
+
+    def flush_once(self):
+        """
+        Flush the spool once
+
+        Returns
+        -------
+        Number of samples flushed, 0 if the database was unavailable
+
+        """
+        if self.spool.pending() == 0:
+            return 0
+
+        try:
+            connector = self.connect()
+        except Exception as error:
+            print(f'\nSpool flush skipped, database unavailable: {error}')
+            return 0
+
+        try:
+            start = time.perf_counter()
+            flushed = self.spool.flush(connector, self.insert,
+                                       self.batch_size, self.on_commit)
+            print(f'\nFlushed {flushed} spooled samples in '
+                  f'{time.perf_counter() - start:.1f}s')
+            return flushed
+        except Exception as error:
+            print(f'\nSpool flush failed, will retry: {error}')
+            return 0
+        finally:
+            connector.close()
@@ -0,0 +1,81 @@
+// Appends each collection cycle pushed by the server to the player count
+// chart, instead of every page reloading all the data on an interval. Only
+// active when live updates are enabled in config.yaml, in which case the
+// stream's route is written into #live-route.
+(function () {
+    function listen() {
+        var route = document.getElementById('live-route');
+        if (!route || !window.dash_clientside || !window.dash_clientside.set_props) {
+            setTimeout(listen, 500);
+            return;
+        }
+        if (!route.textContent || !window.EventSource) {
+            return;
+        }
+
+        var setProps = window.dash_clientside.set_props;
+        var source = new EventSource(route.textContent);
+        source.onmessage = function (message) {
+            var cycle = JSON.parse(message.data);
+
+            // The slider can reach the new cycle, the selection stays put
+            setProps('datetime_RangeSlider', {max: cycle.timestamp / 1000});
+            setProps('live-cycle', {data: cycle});
+
+            // Only a chart of the totals up to the latest cycle grows
+            var graph = document.querySelector('#player-count .js-plotly-plot');
+            if (graph && graph.layout && graph.layout.meta && graph.layout.meta.live) {
+                appendPoint(graph, cycle);
+            }
+        };
+    }
+
+    // Array types of the dtypes typed_array in Dashboard.py can send
+    var dtypes = {
+        f8: Float64Array, f4: Float32Array,
+        i4: Int32Array, u4: Uint32Array,
+        i2: Int16Array, u2: Uint16Array,
+        i1: Int8Array, u1: Uint8Array
+    };
+
+    // Decodes a base64 typed array spec ({dtype, bdata}) of little-endian
+    // values
+    function decode(spec) {
+        var binary = atob(spec.bdata);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new dtypes[spec.dtype](bytes.buffer);
+    }
+
+    function appendPoint(graph, cycle) {
+        var trace = graph.data[0];
+
+        // Plain arrays when binary_figures is off, the x values are then
+        // date strings
+        if (Array.isArray(trace.x)) {
+            var date = new Date(cycle.timestamp).toISOString();
+            Plotly.extendTraces(graph, {
+                x: [[date.slice(0, 19).replace('T', ' ')]],
+                y: [[cycle.count]]
+            }, [0]);
+            return;
+        }
+
+        // Typed array specs can't be extended, so they're swapped for
+        // arrays decoded from the spec the server sent
+        if (!ArrayBuffer.isView(trace.x)) {
+            Plotly.restyle(graph, {
+                x: [Float64Array.from(decode(trace.x))],
+                y: [Float64Array.from(decode(trace.y))]
+            }, [0]);
+        }
+        Plotly.extendTraces(graph, {
+            x: [Float64Array.of(cycle.timestamp)],
+            y: [Float64Array.of(cycle.count)]
+        }, [0]);
+    }
+
+    listen();
+})();
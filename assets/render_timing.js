@@ -0,0 +1,74 @@
+// Reports how long each graph takes to draw after its callback response
+// arrives. Only active when Dashboard.py's profiling is enabled, in which
+// case the report route is written into #render-timing-route.
+(function () {
+    var lastResponse = null;
+    var originalFetch = window.fetch;
+
+    // Note when Dash receives a callback response
+    window.fetch = function (resource, options) {
+        var request = originalFetch.apply(this, arguments);
+        if (String(resource.url || resource).indexOf('_dash-update-component') !== -1) {
+            request.then(function () { lastResponse = performance.now(); });
+        }
+        return request;
+    };
+
+    // Bytes per value of the dtypes typed_array in Dashboard.py can send
+    var itemSizes = {f8: 8, f4: 4, i4: 4, u4: 4, i2: 2, u2: 2, i1: 1, u1: 1};
+
+    // Length of a plain array, or of a base64 typed array spec
+    // ({dtype, bdata}) worked out from its size without decoding it
+    function pointCount(values) {
+        if (!values) {
+            return 0;
+        }
+        if (typeof values.length === 'number') {
+            return values.length;
+        }
+        if (typeof values.bdata === 'string' && itemSizes[values.dtype]) {
+            var padding = (values.bdata.match(/=*$/) || [''])[0].length;
+            var bytes = values.bdata.length / 4 * 3 - padding;
+            return Math.floor(bytes / itemSizes[values.dtype]);
+        }
+        return 0;
+    }
+
+    function report(graph) {
+        var route = document.getElementById('render-timing-route');
+        if (!route || !route.textContent || lastResponse === null) {
+            return;
+        }
+        var elapsed = performance.now() - lastResponse;
+
+        // Zooming and panning redraw too, those aren't callback renders
+        if (elapsed > 10000) {
+            return;
+        }
+        var points = 0;
+        (graph.data || []).forEach(function (trace) {
+            points += pointCount(trace.x);
+        });
+        var container = graph.parentElement.closest('[id]');
+        originalFetch(route.textContent.replace(/\/$/, '') + '/render', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({
+                graph: container ? container.id : 'unknown',
+                ms: elapsed,
+                points: points
+            })
+        });
+    }
+
+    // Graphs are created by Dash after load, so we look for new ones
+    setInterval(function () {
+        document.querySelectorAll('.js-plotly-plot').forEach(function (graph) {
+            if (!graph.on || graph.dataset.renderTimed) {
+                return;
+            }
+            graph.dataset.renderTimed = 'true';
+            graph.on('plotly_afterplot', function () { report(graph); });
+        });
+    }, 1000);
+})();
@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+"""
+Latency benchmark of the dashboard at several data sizes.
+
+For every scale, given as APPSxMONTHS, a synthetic database is generated
+with synthetic_data.py (and kept in benchmarks/data for later runs), then
+Dashboard.py is imported against it in a fresh process and every fetch_*
+function, figure builder and full callback is timed. The figure cache is
+disabled so every run does the full work. p50 and p95 are reported per
+scale, and can be saved as json and compared with an earlier run to catch
+regressions.
+
+Run from the repository root:
+    python benchmarks/bench_dashboard.py --scales 100x1 1000x3 5000x6 \
+        --output bench.json --baseline previous_bench.json
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+#So we can import the dashboard modules from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import synthetic_data
+
+
+#Function for timing a function
+def time_calls(fn, repeats):
+    """
+    Function for timing repeated calls of a function
+
+    Parameters
+    ----------
+    fn : Function with no arguments
+    repeats : Number of timed calls, after one untimed warm up call
+
+    Returns
+    -------
+    Dict of p50, p95 and max in milliseconds
+
+    """
+    fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append((time.perf_counter() - start) * 1000)
+    return {'p50': float(np.percentile(timings, 50)),
+            'p95': float(np.percentile(timings, 95)),
+            'max': float(np.max(timings))}
+
+
+#Function for running every case against one database
+def run_cases(repeats, days):
+    """
+    Function for timing the dashboard against the database in STEAM_DB_URL.
+    Runs in its own process since Dashboard.py loads its data on import.
+
+    Parameters
+    ----------
+    repeats : Number of timed calls per case
+    days : Days in the selected range, ending at the latest sample
+
+    Returns
+    -------
+    Dict of case name to timings
+
+    """
+    import pandas as pd
+    from plotly.io.json import to_json_plotly
+    from sqlalchemy import event
+    from sqlalchemy.engine import Engine
+
+    event.listen(Engine, 'connect', synthetic_data.register_functions)
+
+    os.chdir(ROOT)
+    import Dashboard as D
+    from FigureCache import FigureCache
+    from Jobs import Job
+
+    #Every run does the full work
+    D.figure_cache = FigureCache(0)
+
+    end = D.df['timestamp'].max()
+    start = max(end - pd.Timedelta(days=days), D.df['timestamp'].min())
+    value = [start.timestamp(), end.timestamp()]
+    version = end
+    valid_apps = D.return_valid_apps()
+
+    tiles = D.treemap_tiles(start, end, valid_apps)
+    top_app = tiles['name'].iloc[0]
+    top_app_id = [app_id for app_id, name in D.map_id_name.items()
+                  if name == top_app]
+    game_df = D.fetch_new_data(valid_apps=top_app_id)
+    tag_df = D.fetch_tag_data()
+    gainers, losers = D.fetch_movers(start, end, version)
+
+    def fresh_movers():
+        D.movers_index.update(index=None, version=None)
+        return D.fetch_movers(start, end, version)
+
+    #Full callbacks include the serialization Dash does on the way out
+    def callback(fn, *args):
+        return lambda: to_json_plotly(fn(Job('bench'), *args))
+
+    def content():
+        D.movers_index.update(index=None, version=None)
+        return callback(D.build_content, value)()
+
+    cases = {
+        'fetch_cycle_totals': D.fetch_cycle_totals,
+        'fetch_new_data(game)': lambda: D.fetch_new_data(
+            valid_apps=top_app_id),
+        'return_valid_apps': D.return_valid_apps,
+        'treemap_tiles': lambda: D.treemap_tiles(start, end, valid_apps),
+        'fetch_tag_data': D.fetch_tag_data,
+        'fetch_hourly_counts': lambda: D.fetch_hourly_counts(
+            start - (end - start), end),
+        'fetch_movers': fresh_movers,
+        'create_player_count_chart(total)': lambda: (
+            D.create_player_count_chart(D.df, 'Player Count Over Time')),
+        'create_player_count_chart(game)': lambda: (
+            D.create_player_count_chart(game_df, top_app)),
+        'create_treemap': lambda: D.create_treemap(tiles),
+        'create_bubble_plot': lambda: D.create_bubble_plot(tag_df),
+        'create_movers_chart': lambda: D.create_movers_chart(gainers,
+                                                             losers),
+        'callback:refresh_data': callback(D.refresh_data),
+        'callback:build_content': content,
+    }
+    if D.trends_enabled:
+        cases['fetch_trends'] = D.fetch_trends
+
+    return {name: time_calls(fn, repeats) for name, fn in cases.items()}
+
+
+#Function for printing a scale's results
+def report(scale, results, baseline=None):
+    """
+    Function for printing the timings of a scale, with the change in p50
+    against a baseline run if there is one
+
+    Parameters
+    ----------
+    scale : Name of the scale, e.g. 1000x3
+    results : Dict of case name to timings
+    baseline : Dict of case name to timings of an earlier run, or None
+
+    Returns
+    -------
+    None
+
+    """
+    print(f'\n{scale}')
+    print(f'{"case":<36}{"p50 ms":>10}{"p95 ms":>10}{"vs base":>10}')
+    for name, timing in results.items():
+        change = ''
+        if baseline and name in baseline:
+            change = f'{timing["p50"] / baseline[name]["p50"] - 1:+.0%}'
+        print(f'{name:<36}{timing["p50"]:>10.1f}{timing["p95"]:>10.1f}'
+              f'{change:>10}')
+
+    return
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--scales', nargs='+', default=['100x1', '1000x3'],
+                        help='Data sizes as APPSxMONTHS')
+    parser.add_argument('--repeats', type=int, default=5,
+                        help='Timed calls per case')
+    parser.add_argument('--days', type=float, default=7,
+                        help='Days in the selected range')
+    parser.add_argument('--interval', type=int, default=10,
+                        help='Minutes between synthetic samples')
+    parser.add_argument('--regenerate', action='store_true',
+                        help='Regenerate databases that already exist')
+    parser.add_argument('--output', help='Save the results as json')
+    parser.add_argument('--baseline', help='Json results to compare with')
+    #Used by the child processes
+    parser.add_argument('--run', help=argparse.SUPPRESS)
+    parser.add_argument('--result-file', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run:
+        with open(args.result_file, 'w') as file:
+            json.dump(run_cases(args.repeats, args.days), file)
+        sys.exit()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline, 'r') as file:
+            baseline = json.load(file)
+
+    all_results = {}
+    for scale in args.scales:
+        apps, months = scale.lower().split('x')
+        path = os.path.join(ROOT, 'benchmarks', 'data',
+                            f'steam_{scale}_{args.interval}min.sqlite')
+        if args.regenerate or not os.path.exists(path):
+            start = time.perf_counter()
+            rows = synthetic_data.generate(path, int(apps), float(months),
+                                           args.interval)
+            print(f'Generated {rows:,} player counts for {scale} in '
+                  f'{time.perf_counter() - start:.1f}s')
+
+        #Each scale in a fresh process, the dashboard loads data on import
+        with tempfile.NamedTemporaryFile(suffix='.json',
+                                         delete=False) as result_file:
+            result_path = result_file.name
+        env = dict(os.environ, STEAM_DB_URL=f'sqlite:///{path}')
+        subprocess.run([sys.executable, os.path.abspath(__file__),
+                        '--run', path, '--result-file', result_path,
+                        '--repeats', str(args.repeats),
+                        '--days', str(args.days)],
+                       env=env, check=True, stdout=subprocess.DEVNULL)
+        with open(result_path, 'r') as file:
+            all_results[scale] = json.load(file)
+        os.remove(result_path)
+
+        report(scale, all_results[scale], baseline.get(scale))
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(all_results, file, indent=2)
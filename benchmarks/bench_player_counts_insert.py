@@ -0,0 +1,129 @@
+# -*- coding: utf-8 -*-
+"""
+Benchmark of the player_counts_insert bulk load strategies.
+
+Loads the same synthetic cycle of player counts with each strategy (and each
+batch size for the values strategy) into a scratch database, steam_bench,
+and reports rows per second. Uses the credentials in config.yaml; the
+server needs local_infile enabled for the load_data strategy.
+
+Run from the repository root:
+    python benchmarks/bench_player_counts_insert.py --rows 50000
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime
+
+import yaml
+import mysql.connector as MSQL
+
+#So we can import DataFetch from the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from DataFetch import player_counts_insert
+
+
+#Function for creating the scratch database
+def setup_bench_database(credentials):
+    """
+    Function for creating steam_bench with empty copies of the tables the
+    insert path touches
+
+    Parameters
+    ----------
+    credentials : Dict of credentials from config.yaml
+
+    Returns
+    -------
+    MySQL connection to steam_bench
+
+    """
+    cnx = MSQL.connect(user=credentials['username'],
+                       password=credentials['password'],
+                       host=credentials['host'],
+                       allow_local_infile=True)
+    cursor = cnx.cursor()
+    cursor.execute('CREATE DATABASE IF NOT EXISTS steam_bench;')
+    cnx.database = 'steam_bench'
+    cursor.execute('DROP TABLE IF EXISTS player_count;')
+    cursor.execute('DROP TABLE IF EXISTS game_info;')
+    cursor.execute('CREATE TABLE game_info LIKE steam_db.game_info;')
+    cursor.execute('CREATE TABLE player_count LIKE steam_db.player_count;')
+    cnx.commit()
+    cursor.close()
+    return cnx
+
+
+#Function for timing one strategy
+def time_strategy(cnx, data, strategy, batch_size):
+    """
+    Function for timing one load of data with a strategy
+
+    Parameters
+    ----------
+    cnx : Connection to steam_bench
+    data : Rows to insert
+    strategy : Bulk load strategy passed to player_counts_insert
+    batch_size : Batch size passed to player_counts_insert
+
+    Returns
+    -------
+    Rows per second
+
+    """
+    cursor = cnx.cursor()
+    cursor.execute('TRUNCATE TABLE player_count;')
+    cursor.close()
+
+    start = time.perf_counter()
+    player_counts_insert(data, cnx, strategy=strategy, batch_size=batch_size)
+    elapsed = time.perf_counter() - start
+
+    return len(data) / elapsed
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=20000,
+                        help='Number of rows per load')
+    parser.add_argument('--batch-sizes', type=int, nargs='+',
+                        default=[100, 1000, 5000],
+                        help='Batch sizes tried with the values strategy')
+    parser.add_argument('--repeats', type=int, default=3,
+                        help='Loads per strategy, the best is reported')
+    args = parser.parse_args()
+
+    with open('config.yaml', 'r') as file:
+        config = yaml.safe_load(file)
+
+    cnx = setup_bench_database(config['mysql_credentials'])
+
+    #One row per app, as in a single cycle at catalog scale
+    cursor = cnx.cursor()
+    cursor.executemany("""
+                       INSERT INTO game_info
+                       (app_id, name, developer, rating, price)
+                       VALUES (%s, %s, '', 0, 0)
+                       """, [[app_id, f'App {app_id}']
+                             for app_id in range(args.rows)])
+    cnx.commit()
+    cursor.close()
+
+    timestamp = datetime.now().strftime('%Y-%m-%d-%H:%M:00')
+    data = [[app_id, timestamp, app_id % 5000] for app_id in range(args.rows)]
+
+    runs = [('executemany', None)]
+    runs += [('values', batch_size) for batch_size in args.batch_sizes]
+    runs += [('load_data', None)]
+
+    print(f'{"strategy":<12}{"batch size":>12}{"rows/s":>14}')
+    for strategy, batch_size in runs:
+        rate = max(time_strategy(cnx, data, strategy, batch_size)
+                   for _ in range(args.repeats))
+        print(f'{strategy:<12}{str(batch_size or "-"):>12}{rate:>14,.0f}')
+
+    cnx.close()
@@ -0,0 +1,364 @@
+# -*- coding: utf-8 -*-
+"""
+Synthetic steam_db for benchmarking the dashboard.
+
+Fills a SQLite file with the tables and views Dashboard.py reads: a catalog
+of apps with tags and genres, 10 minute player counts with a long-tailed
+popularity, a daily cycle peaking in each app's evening, busier weekends,
+slow drift, noise and the odd launch or update spike, plus the
+collection_cycle totals and app_trend scores the collector would keep.
+
+Run from the repository root:
+    python benchmarks/synthetic_data.py --apps 1000 --months 3 \
+        --output benchmarks/data/steam_1000x3.sqlite
+"""
+
+import argparse
+import os
+import sqlite3
+import time
+from datetime import datetime, timedelta
+
+import numpy as np
+
+
+#Length of a collection cycle's bucket in seconds, as in DataFetch
+BUCKET_SECONDS = 600
+
+TAGS = ['Action', 'Indie', 'Adventure', 'RPG', 'Strategy', 'Simulation',
+        'Casual', 'Multiplayer', 'Open World', 'Survival', 'Shooter', 'FPS',
+        'Puzzle', 'Roguelike', 'Co-op', 'Sandbox', 'Horror', 'Story Rich',
+        'Platformer', 'Racing', 'Sports', 'Anime', 'Pixel Graphics',
+        'Early Access', 'Free to Play', 'Singleplayer', 'MMO', 'Card Game',
+        'Tower Defense', 'Visual Novel', 'Crafting', 'Base Building',
+        'Competitive', 'Fantasy', 'Sci-fi', 'Stealth', 'Tactical',
+        'Turn-Based', 'Metroidvania', 'Battle Royale']
+
+GENRES = ['Action', 'Adventure', 'Casual', 'Indie', 'RPG', 'Simulation',
+          'Strategy', 'Sports', 'Racing', 'Massively Multiplayer',
+          'Free to Play', 'Early Access']
+
+#SQLite versions of the steam_db tables the dashboard reads, same columns
+#and the same indexes as the migrations in Migrations.py
+SCHEMA = """
+CREATE TABLE game_info(
+    app_id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    developer TEXT NOT NULL,
+    rating INTEGER NOT NULL,
+    price REAL NOT NULL
+    );
+CREATE TABLE player_count(
+    app_id INTEGER NOT NULL,
+    timestamp TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    cycle_bucket INTEGER
+    );
+CREATE INDEX player_count_app_id ON player_count(app_id);
+CREATE INDEX player_count_app_timestamp ON player_count(app_id, timestamp);
+CREATE INDEX player_count_timestamp ON player_count(timestamp);
+CREATE INDEX player_count_cycle_bucket ON player_count(cycle_bucket);
+CREATE TABLE genre(genre_id INTEGER PRIMARY KEY, genre TEXT NOT NULL);
+CREATE TABLE game_genre(app_id INTEGER NOT NULL, genre_id INTEGER,
+                        PRIMARY KEY(app_id, genre_id));
+CREATE TABLE tag(tag_id INTEGER PRIMARY KEY, tag TEXT NOT NULL);
+CREATE TABLE game_tag(app_id INTEGER NOT NULL, tag_id INTEGER NOT NULL,
+                      PRIMARY KEY(app_id, tag_id));
+CREATE TABLE collection_cycle(
+    bucket INTEGER PRIMARY KEY,
+    started_at TEXT NOT NULL,
+    finished_at TEXT,
+    shards_total INTEGER NOT NULL DEFAULT 1,
+    shards_sampled INTEGER NOT NULL DEFAULT 0,
+    workers_started INTEGER NOT NULL DEFAULT 0,
+    workers_finished INTEGER NOT NULL DEFAULT 0,
+    apps_expected INTEGER NOT NULL DEFAULT 0,
+    apps_sampled INTEGER NOT NULL DEFAULT 0,
+    apps_carried INTEGER NOT NULL DEFAULT 0,
+    total_players INTEGER NOT NULL DEFAULT 0
+    );
+CREATE TABLE app_trend(
+    app_id INTEGER PRIMARY KEY,
+    bucket INTEGER NOT NULL,
+    last_count INTEGER NOT NULL,
+    ewma_fast REAL NOT NULL,
+    ewma_slow REAL NOT NULL,
+    ew_std REAL NOT NULL,
+    rolling_mean REAL NOT NULL,
+    rolling_std REAL NOT NULL,
+    baseline REAL,
+    trend_score REAL NOT NULL,
+    anomaly_score REAL NOT NULL,
+    state BLOB NOT NULL
+    );
+CREATE INDEX app_trend_trend_score ON app_trend(trend_score);
+CREATE INDEX app_trend_anomaly_score ON app_trend(anomaly_score);
+CREATE TABLE app_seasonality(
+    app_id INTEGER PRIMARY KEY,
+    bucket INTEGER NOT NULL,
+    peak_slot INTEGER,
+    peak_average REAL,
+    state BLOB NOT NULL
+    );
+CREATE TABLE tag_seasonality(
+    tag_id INTEGER PRIMARY KEY,
+    bucket INTEGER NOT NULL,
+    peak_slot INTEGER,
+    peak_average REAL,
+    state BLOB NOT NULL
+    );
+CREATE VIEW player_count_by_game AS
+    SELECT game_info.app_id, game_info.name, player_count.timestamp,
+    player_count.count, player_count.cycle_bucket
+    FROM game_info
+    INNER JOIN player_count
+    ON game_info.app_id = player_count.app_id
+    WHERE player_count.timestamp >= date('now', '-6 months');
+CREATE VIEW complete_game_info AS
+    SELECT game_info.app_id, name, developer, rating, price, genre, tag
+    FROM game_info
+    INNER JOIN game_genre ON game_info.app_id = game_genre.app_id
+    INNER JOIN genre ON game_genre.genre_id = genre.genre_id
+    INNER JOIN game_tag ON game_info.app_id = game_tag.app_id
+    INNER JOIN tag ON game_tag.tag_id = tag.tag_id;
+"""
+
+
+#Function for adding the MySQL functions the dashboard uses to SQLite
+def register_functions(dbapi_connection, connection_record=None):
+    """
+    Function for registering MySQL's HOUR on a SQLite connection. SQLite
+    already has DATE. Usable as a SQLAlchemy connect event listener.
+
+    Parameters
+    ----------
+    dbapi_connection : sqlite3 connection, other connections are left alone
+    connection_record : Unused, passed by SQLAlchemy
+
+    Returns
+    -------
+    None
+
+    """
+    if isinstance(dbapi_connection, sqlite3.Connection):
+        dbapi_connection.create_function(
+            'HOUR', 1, lambda value: None if value is None
+            else int(str(value)[11:13]), deterministic=True)
+
+    return
+
+
+#Function for the player counts of one day
+def daily_counts(rng, base, peak_hour, drift, spikes, day_start, steps,
+                 interval):
+    """
+    Function for generating one day of player counts for every app
+
+    Parameters
+    ----------
+    rng : numpy Generator
+    base : Array of each app's typical player count
+    peak_hour : Array of the hour each app's players peak, in UTC
+    drift : Array of each app's current long term multiplier
+    spikes : Array of each app's current launch or update multiplier
+    day_start : datetime of the first sample
+    steps : Number of samples in the day
+    interval : Minutes between samples
+
+    Returns
+    -------
+    Array of shape (apps, steps) of player counts
+
+    """
+    hours = (np.arange(steps) * interval / 60)[None, :]
+
+    #Players follow the evening, about twice as many at the peak as at night
+    diurnal = 1 + 0.35 * np.cos(2 * np.pi * (hours - peak_hour[:, None]) / 24)
+    weekend = 1.15 if day_start.weekday() >= 5 else 1.0
+    noise = rng.lognormal(0, 0.05, size=(len(base), steps))
+
+    expected = (base * drift * spikes)[:, None] * diurnal * weekend * noise
+    #Small games are whole players coming and going
+    return rng.poisson(expected).astype(np.int64)
+
+
+#Function for filling a database
+def generate(path, apps, months, interval=10, seed=0, end=None):
+    """
+    Function for creating a synthetic steam_db in a SQLite file
+
+    Parameters
+    ----------
+    path : Path of the SQLite file, replaced if it exists
+    apps : Number of apps in the catalog
+    months : Months of history, ending at end
+    interval : Minutes between samples, a multiple of 10
+    seed : Seed of the random generator
+    end : datetime of the last sample, now if None
+
+    Returns
+    -------
+    Number of player count rows written
+
+    """
+    rng = np.random.default_rng(seed)
+    if os.path.exists(path):
+        os.remove(path)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+
+    con = sqlite3.connect(path)
+    con.execute('PRAGMA journal_mode = OFF;')
+    con.execute('PRAGMA synchronous = OFF;')
+    con.executescript(SCHEMA)
+
+    #Catalog with a long tail: a few huge games and many tiny ones
+    app_ids = np.sort(rng.choice(np.arange(10, apps * 20 + 10), size=apps,
+                                 replace=False))
+    ranks = rng.permutation(apps) + 1
+    base = 800_000 / ranks ** 1.2 + rng.lognormal(1.5, 1.0, size=apps)
+    peak_hour = (20 + rng.normal(0, 4, size=apps)) % 24
+
+    con.executemany('INSERT INTO game_info VALUES (?, ?, ?, ?, ?);', [
+        (int(app_id), f'Game {app_id}', f'Studio {app_id % 997}',
+         int(rng.integers(40, 100)), float(rng.choice([0, 4.99, 9.99, 19.99,
+                                                      29.99, 59.99])))
+        for app_id in app_ids])
+    con.executemany('INSERT INTO tag VALUES (?, ?);', enumerate(TAGS))
+    con.executemany('INSERT INTO genre VALUES (?, ?);', enumerate(GENRES))
+
+    #Five tags and one to three genres per app, popular ones more often
+    tag_weights = 1 / np.arange(1, len(TAGS) + 1)
+    genre_weights = 1 / np.arange(1, len(GENRES) + 1)
+    game_tags = []
+    game_genres = []
+    for app_id in app_ids:
+        for tag_id in rng.choice(len(TAGS), size=5, replace=False,
+                                 p=tag_weights / tag_weights.sum()):
+            game_tags.append((int(app_id), int(tag_id)))
+        for genre_id in rng.choice(len(GENRES), size=rng.integers(1, 4),
+                                   replace=False,
+                                   p=genre_weights / genre_weights.sum()):
+            game_genres.append((int(app_id), int(genre_id)))
+    con.executemany('INSERT INTO game_tag VALUES (?, ?);', game_tags)
+    con.executemany('INSERT INTO game_genre VALUES (?, ?);', game_genres)
+
+    if end is None:
+        end = datetime.now()
+    end = end.replace(second=0, microsecond=0,
+                      minute=end.minute - end.minute % interval)
+    start = (end - timedelta(days=round(months * 30.4))).replace(hour=0,
+                                                                 minute=0)
+    steps = 24 * 60 // interval
+
+    drift = np.ones(apps)
+    spikes = np.ones(apps)
+    recent = []
+    rows = 0
+    day_start = start
+    while day_start <= end:
+        #Slow random walk of each game's popularity, and the odd launch or
+        #big update tripling a game's players then fading over a few days
+        drift *= rng.lognormal(0, 0.02, size=apps)
+        spiking = rng.random(apps) < 0.002
+        spikes = 1 + (spikes - 1) * 0.6
+        spikes[spiking] = rng.uniform(2, 4, size=spiking.sum())
+
+        counts = daily_counts(rng, base, peak_hour, drift, spikes, day_start,
+                              steps, interval)
+        times = [day_start + timedelta(minutes=interval * step)
+                 for step in range(steps)]
+        keep = [step for step, t in enumerate(times) if t <= end]
+        counts = counts[:, keep]
+        times = [times[step] for step in keep]
+
+        #Naive times are treated as UTC, as DataFetch.time_to_bucket does
+        buckets = [int((t - datetime(1970, 1, 1)).total_seconds())
+                   // BUCKET_SECONDS for t in times]
+        stamps = [t.strftime('%Y-%m-%d %H:%M:%S') for t in times]
+
+        con.executemany('INSERT INTO player_count VALUES (?, ?, ?, ?);', (
+            (int(app_ids[i]), stamps[j], int(counts[i, j]), buckets[j])
+            for j in range(len(times)) for i in range(apps)))
+        con.executemany("""
+                        INSERT INTO collection_cycle
+                        VALUES (?, ?, ?, 1, 1, 1, 1, ?, ?, 0, ?);
+                        """, [(buckets[j], stamps[j], stamps[j], apps, apps,
+                               int(counts[:, j].sum()))
+                              for j in range(len(times))])
+        con.commit()
+
+        rows += counts.size
+        recent = (recent + [counts])[-2:]
+        day_start += timedelta(days=1)
+
+    write_trends(con, app_ids, np.concatenate(recent, axis=1),
+                 int((end - datetime(1970, 1, 1)).total_seconds())
+                 // BUCKET_SECONDS, interval)
+    con.close()
+
+    return rows
+
+
+#Function for the app_trend rows the collector would have kept
+def write_trends(con, app_ids, recent, bucket, interval):
+    """
+    Function for writing app_trend scores from the last samples of each
+    app. The packed state is left empty since the dashboard doesn't read it.
+
+    Parameters
+    ----------
+    con : sqlite3 connection
+    app_ids : Array of app ids
+    recent : Array of shape (apps, samples) of the latest player counts
+    bucket : Bucket of the last sample
+    interval : Minutes between samples
+
+    Returns
+    -------
+    None
+
+    """
+    window = recent[:, -36:].astype(float)
+    last = recent[:, -1].astype(float)
+    ewma_fast = recent[:, -(60 // interval):].mean(axis=1)
+    ewma_slow = recent[:, -(24 * 60 // interval):].mean(axis=1)
+    rolling_mean = window.mean(axis=1)
+    rolling_std = window.std(axis=1)
+    trend_score = (ewma_fast - ewma_slow) / np.maximum(ewma_slow, 100)
+    anomaly_score = (last - rolling_mean) / np.maximum(
+        rolling_std, np.sqrt(np.maximum(rolling_mean, 1)))
+
+    con.executemany("""
+                    INSERT INTO app_trend
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, NULL, ?, ?, x'');
+                    """, [(int(app_ids[i]), bucket, int(last[i]),
+                           float(ewma_fast[i]), float(ewma_slow[i]),
+                           float(rolling_std[i]), float(rolling_mean[i]),
+                           float(rolling_std[i]), float(trend_score[i]),
+                           float(anomaly_score[i]))
+                          for i in range(len(app_ids))])
+    con.commit()
+
+    return
+
+
+if __name__ == '__main__':
+
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--apps', type=int, default=1000,
+                        help='Number of apps in the catalog')
+    parser.add_argument('--months', type=float, default=3,
+                        help='Months of history')
+    parser.add_argument('--interval', type=int, default=10,
+                        help='Minutes between samples')
+    parser.add_argument('--seed', type=int, default=0,
+                        help='Seed of the random generator')
+    parser.add_argument('--output', default='benchmarks/data/steam.sqlite',
+                        help='SQLite file to create')
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    rows = generate(args.output, args.apps, args.months, args.interval,
+                    args.seed)
+    print(f'Wrote {rows:,} player counts of {args.apps:,} apps to '
+          f'{args.output} in {time.perf_counter() - start:.1f}s')
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+"""
+Shared fixtures for the tests. The modules under test live at the top of the
+repository, and the MySQL they talk to is stood in for by SQLite with the
+few MySQL-only bits of their SQL translated.
+"""
+
+import os
+import re
+import sqlite3
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+#MySQL spellings used by the modules and their SQLite equivalents
+TRANSLATIONS = [
+    (re.compile(r'NOW\(\) \+ INTERVAL %s SECOND'),
+     "datetime('now', '+' || %s || ' seconds')"),
+    (re.compile(r'NOW\(\)'), "datetime('now')"),
+    (re.compile(r'INSERT IGNORE'), 'INSERT OR IGNORE'),
+    (re.compile(r'ON DUPLICATE KEY UPDATE'), 'ON CONFLICT DO UPDATE SET'),
+    (re.compile(r'VALUES\((\w+)\)'), r'excluded.\1'),
+    (re.compile(r'steam_db\.'), ''),
+    (re.compile(r'%s'), '?'),
+]
+
+
+def translate(query):
+    for pattern, replacement in TRANSLATIONS:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+class SQLiteCursor:
+    """Cursor translating each query before running it on SQLite"""
+
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def execute(self, query, params=()):
+        self._cursor.execute(translate(query), params)
+
+    def executemany(self, query, rows):
+        self._cursor.executemany(translate(query), rows)
+
+    def fetchone(self):
+        return self._cursor.fetchone()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    @property
+    def rowcount(self):
+        return self._cursor.rowcount
+
+    def close(self):
+        self._cursor.close()
+
+
+class SQLiteConnector:
+    """Connector with the parts of the mysql-connector API the modules use"""
+
+    def __init__(self, path):
+        #Flusher threads open their own, and the fixture closes them all
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+
+    def cursor(self):
+        return SQLiteCursor(self._connection.cursor())
+
+    def commit(self):
+        self._connection.commit()
+
+    def rollback(self):
+        self._connection.rollback()
+
+    def close(self):
+        self._connection.close()
+
+
+@pytest.fixture
+def connect(tmp_path):
+    """Function opening a new connector to one SQLite database per test"""
+    path = str(tmp_path / 'steam_db.sqlite')
+    opened = []
+
+    def open_connector():
+        connector = SQLiteConnector(path)
+        opened.append(connector)
+        return connector
+
+    yield open_connector
+
+    for connector in opened:
+        connector.close()
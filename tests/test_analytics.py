@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Analytics.py
+"""
+
+from Analytics import TrendEngine
+
+
+def config():
+    return {'data_fetch': {'trends': {'enabled': True,
+                                      'save_interval': 3600}}}
+
+
+def saved(connector):
+    cursor = connector.cursor()
+    cursor.execute('SELECT app_id, last_count, length(state) FROM app_trend '
+                   'ORDER BY app_id;')
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def test_states_are_written_every_save_interval(connect, monkeypatch):
+    connector = connect()
+    cursor = connector.cursor()
+    cursor.execute("""
+                   CREATE TABLE app_trend(
+                       app_id INTEGER PRIMARY KEY,
+                       bucket INTEGER NOT NULL,
+                       last_count INTEGER NOT NULL,
+                       ewma_fast REAL NOT NULL,
+                       ewma_slow REAL NOT NULL,
+                       ew_std REAL NOT NULL,
+                       rolling_mean REAL NOT NULL,
+                       rolling_std REAL NOT NULL,
+                       baseline REAL,
+                       trend_score REAL NOT NULL,
+                       anomaly_score REAL NOT NULL,
+                       state BLOB NOT NULL
+                       );
+                   """)
+    cursor.close()
+
+    clock = [0.0]
+    monkeypatch.setattr('Analytics.time.monotonic', lambda: clock[0])
+    engine = TrendEngine.from_config(config())
+
+    #Cycles within the interval only write the scores
+    for bucket in range(100, 106):
+        engine.update([[10, None, 50 + bucket, bucket],
+                       [20, None, 5, bucket]], connector)
+        clock[0] += 600
+    assert saved(connector) == [(10, 155, 0), (20, 5, 0)]
+
+    #The first cycle after it writes every changed state once
+    engine.update([[10, None, 60, 106]], connector)
+    rows = saved(connector)
+    assert [row[:2] for row in rows] == [(10, 60), (20, 5)]
+    assert all(row[2] > 0 for row in rows)
+    assert engine.dirty == set()
+
+    #A restarted engine picks up where the written states left off
+    engine.update([[20, None, 7, 107]], connector)
+    engine.flush(connector)
+    restarted = TrendEngine.from_config(config())
+    restarted.update([[20, None, 9, 108]], connector)
+    engine.update([[20, None, 9, 108]], connector)
+    assert restarted.trends[20].to_bytes() == engine.trends[20].to_bytes()
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Backfill.py
+"""
+
+import pytest
+
+import Backfill
+
+
+def create_tables(connector):
+    cursor = connector.cursor()
+    cursor.execute("""
+                   CREATE TABLE game_info(
+                       app_id INTEGER PRIMARY KEY,
+                       name TEXT NOT NULL,
+                       developer TEXT NOT NULL,
+                       rating INTEGER NOT NULL,
+                       price REAL NOT NULL
+                       );
+                   """)
+    cursor.execute("""
+                   CREATE TABLE player_count(
+                       app_id INTEGER NOT NULL,
+                       timestamp TEXT NOT NULL,
+                       count INTEGER NOT NULL,
+                       cycle_bucket INTEGER
+                       );
+                   """)
+    cursor.execute("""
+                   CREATE TABLE collection_cycle(
+                       bucket INTEGER PRIMARY KEY
+                       );
+                   """)
+    cursor.execute("""
+                   CREATE TABLE backfill_chunk(
+                       source TEXT NOT NULL,
+                       start_byte INTEGER NOT NULL,
+                       end_byte INTEGER NOT NULL,
+                       rows_loaded INTEGER NOT NULL,
+                       loaded_at TEXT NOT NULL,
+                       PRIMARY KEY(source, start_byte)
+                       );
+                   """)
+    connector.commit()
+    cursor.close()
+
+
+def player_count(connector):
+    cursor = connector.cursor()
+    cursor.execute('SELECT app_id, timestamp, count FROM player_count '
+                   'ORDER BY timestamp, app_id;')
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def test_samples_already_collected_are_skipped(connect, tmp_path):
+    connector = connect()
+    create_tables(connector)
+    cursor = connector.cursor()
+    cursor.execute("INSERT INTO game_info VALUES (10, 'Counter-Strike', "
+                   "'Valve', 97, 9.99);")
+    #Collected before cycles were recorded, so there's no cycle to cut at
+    cursor.execute("INSERT INTO player_count VALUES "
+                   "(10, '2024-01-01 00:10:00', 500, NULL);")
+    connector.commit()
+    cursor.close()
+
+    dump = tmp_path / 'dump.csv'
+    dump.write_text('app_id,timestamp,count\n'
+                    '10,2024-01-01 00:00:00,400\n'
+                    '10,2024-01-01 00:09:00,450\n'
+                    '20,2024-01-01 00:10:00,30\n')
+    columns = {'app_id': 'app_id', 'timestamp': 'timestamp',
+               'count': 'count'}
+
+    assert Backfill.backfill(connector, [str(dump)], columns, workers=1) == 2
+    assert player_count(connector) == [
+        (10, '2024-01-01 00:00:00', 400),
+        (10, '2024-01-01 00:10:00', 500),
+        (20, '2024-01-01 00:10:00', 30)]
+
+    #The new app got a stub and a rerun loads nothing again
+    cursor = connector.cursor()
+    cursor.execute('SELECT name FROM game_info WHERE app_id = 20;')
+    assert cursor.fetchone() == ('App 20',)
+    cursor.close()
+    assert Backfill.backfill(connector, [str(dump)], columns, workers=1) == 0
+
+
+def test_json_arrays_are_refused(tmp_path):
+    array = tmp_path / 'dump.jsonl'
+    array.write_text('[{"app_id": 10, "timestamp": 0, "count": 1}]\n')
+    with pytest.raises(ValueError, match='json array'):
+        Backfill.file_format_of(str(array))
+
+    plain = tmp_path / 'dump.json'
+    plain.write_text('{"app_id": 10, "timestamp": 0, "count": 1}\n')
+    with pytest.raises(ValueError, match='json lines'):
+        Backfill.file_format_of(str(plain))
+    assert Backfill.file_format_of(str(plain), 'json') == 'json'
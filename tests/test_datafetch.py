@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for DataFetch.py
+"""
+
+import json
+import random
+
+import pytest
+
+import DataFetch
+
+
+DOCUMENT = json.dumps({
+    '10': {'appid': 10, 'name': 'Counter-Strike', 'price': '999',
+           'positive': 219171, 'negative': 5670, 'score': -1.5e-3},
+    '570': {'appid': 570, 'name': 'Dota 2 {"quoted": [1, 2]}',
+            'tags': {'MOBA': 21020, 'Free to Play': 14287},
+            'owners': None, 'active': True},
+    'unicode': 'Ελληνικά \\ ☃',
+    'empty': {},
+    'list': [1, 22, 333, [], [{}]],
+    'number': 123456789,
+    }, indent=1, ensure_ascii=False)
+
+
+#Function for cutting a document into chunks at random places
+def random_chunks(text, seed):
+    rng = random.Random(seed)
+    chunks = []
+    start = 0
+    while start < len(text):
+        end = start + rng.randint(0, 12)
+        chunks.append(text[start:end])
+        start = end
+    return chunks
+
+
+@pytest.mark.parametrize('seed', range(50))
+def test_iter_json_object_any_chunk_boundaries(seed):
+    chunks = random_chunks(DOCUMENT, seed)
+    assert list(DataFetch.iter_json_object(chunks)) == \
+        list(json.loads(DOCUMENT).items())
+
+
+def test_iter_json_object_single_characters():
+    assert list(DataFetch.iter_json_object(iter(DOCUMENT))) == \
+        list(json.loads(DOCUMENT).items())
+
+
+@pytest.mark.parametrize('text', ['', '[]', ' [ ] ', '"text"'])
+def test_iter_json_object_not_an_object(text):
+    assert list(DataFetch.iter_json_object([text])) == []
+
+
+def test_iter_json_object_truncated():
+    with pytest.raises(ValueError):
+        list(DataFetch.iter_json_object(random_chunks(DOCUMENT[:-20], 0)))
+
+
+def test_app_catalog_walks_pages_across_cycles(monkeypatch):
+    pages = {page: {str(page * 10 + i): {'name': f'App {page}-{i}'}
+                    for i in range(3)}
+             for page in range(3)}
+    requested = []
+    inserted = []
+
+    def stream_request(url, params=None, config=None):
+        requested.append(params['page'])
+        yield from pages.get(params['page'], {}).items()
+
+    monkeypatch.setattr(DataFetch, 'stream_request', stream_request)
+    monkeypatch.setattr(DataFetch, 'app_catalog_insert',
+                        lambda batch, connector: inserted.extend(batch))
+    monkeypatch.setattr(DataFetch.time, 'sleep', lambda seconds: None)
+    config = {'data_fetch': {'catalog': {'pages_per_cycle': 2}}}
+
+    #The first run walks every page up to the empty one
+    DataFetch.app_catalog(None, config, initial=True)
+    assert requested == [0, 1, 2, 3]
+    assert len(inserted) == 9
+
+    #Cycles then fetch two pages each and start over past the end
+    for _ in range(3):
+        DataFetch.app_catalog(None, config)
+    assert requested[4:] == [0, 1, 2, 3, 0, 1]
+
+
+def test_failing_insert_hook_keeps_the_commit(connect, monkeypatch):
+    connector = connect()
+    cursor = connector.cursor()
+    cursor.execute("""
+                   CREATE TABLE player_count(
+                       app_id INTEGER NOT NULL,
+                       timestamp TEXT NOT NULL,
+                       count INTEGER NOT NULL,
+                       cycle_bucket INTEGER
+                       );
+                   """)
+    cursor.close()
+    seen = []
+
+    def failing_hook(rows, cnx):
+        raise RuntimeError('hook failed')
+
+    #A failing hook is reported and the hooks after it still run
+    monkeypatch.setattr(DataFetch, 'insert_hooks',
+                        [failing_hook, lambda rows, cnx: seen.extend(rows)])
+    samples = [[app_id, '2024-03-01-12:00:00', app_id * 10]
+               for app_id in range(1, 26)]
+    DataFetch.player_counts_insert(samples, connector,
+                                   strategy='executemany')
+
+    cursor = connector.cursor()
+    cursor.execute('SELECT COUNT(*) FROM player_count;')
+    assert cursor.fetchone()[0] == 25
+    assert len(seen) == 25
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for LiveUpdates.py
+"""
+
+from LiveUpdates import LiveFeed
+
+
+def test_streams_are_capped_and_end_after_max_age():
+    feed = LiveFeed(lambda: [], heartbeat=0.01, max_subscribers=1,
+                    max_age=0.05)
+    first = feed.stream()
+    assert next(first) == 'retry: 10000\n\n'
+    assert feed.subscribers == 1
+
+    #A full feed tells the page when to try again and ends the stream
+    assert list(feed.stream()) == ['retry: 50\n\n']
+
+    #The open stream ends on its own and frees its place
+    assert set(first) == {': keepalive\n\n'}
+    assert feed.subscribers == 0
+
+
+def test_reconnecting_pages_get_the_events_they_missed():
+    feed = LiveFeed(lambda: [], heartbeat=0.01, max_age=0.02)
+    stream = feed.stream()
+    next(stream)
+    feed.broadcast({'count': 1})
+    message = next(stream)
+    stream.close()
+    last_event_id = message.split('\n')[0][len('id: '):]
+
+    feed.broadcast({'count': 2})
+    feed.broadcast({'count': 3})
+    events = [event for event in feed.stream(last_event_id)
+              if event.startswith('id: ')]
+    assert [event.split('data: ')[1] for event in events] == [
+        '{"count": 2}\n\n', '{"count": 3}\n\n']
+
+    #Ids from another process don't replay anything
+    assert not [event for event in feed.stream('other:1')
+                if event.startswith('id: ')]
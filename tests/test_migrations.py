@@ -0,0 +1,184 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Migrations.py
+"""
+
+from datetime import date
+
+import mysql.connector as MSQL
+import pytest
+from mysql.connector import errorcode
+
+import Migrations
+
+
+class FakeCursor:
+    def __init__(self, connector):
+        self.connector = connector
+        self.result = []
+
+    def execute(self, query, params=()):
+        query = ' '.join(query.split())
+        self.connector.queries.append(query)
+        self.result = self.connector.answer(query, params)
+
+    def fetchone(self):
+        return self.result[0] if self.result else None
+
+    def fetchall(self):
+        return self.result
+
+    def close(self):
+        pass
+
+
+class FakeConnector:
+    """Records every query and answers the ones migrate and its helpers
+    read from"""
+
+    def __init__(self, versions=None, lock=1, partitions=(), rows=True):
+        self.versions = versions
+        self.lock = lock
+        self.partitions = list(partitions)
+        self.rows = rows
+        self.queries = []
+        self.commits = 0
+
+    def cursor(self):
+        return FakeCursor(self)
+
+    def commit(self):
+        self.commits += 1
+
+    def answer(self, query, params):
+        if query.startswith('SELECT version FROM schema_version'):
+            if self.versions is None:
+                raise MSQL.Error(errno=errorcode.ER_NO_SUCH_TABLE)
+            return [(version,) for version in sorted(self.versions)]
+        if query.startswith('CREATE TABLE IF NOT EXISTS steam_db.schema'):
+            self.versions = self.versions or set()
+        if query.startswith('INSERT INTO schema_version'):
+            self.versions.add(params[0])
+        if query.startswith('SELECT 1 FROM steam_db.player_count'):
+            return [(1,)] if self.rows else []
+        if query.startswith('SELECT GET_LOCK'):
+            return [(self.lock,)]
+        if 'information_schema.PARTITIONS' in query:
+            return [(name,) for name in self.partitions]
+        if query.startswith('ALTER TABLE steam_db.player_count REORGANIZE'):
+            self.partitions = ['p202403', 'p202404', 'p202405', 'p202406',
+                               'pmax']
+        return []
+
+
+@pytest.fixture
+def migrations(monkeypatch):
+    applied = []
+    steps = []
+    for version, manual in [(1, False), (2, True), (3, False)]:
+        steps.append(Migrations.Migration(
+            version, f'Step {version}',
+            lambda connector, options, version=version:
+                applied.append(version),
+            manual=manual))
+    steps.append(Migrations.Migration(
+        4, 'Optional', lambda connector, options: applied.append(4),
+        option='optional'))
+    monkeypatch.setattr(Migrations, 'MIGRATIONS', steps)
+    return applied
+
+
+def test_migrate_runs_and_records_pending_migrations(migrations):
+    connector = FakeConnector()
+    assert Migrations.migrate(connector) == [1, 3]
+    assert migrations == [1, 3]
+    assert connector.versions == {1, 3}
+    assert connector.commits == 2
+    assert any('RELEASE_LOCK' in query for query in connector.queries)
+
+
+def test_migrate_is_one_query_when_current(migrations):
+    connector = FakeConnector(versions={1, 3})
+    assert Migrations.migrate(connector) == []
+    assert connector.queries == ['SELECT version FROM schema_version;']
+
+
+def test_manual_and_optional_migrations_run_when_asked(migrations):
+    connector = FakeConnector(versions={1, 3})
+    assert Migrations.migrate(connector, {'optional': True},
+                              manual=[2]) == [2, 4]
+    assert connector.versions == {1, 2, 3, 4}
+
+
+def test_migrations_are_manual_only_while_player_count_has_rows(
+        migrations, monkeypatch):
+    step = Migrations.Migration(
+        5, 'Rows', lambda connector, options: migrations.append(5),
+        manual=lambda connector: Migrations.table_has_rows(connector,
+                                                           'player_count'))
+    monkeypatch.setattr(Migrations, 'MIGRATIONS',
+                        Migrations.MIGRATIONS + [step])
+    assert Migrations.migrate(FakeConnector(versions={1, 3})) == []
+    assert Migrations.migrate(FakeConnector(versions={1, 3},
+                                            rows=False)) == [5]
+
+
+def test_setup_database_is_one_query_when_current(monkeypatch):
+    import DataFetch
+
+    versions = {step.version for step in Migrations.MIGRATIONS}
+    connector = FakeConnector(versions=versions - {3})
+    monkeypatch.setattr(DataFetch.MSQL, 'connect',
+                        lambda **credentials: connector)
+    DataFetch.setup_database({'username': '', 'password': '', 'host': ''})
+    assert connector.queries == ['SELECT version FROM schema_version;']
+
+    #Partitions are only looked at once player_count is partitioned
+    connector = FakeConnector(versions=versions, partitions=['p202403'])
+    DataFetch.setup_database({'username': '', 'password': '', 'host': ''})
+    assert len(connector.queries) == 2
+    assert 'information_schema.PARTITIONS' in connector.queries[1]
+
+
+def test_migrate_raises_when_the_lock_times_out(migrations):
+    connector = FakeConnector(lock=0)
+    with pytest.raises(RuntimeError):
+        Migrations.migrate(connector, lock_timeout=1)
+    assert migrations == []
+
+
+def test_month_partitions():
+    assert Migrations.month_partitions(date(2023, 11, 15),
+                                       date(2024, 1, 1)) == (
+        "PARTITION p202311 VALUES LESS THAN ('2023-12-01'), "
+        "PARTITION p202312 VALUES LESS THAN ('2024-01-01'), "
+        "PARTITION p202401 VALUES LESS THAN ('2024-02-01'), "
+        'PARTITION pmax VALUES LESS THAN (MAXVALUE)')
+
+
+class Today(date):
+    @classmethod
+    def today(cls):
+        return cls(2024, 3, 20)
+
+
+def test_ensure_partitions_adds_the_coming_months(monkeypatch):
+    monkeypatch.setattr(Migrations, 'date', Today)
+    connector = FakeConnector(partitions=['p202403', 'pmax'])
+    assert Migrations.ensure_partitions(connector, months_ahead=3) == 3
+    assert connector.queries[1] == (
+        'ALTER TABLE steam_db.player_count REORGANIZE PARTITION pmax INTO '
+        "(PARTITION p202404 VALUES LESS THAN ('2024-05-01'), "
+        "PARTITION p202405 VALUES LESS THAN ('2024-06-01'), "
+        "PARTITION p202406 VALUES LESS THAN ('2024-07-01'), "
+        'PARTITION pmax VALUES LESS THAN (MAXVALUE));')
+
+
+def test_ensure_partitions_leaves_current_and_unpartitioned_tables(
+        monkeypatch):
+    monkeypatch.setattr(Migrations, 'date', Today)
+    for partitions in [[], ['p202403', 'p202404', 'p202405', 'p202406',
+                            'pmax']]:
+        connector = FakeConnector(partitions=partitions)
+        assert Migrations.ensure_partitions(connector) == 0
+        assert len(connector.queries) == 1
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Movers.py
+"""
+
+import numpy as np
+import pandas as pd
+
+from Movers import MoversIndex
+
+
+START = pd.Timestamp('2024-03-01 00:00')
+
+
+#Hourly sums of three apps over two days, app 3 only on the second day
+def hourly_counts():
+    rows = []
+    for hour in range(48):
+        for app_id, players in [(1, 100 + hour), (2, 500 - 5 * hour)]:
+            rows.append((app_id, START + pd.Timedelta(hours=hour),
+                         players * 6, 6))
+        if hour >= 24:
+            rows.append((3, START + pd.Timedelta(hours=hour), 60, 6))
+    return pd.DataFrame(rows, columns=['app_id', 'hour', 'players',
+                                       'samples'])
+
+
+def test_window_average_matches_pandas():
+    hourly_df = hourly_counts()
+    index = MoversIndex(hourly_df)
+    start, end = START + pd.Timedelta(hours=5), START + pd.Timedelta(hours=30)
+    window = hourly_df[(hourly_df['hour'] >= start)
+                       & (hourly_df['hour'] <= end)].groupby('app_id').sum(
+                           numeric_only=True)
+    expected = window['players'] / window['samples']
+    np.testing.assert_allclose(index.window_average(start, end),
+                               expected.loc[index.app_ids].to_numpy())
+    assert index.player_prefix.dtype == np.float64
+    assert index.sample_prefix.dtype == np.int32
+
+
+def test_window_average_of_large_counts_over_a_long_range():
+    #A year of hourly sums of a million players sampled six times an hour,
+    #so the running totals pass 5e10, with small moves between windows
+    hours = pd.date_range(START, periods=24 * 365, freq='h')
+    rng = np.random.default_rng(0)
+    rows = []
+    for app_id in range(1, 6):
+        players = 1_000_000 * app_id + rng.integers(0, 100, len(hours))
+        rows.append(pd.DataFrame({'app_id': app_id, 'hour': hours,
+                                  'players': players * 6, 'samples': 6}))
+    hourly_df = pd.concat(rows, ignore_index=True)
+    index = MoversIndex(hourly_df)
+
+    for start, end in [(hours[-48], hours[-25]), (hours[-24], hours[-1]),
+                       (hours[100], hours[100])]:
+        window = hourly_df[(hourly_df['hour'] >= start)
+                           & (hourly_df['hour'] <= end)].groupby(
+                               'app_id').sum(numeric_only=True)
+        expected = (window['players'] / window['samples']).to_numpy()
+        np.testing.assert_allclose(index.window_average(start, end),
+                                   expected, rtol=0, atol=1e-6)
+
+
+def test_top_movers_only_indexes_the_apps_asked_for():
+    index = MoversIndex(hourly_counts(), app_ids=[1, 2])
+    assert list(index.app_ids) == [1, 2]
+    gainers, losers = index.top_movers(
+        (START, START + pd.Timedelta(hours=23)),
+        (START + pd.Timedelta(hours=24), START + pd.Timedelta(hours=47)))
+    assert list(gainers['app_id']) == [1]
+    assert list(losers['app_id']) == [2]
+    assert gainers['change'].iloc[0] == 24
+
+
+def test_covers_the_requested_range_not_the_data():
+    hourly_df = hourly_counts()
+    requested = (START - pd.Timedelta(days=1), START + pd.Timedelta(days=3))
+    index = MoversIndex(hourly_df, *requested)
+    assert index.covers(*requested)
+    assert not index.covers(requested[0] - pd.Timedelta(hours=1),
+                            requested[1])
+
+    #Data that starts late doesn't make the index miss its own range
+    late = MoversIndex(hourly_df[hourly_df['app_id'] == 3], *requested)
+    assert late.covers(*requested)
+    assert np.isnan(late.window_average(requested[0], requested[0])[0])
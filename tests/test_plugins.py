@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Plugins.py
+"""
+
+import pytest
+import requests
+
+import DataFetch
+import Plugins
+
+
+class CountingLimiter:
+    def __init__(self):
+        self.acquired = 0
+
+    def acquire(self):
+        self.acquired += 1
+
+
+class Response:
+    def __init__(self, ok):
+        self.ok = ok
+
+    def __bool__(self):
+        return self.ok
+
+    def json(self):
+        return {'response': {'player_count': 7}}
+
+
+def test_source_without_insert_is_rejected():
+    with pytest.raises(ValueError):
+        Plugins.SourcePlugin('no_insert', fetch=lambda row, cycle=None: row)
+
+
+def test_every_request_attempt_takes_the_limiter(monkeypatch):
+    responses = iter([ConnectionError('reset'), Response(False),
+                      Response(True)])
+
+    def get(url, params=None):
+        response = next(responses)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    monkeypatch.setattr(requests, 'get', get)
+    monkeypatch.setattr(DataFetch.time, 'sleep', lambda seconds: None)
+    limiter = CountingLimiter()
+
+    plugin = Plugins.SourcePlugin(
+        'retrying', host='api.example.com',
+        fetch=lambda row, cycle=None: DataFetch.get_request(
+            'https://api.example.com'),
+        insert=lambda data, connector: None)
+    results = Plugins.run_plugins([plugin], {'retrying': [[10]]}, None,
+                                  lambda host: limiter)
+
+    assert results['retrying'] == [{'response': {'player_count': 7}}]
+    assert limiter.acquired == 3
+
+
+def test_requests_outside_sources_are_not_limited(monkeypatch):
+    monkeypatch.setattr(requests, 'get',
+                        lambda url, params=None: Response(True))
+    Plugins.acquire_host()
+    assert DataFetch.get_request('https://api.example.com') is not None
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Seasonality.py
+"""
+
+from Seasonality import SeasonalityEngine
+
+
+def config(sharding=False, scheduling=False):
+    return {'data_fetch': {'seasonality': {'enabled': True,
+                                           'save_interval': 3600},
+                           'sharding': {'enabled': sharding},
+                           'scheduling': {'enabled': scheduling}}}
+
+
+def test_tag_cubes_only_without_sharding_or_scheduling():
+    assert SeasonalityEngine.from_config(config()).tags
+    assert not SeasonalityEngine.from_config(config(sharding=True)).tags
+    assert not SeasonalityEngine.from_config(config(scheduling=True)).tags
+
+
+def saved(connector):
+    cursor = connector.cursor()
+    cursor.execute('SELECT app_id, bucket FROM app_seasonality '
+                   'ORDER BY app_id;')
+    rows = cursor.fetchall()
+    cursor.close()
+    return rows
+
+
+def test_cubes_are_written_every_save_interval(connect, monkeypatch):
+    connector = connect()
+    cursor = connector.cursor()
+    cursor.execute("""
+                   CREATE TABLE app_seasonality(
+                       app_id INTEGER PRIMARY KEY,
+                       bucket INTEGER NOT NULL,
+                       peak_slot INTEGER,
+                       peak_average REAL,
+                       state BLOB NOT NULL
+                       );
+                   """)
+    cursor.close()
+
+    clock = [0.0]
+    monkeypatch.setattr('Seasonality.time.monotonic', lambda: clock[0])
+    engine = SeasonalityEngine.from_config(config(sharding=True))
+
+    #Cycles within the interval only change the cubes in memory
+    for bucket in range(100, 106):
+        engine.update([[10, None, 50, bucket], [20, None, 5, bucket]],
+                      connector)
+        clock[0] += 600
+    assert saved(connector) == []
+
+    #The first cycle after it writes every changed cube once
+    engine.update([[10, None, 50, 106]], connector)
+    assert saved(connector) == [(10, 106), (20, 105)]
+    assert engine.dirty == {'app': set(), 'tag': set()}
+
+    #And flushing writes whatever changed since
+    engine.update([[20, None, 5, 107]], connector)
+    engine.flush(connector)
+    assert saved(connector) == [(10, 106), (20, 107)]
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Sharding.py
+"""
+
+import Sharding
+
+
+NUM_SHARDS = 8
+LEASE_SECONDS = 300
+
+
+def create_tables(connector):
+    cursor = connector.cursor()
+    cursor.execute("""
+                   CREATE TABLE collector_lease(
+                       shard_id INTEGER PRIMARY KEY,
+                       worker_id TEXT,
+                       lease_expires TEXT
+                       );
+                   """)
+    cursor.execute("""
+                   CREATE TABLE collector_worker(
+                       worker_id TEXT PRIMARY KEY,
+                       heartbeat_expires TEXT NOT NULL
+                       );
+                   """)
+    connector.commit()
+    cursor.close()
+
+
+def test_two_workers_split_the_shards(connect):
+    first, second = connect(), connect()
+    create_tables(first)
+    Sharding.ensure_shards(first, NUM_SHARDS)
+
+    #Alone, the first worker takes every shard
+    owned = Sharding.claim_shards(first, 'first', NUM_SHARDS, LEASE_SECONDS)
+    assert owned == list(range(NUM_SHARDS))
+
+    #The second registers but every shard is held
+    assert Sharding.claim_shards(second, 'second', NUM_SHARDS,
+                                 LEASE_SECONDS) == []
+
+    #The first gives back what is above its share on its next renewal and
+    #the second claims it on its own
+    owned_first = Sharding.claim_shards(first, 'first', NUM_SHARDS,
+                                        LEASE_SECONDS)
+    owned_second = Sharding.claim_shards(second, 'second', NUM_SHARDS,
+                                         LEASE_SECONDS)
+    assert len(owned_first) == len(owned_second) == NUM_SHARDS // 2
+    assert sorted(owned_first + owned_second) == list(range(NUM_SHARDS))
+
+    #Further cycles keep the split
+    assert Sharding.claim_shards(first, 'first', NUM_SHARDS,
+                                 LEASE_SECONDS) == owned_first
+    assert Sharding.claim_shards(second, 'second', NUM_SHARDS,
+                                 LEASE_SECONDS) == owned_second
+
+
+def test_released_worker_hands_over_its_shards(connect):
+    first, second = connect(), connect()
+    create_tables(first)
+    Sharding.ensure_shards(first, NUM_SHARDS)
+
+    Sharding.claim_shards(first, 'first', NUM_SHARDS, LEASE_SECONDS)
+    Sharding.claim_shards(second, 'second', NUM_SHARDS, LEASE_SECONDS)
+    Sharding.claim_shards(first, 'first', NUM_SHARDS, LEASE_SECONDS)
+    Sharding.claim_shards(second, 'second', NUM_SHARDS, LEASE_SECONDS)
+
+    #Once the first shuts down the second is alone again
+    Sharding.release_shards(first, 'first')
+    assert Sharding.claim_shards(second, 'second', NUM_SHARDS,
+                                 LEASE_SECONDS) == list(range(NUM_SHARDS))
@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+Tests for Spool.py
+"""
+
+import threading
+
+import pytest
+
+import DataFetch
+from Spool import SampleSpool, SpoolFlusher
+
+
+def create_tables(connector):
+    cursor = connector.cursor()
+    cursor.execute("""
+                   CREATE TABLE player_count(
+                       app_id INTEGER NOT NULL,
+                       timestamp TEXT NOT NULL,
+                       count INTEGER NOT NULL,
+                       cycle_bucket INTEGER
+                       );
+                   """)
+    cursor.execute("""
+                   CREATE TABLE spool_offset(
+                       token TEXT PRIMARY KEY,
+                       committed INTEGER NOT NULL
+                       );
+                   """)
+    connector.commit()
+    cursor.close()
+
+
+def player_count(connector):
+    cursor = connector.cursor()
+    cursor.execute('SELECT app_id, timestamp, count FROM player_count '
+                   'ORDER BY app_id;')
+    rows = [list(row) for row in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+
+#Inserts the way the collector's flusher does, leaving the commit to flush
+def insert(data, connector):
+    DataFetch.player_counts_insert(data, connector, strategy='executemany',
+                                   hooks=False, commit=False)
+
+
+@pytest.fixture
+def samples():
+    return [[app_id, '2024-03-01-12:00:00', app_id * 10]
+            for app_id in range(1, 26)]
+
+
+@pytest.fixture
+def spool(tmp_path, samples):
+    spool = SampleSpool(str(tmp_path / 'player_counts.spool'))
+    spool.append(samples)
+    return spool
+
+
+def test_replay_after_failed_batch_loads_each_sample_once(connect, spool,
+                                                          samples):
+    connector = connect()
+    create_tables(connector)
+    batches = []
+
+    #The third batch fails partway through, before it is committed
+    def failing_insert(data, cnx):
+        batches.append(len(data))
+        if len(batches) == 3:
+            insert(data[:2], cnx)
+            raise ConnectionError('database went away')
+        insert(data, cnx)
+
+    with pytest.raises(ConnectionError):
+        spool.flush(connector, failing_insert, batch_size=10)
+    assert spool.pending() == 5
+    assert len(player_count(connector)) == 20
+
+    #The next flush carries on from the last committed batch
+    assert spool.flush(connector, insert, batch_size=10) == 5
+    assert spool.pending() == 0
+    assert [row[0] for row in player_count(connector)] == \
+        [sample[0] for sample in samples]
+
+
+def test_crash_between_commit_and_local_offset_does_not_replay(
+        connect, spool, samples, monkeypatch):
+    connector = connect()
+    create_tables(connector)
+    write_progress = spool._write_progress
+    writes = []
+
+    #The collector dies after the second batch commits but before the
+    #local offset file is updated
+    def dying_write(token, offset):
+        writes.append(offset)
+        if offset == 20:
+            raise SystemExit('killed')
+        write_progress(token, offset)
+
+    monkeypatch.setattr(spool, '_write_progress', dying_write)
+    with pytest.raises(SystemExit):
+        spool.flush(connector, insert, batch_size=10)
+    monkeypatch.setattr(spool, '_write_progress', write_progress)
+    assert spool.pending() == 15
+
+    #The database's offset is ahead of the local one and wins
+    assert spool.flush(connector, insert, batch_size=10) == 5
+    assert [row[0] for row in player_count(connector)] == \
+        [sample[0] for sample in samples]
+
+    #Nothing is left of the flushed file, here or in the database
+    cursor = connector.cursor()
+    cursor.execute('SELECT COUNT(*) FROM spool_offset;')
+    assert cursor.fetchone()[0] == 0
+    cursor.close()
+
+
+def test_failing_follow_up_does_not_replay(connect, spool, monkeypatch):
+    connector = connect()
+    create_tables(connector)
+    seen = []
+
+    def failing_hook(rows, cnx):
+        raise RuntimeError('hook failed')
+
+    monkeypatch.setattr(DataFetch, 'insert_hooks',
+                        [failing_hook, lambda rows, cnx: seen.extend(rows)])
+    on_commit = lambda data, cnx: DataFetch.run_insert_hooks(
+        DataFetch.player_count_rows(data), cnx)
+
+    #The hook failing neither fails the flush nor stops the other hooks
+    assert spool.flush(connector, insert, batch_size=10,
+                       on_commit=on_commit) == 25
+    assert spool.pending() == 0
+    assert len(seen) == 25
+    assert all(row[3] == seen[0][3] for row in seen)
+
+    #Nothing is left to load again
+    assert spool.flush(connector, insert, batch_size=10) == 0
+    assert len(player_count(connector)) == 25
+
+
+def test_stop_waits_for_the_flush_in_progress(connect, spool):
+    connector = connect()
+    create_tables(connector)
+    started = threading.Event()
+    release = threading.Event()
+
+    def slow_insert(data, cnx):
+        started.set()
+        release.wait(5)
+        insert(data, cnx)
+
+    #The flusher's connection is opened on its own thread
+    flusher = SpoolFlusher(spool, lambda: connect(), slow_insert,
+                           interval=60, batch_size=100)
+    flusher.start()
+    assert started.wait(5)
+    threading.Timer(0.2, release.set).start()
+    flusher.stop()
+
+    assert not flusher.is_alive()
+    assert spool.pending() == 0
+    assert len(player_count(connector)) == 25